@@ -0,0 +1,261 @@
+"""
+Cold storage for old audit rows.
+
+Rows are moved out of the AuditLog table into append-only, gzip-compressed
+JSONL segments. Every segment has a small JSON index next to it with its
+id and time range and a Bloom filter over its object ids, so searches
+only decompress the segments that can contain a match.
+"""
+import gzip
+import json
+import os
+from datetime import timezone
+from functools import cached_property
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from authcore.bloom import BloomFilter
+from .models import AuditLog
+from .serializer import ACTION_DISPLAY, MODEL_DISPLAY
+
+DEFAULTS = {
+    'DIR': 'audit_archive',
+    'RETENTION_DAYS': 90,
+    'SEGMENT_ROWS': 50000,
+}
+
+SEGMENT_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.idx.json'
+
+_timestamp_field = serializers.DateTimeField()
+
+
+def archive_setting(name):
+    return getattr(settings, 'AUDIT_ARCHIVE', {}).get(name, DEFAULTS[name])
+
+
+def iso_timestamp(value):
+    # fixed-width UTC timestamps compare correctly as strings
+    return value.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+def to_archive_row(row):
+    """
+    row: AuditLog values() dict, with user_email
+    """
+    return {
+        'id': row['id'],
+        'user': str(row['user']) if row['user'] else None,
+        'user_email': row.get('user_email'),
+        'model_name': row['model_name'],
+        'object_id': row['object_id'],
+        'action': row['action'],
+        'timestamp': iso_timestamp(row['timestamp']),
+        'changes': row['changes'],
+    }
+
+
+def to_representation(row):
+    """
+    renders an archived row exactly like AuditLogSerializer renders a live one
+    """
+    return {
+        'id': row['id'],
+        'user': row['user'],
+        'user_email': row['user_email'],
+        'model_name': row['model_name'],
+        'model_display': MODEL_DISPLAY.get(row['model_name'], row['model_name']),
+        'object_id': row['object_id'],
+        'action': row['action'],
+        'action_display': ACTION_DISPLAY.get(row['action'], row['action']),
+        'timestamp': _timestamp_field.to_representation(parse_datetime(row['timestamp'])),
+        'changes': row['changes'],
+    }
+
+
+def _write_atomic(path, data):
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+# directory -> (index file names, segments newest first), per process;
+# segments never change once written and their names carry their id range
+_loaded_segments = {}
+
+
+class Segment:
+
+    def __init__(self, directory, index):
+        self.directory = directory
+        self.index = index
+
+    @property
+    def path(self):
+        return self.directory / self.index['file']
+
+    @property
+    def index_name(self):
+        return self.index['file'][:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+    @cached_property
+    def objects(self):
+        # decoded on the first object_id lookup only
+        return BloomFilter.from_dict(self.index['object_ids'])
+
+    def may_contain(self, start=None, end=None, object_id=None, pk=None):
+        index = self.index
+        if start is not None and index['max_timestamp'] < iso_timestamp(start):
+            return False
+        if end is not None and index['min_timestamp'] > iso_timestamp(end):
+            return False
+        if pk is not None and not index['first_id'] <= pk <= index['last_id']:
+            return False
+        if object_id is not None and object_id not in self.objects:
+            return False
+        return True
+
+    def rows(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as fh:
+            for line in fh:
+                yield json.loads(line)
+
+
+class AuditArchive:
+
+    def __init__(self, directory=None):
+        directory = directory or archive_setting('DIR')
+        directory = Path(directory)
+        if not directory.is_absolute():
+            directory = Path(settings.BASE_DIR) / directory
+        self.directory = directory
+
+    def segments(self):
+        """
+        segments ordered newest first; indexes are parsed once per process,
+        a listing of the directory tells which ones are new
+        """
+        try:
+            names = frozenset(entry.name for entry in os.scandir(self.directory) if entry.name.endswith(INDEX_SUFFIX))
+        except FileNotFoundError:
+            return []
+        loaded = _loaded_segments.get(self.directory)
+        if loaded is None or loaded[0] != names:
+            known = {segment.index_name: segment for segment in loaded[1]} if loaded else {}
+            segments = [known.get(name) or self.load_segment(name) for name in names]
+            loaded = _loaded_segments[self.directory] = (
+                names, sorted(segments, key=lambda s: s.index['last_id'], reverse=True)
+            )
+        return list(loaded[1])
+
+    def load_segment(self, index_name):
+        with open(self.directory / index_name) as fh:
+            return Segment(self.directory, json.load(fh))
+
+    def write_segment(self, rows):
+        """
+        rows: archive rows ordered by id; returns the segment index
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        first_id, last_id = rows[0]['id'], rows[-1]['id']
+        name = f"segment-{first_id:012d}-{last_id:012d}"
+
+        objects = BloomFilter(len(rows))
+        objects.update(row['object_id'] for row in rows)
+        payload = '\n'.join(json.dumps(row, separators=(',', ':'), default=str) for row in rows) + '\n'
+        index = {
+            'file': name + SEGMENT_SUFFIX,
+            'count': len(rows),
+            'first_id': first_id,
+            'last_id': last_id,
+            'min_timestamp': min(row['timestamp'] for row in rows),
+            'max_timestamp': max(row['timestamp'] for row in rows),
+            'object_ids': objects.to_dict(),
+        }
+        # the segment only becomes visible once its index is in place
+        _write_atomic(self.directory / index['file'], gzip.compress(payload.encode('utf-8')))
+        _write_atomic(self.directory / (name + INDEX_SUFFIX), json.dumps(index).encode('utf-8'))
+        return index
+
+    def search(self, start=None, end=None, model_name=None, object_id=None, user=None, action=None,
+               pk=None, before=None):
+        """
+        yields matching archive rows, newest first
+        before: (timestamp, id) keyset position; only rows strictly older are returned
+        """
+        start_iso = iso_timestamp(start) if start else None
+        end_iso = iso_timestamp(end) if end else None
+        before = (iso_timestamp(before[0]), before[1]) if before else None
+        for segment in self.segments():
+            if not segment.may_contain(start, end, object_id, pk):
+                continue
+            if before is not None and segment.index['min_timestamp'] > before[0]:
+                continue
+            matches = []
+            for row in segment.rows():
+                if pk is not None and row['id'] != pk:
+                    continue
+                if before is not None and (row['timestamp'], row['id']) >= before:
+                    continue
+                if start_iso and row['timestamp'] < start_iso:
+                    continue
+                if end_iso and row['timestamp'] > end_iso:
+                    continue
+                if model_name and row['model_name'] != model_name:
+                    continue
+                if object_id and row['object_id'] != object_id:
+                    continue
+                if user and row['user'] != str(user):
+                    continue
+                if action and row['action'] != action:
+                    continue
+                matches.append(row)
+            matches.sort(key=lambda r: (r['timestamp'], r['id']), reverse=True)
+            yield from matches
+
+    def get(self, pk):
+        return next(self.search(pk=pk), None)
+
+
+def archive_before(cutoff, archive=None, segment_rows=None):
+    """
+    moves every AuditLog row older than cutoff into archive segments and
+    returns the number of rows moved
+    """
+    archive = archive or AuditArchive()
+    segment_rows = segment_rows or archive_setting('SEGMENT_ROWS')
+
+    # a run interrupted after writing a segment left its rows in the table;
+    # rows in that id range that were not archived are newer than the segment
+    latest = next(iter(archive.segments()), None)
+    if latest is not None:
+        AuditLog.objects.filter(
+            id__gte=latest.index['first_id'],
+            id__lte=latest.index['last_id'],
+            timestamp__lte=parse_datetime(latest.index['max_timestamp']),
+        ).delete()
+
+    moved = 0
+    while True:
+        rows = list(
+            AuditLog.objects.filter(timestamp__lt=cutoff).order_by('id').values(
+                'id', 'user', 'model_name', 'object_id', 'action', 'timestamp', 'changes',
+                user_email=F('user__email'),
+            )[:segment_rows]
+        )
+        if not rows:
+            return moved
+        index = archive.write_segment([to_archive_row(row) for row in rows])
+        with transaction.atomic():
+            AuditLog.objects.filter(
+                id__gte=index['first_id'], id__lte=index['last_id'], timestamp__lt=cutoff
+            ).delete()
+        moved += len(rows)
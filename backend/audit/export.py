@@ -0,0 +1,60 @@
+"""
+Streaming audit log export (NDJSON or CSV).
+
+Rows are read with a server-side iterator over values() and written one at
+a time, so memory stays flat whatever the size of the export.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from .serializer import VALUE_FIELDS, represent_values
+
+EXPORT_FIELDS = [
+    'id', 'user', 'user_email', 'model_name', 'model_display', 'object_id',
+    'action', 'action_display', 'timestamp', 'changes',
+]
+CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class _Echo:
+    """
+    file-like object whose write() returns the value, for csv.writer
+    """
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset, archived=None):
+    rows = queryset.values(*VALUE_FIELDS, user_email=F('user__email')).iterator(chunk_size=CHUNK_SIZE)
+    for row in rows:
+        yield represent_values(row, row['user_email'])
+    if archived is not None:
+        yield from archived
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        values = dict(row, changes=json.dumps(row['changes'], ensure_ascii=False, cls=DjangoJSONEncoder))
+        yield writer.writerow([values[field] if values[field] is not None else '' for field in EXPORT_FIELDS])
+
+
+def export_lines(export_format, rows):
+    if export_format == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from audit.archive import AuditArchive, archive_before, archive_setting
+
+
+class Command(BaseCommand):
+    help = "Move audit log rows older than the retention period into compressed archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help='defaults to AUDIT_ARCHIVE["RETENTION_DAYS"]')
+        parser.add_argument('--segment-rows', type=int, default=None,
+                            help='defaults to AUDIT_ARCHIVE["SEGMENT_ROWS"]')
+        parser.add_argument('--dir', default=None, help='defaults to AUDIT_ARCHIVE["DIR"]')
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        if days is None:
+            days = archive_setting('RETENTION_DAYS')
+        cutoff = timezone.now() - timedelta(days=days)
+        archive = AuditArchive(options['dir'])
+
+        moved = archive_before(cutoff, archive, options['segment_rows'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} audit rows older than {cutoff.isoformat()} into {archive.directory}"
+        ))
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 # Create your models here.
 
@@ -20,8 +21,17 @@ class AuditLog(models.Model):
     model_name = models.CharField(max_length=100)
     object_id = models.CharField(max_length=36) # UUID or register id
     action = models.CharField(max_length=10, choices=ACTION_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False) # set when the event happens, not when a buffered batch is written
     changes = models.JSONField(default=dict, blank=True) # Store changes as JSON
 
+    class Meta:
+        # every list query filters on one of these and pages on (timestamp, id)
+        indexes = [
+            models.Index(fields=['-timestamp', '-id'], name='audit_ts_id_idx'),
+            models.Index(fields=['user', '-timestamp', '-id'], name='audit_user_ts_idx'),
+            models.Index(fields=['model_name', 'object_id', '-timestamp', '-id'], name='audit_object_ts_idx'),
+            models.Index(fields=['action', '-timestamp', '-id'], name='audit_action_ts_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user} {self.action} {self.model_name} {self.object_id}"
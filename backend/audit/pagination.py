@@ -0,0 +1,103 @@
+import base64
+import heapq
+from itertools import islice
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .archive import iso_timestamp
+
+
+def _position(row):
+    timestamp = row['timestamp']
+    if not isinstance(timestamp, str):
+        timestamp = iso_timestamp(timestamp)
+    return (timestamp, row['id'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (timestamp, id), newest first.
+
+    Each page is a range scan on the composite index that starts right after
+    the last row of the previous page, so its cost does not depend on how deep
+    the client has paged. Opt-in: only requests with ?page_size= or ?cursor=
+    are paginated.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = 'Cursor inválido'
+
+    def encode_cursor(self, row):
+        timestamp, pk = _position(row)
+        return base64.urlsafe_b64encode(f"{timestamp}|{pk}".encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None:
+                raise ValueError
+            return timestamp, int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            timestamp, pk = cursor
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+        rows = list(queryset.order_by('-timestamp', '-id')[:page_size + 1])
+        archived = view.archived_rows(before=cursor) if view is not None and hasattr(view, 'archived_rows') else None
+        if archived is not None:
+            rows = list(islice(heapq.merge(rows, archived, key=_position, reverse=True), page_size + 1))
+
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.last_row = rows[-1] if rows else None
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or self.last_row is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_row))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
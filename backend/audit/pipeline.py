@@ -0,0 +1,220 @@
+"""
+Audit write pipeline.
+
+In "sync" mode (the default) every event is inserted right away, as the
+signal handlers always did. In "buffered" mode events are kept in memory
+and written with bulk_create when the surrounding transaction commits,
+when MAX_EVENTS are pending or FLUSH_INTERVAL_MS after the first pending
+event, and at interpreter shutdown.
+"""
+import atexit
+import threading
+
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+
+from .models import AuditLog
+
+DEFAULTS = {
+    'MODE': 'sync',
+    'MAX_EVENTS': 500,
+    'FLUSH_INTERVAL_MS': 1000,
+}
+
+
+def pipeline_setting(name):
+    return getattr(settings, 'AUDIT_PIPELINE', {}).get(name, DEFAULTS[name])
+
+
+class Ref:
+    """
+    A value read from a related row when the event is written, so a signal
+    handler does not have to load the related object itself.
+    """
+    __slots__ = ('model', 'pk', 'field')
+
+    def __init__(self, model, pk, field):
+        self.model = model
+        self.pk = pk
+        self.field = field
+
+
+def related_value(instance, name, field):
+    """
+    returns instance.<name>.<field> if the related object is already loaded,
+    otherwise a Ref resolved in bulk at write time
+    """
+    descriptor = getattr(type(instance), name)
+    if descriptor.is_cached(instance):
+        return str(getattr(getattr(instance, name), field))
+    return Ref(descriptor.field.related_model, getattr(instance, descriptor.field.attname), field)
+
+
+class AuditEvent:
+    __slots__ = ('user_id', 'model_name', 'object_id', 'action', 'changes', 'timestamp')
+
+    def __init__(self, user, model_name, object_id, action, changes=None):
+        self.user_id = getattr(user, 'pk', None)
+        self.model_name = model_name
+        self.object_id = object_id
+        self.action = action
+        self.changes = changes or {}
+        self.timestamp = timezone.now()
+
+
+def _resolve_refs(events):
+    wanted = {}
+    for event in events:
+        for value in event.changes.values():
+            if isinstance(value, Ref):
+                wanted.setdefault((value.model, value.field), set()).add(value.pk)
+
+    resolved = {}
+    for (model, field), pks in wanted.items():
+        for pk, value in model._default_manager.filter(pk__in=pks).values_list('pk', field):
+            resolved[(model, field, pk)] = str(value)
+
+    for event in events:
+        for key, value in event.changes.items():
+            if isinstance(value, Ref):
+                event.changes[key] = resolved.get((value.model, value.field, value.pk), str(value.pk))
+
+
+def _existing_actors(events):
+    actor_ids = {e.user_id for e in events if e.user_id is not None}
+    if not actor_ids:
+        return set()
+    user_model = AuditLog._meta.get_field('user').related_model
+    return set(user_model._default_manager.filter(pk__in=actor_ids).values_list('pk', flat=True))
+
+
+def write_events(events, check_actors=False):
+    """
+    inserts the events with one bulk_create
+    check_actors: drop actors deleted since the events were recorded
+    """
+    _resolve_refs(events)
+    if check_actors:
+        existing = _existing_actors(events)
+        for e in events:
+            if e.user_id not in existing:
+                e.user_id = None
+    AuditLog.objects.bulk_create([
+        AuditLog(
+            user_id=e.user_id,
+            model_name=e.model_name,
+            object_id=e.object_id,
+            action=e.action,
+            timestamp=e.timestamp,
+            changes=e.changes,
+        )
+        for e in events
+    ])
+
+
+class _CommitGroup:
+    """
+    the events callbacks of one transaction, kept on the connection; the last
+    scheduled callback flushes the buffer. One left behind by a rollback is
+    picked up by the next transaction
+    """
+    def __init__(self):
+        self.scheduled = 0
+
+
+class _CommitBatch:
+    """
+    events recorded by one write inside a transaction, handed to the buffer
+    on commit; Django drops this callback, and so the events, on rollback
+    """
+    def __init__(self, buffer, connection, group, events):
+        self.buffer = buffer
+        self.connection = connection
+        self.group = group
+        group.scheduled += 1
+        self.position = group.scheduled
+        self.events = events
+
+    def __call__(self):
+        # when the last one was rolled back, the flush timer writes the rest
+        last = self.position == self.group.scheduled
+        if last:
+            groups = getattr(self.connection, 'audit_commit_groups', {})
+            if groups.get(self.buffer) is self.group:
+                del groups[self.buffer]
+        self.buffer.add(self.events, flush=last)
+
+
+class AuditBuffer:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._timer = None
+
+    def record(self, events, connection=None):
+        connection = connection or default_connection
+        if connection.in_atomic_block:
+            groups = connection.__dict__.setdefault('audit_commit_groups', {})
+            group = groups.get(self)
+            if group is None:
+                group = groups[self] = _CommitGroup()
+            connection.on_commit(_CommitBatch(self, connection, group, events))
+        else:
+            self.add(events)
+
+    def add(self, events, flush=False):
+        with self._lock:
+            self._events.extend(events)
+            pending = len(self._events)
+            flush = flush or pending >= pipeline_setting('MAX_EVENTS')
+            if pending and not flush and self._timer is None:
+                self._timer = threading.Timer(
+                    pipeline_setting('FLUSH_INTERVAL_MS') / 1000, self._flush_from_timer
+                )
+                self._timer.daemon = True
+                self._timer.start()
+        if flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if events:
+            write_events(events, check_actors=True)
+        return len(events)
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread opened its own connection
+            default_connection.close()
+
+    def __len__(self):
+        return len(self._events)
+
+
+audit_buffer = AuditBuffer()
+atexit.register(audit_buffer.flush)
+
+
+def record_events(events, using='default'):
+    """
+    writes the events now (sync mode) or hands them to the buffer
+    """
+    events = list(events)
+    if not events:
+        return
+    if pipeline_setting('MODE') == 'buffered':
+        audit_buffer.record(events, transaction.get_connection(using))
+    else:
+        write_events(events)
+
+
+def record_event(user, model_name, object_id, action, changes=None, using='default'):
+    record_events([AuditEvent(user, model_name, object_id, action, changes)], using)
@@ -1,6 +1,20 @@
 from rest_framework import serializers
+from django.contrib.auth import get_user_model
 from audit.models import AuditLog
 
+ACTION_DISPLAY = {
+    'create': 'Creación',
+    'update': 'Actualización',
+    'delete': 'eliminación'
+
+}
+
+MODEL_DISPLAY = {
+    'Role': 'Rol',
+    'Permission': 'Permiso',
+    'RolePermission': 'Asignación de permiso'
+}
+
 class AuditLogSerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(source='user.email', read_only=True)
     action_display = serializers.SerializerMethodField()
@@ -22,16 +36,48 @@ class AuditLogSerializer(serializers.ModelSerializer):
         ]
 
     def get_action_display(self, obj):
-            return {
-                'create': 'Creación',
-                'update': 'Actualización',
-                'delete': 'eliminación'
-
-            }.get(obj.action, obj.action)
+            return ACTION_DISPLAY.get(obj.action, obj.action)
         
     def get_model_display(self, obj):
-            return {
-                'Role': 'Rol',
-                'Permission': 'Permiso',
-                'RolePermission': 'Asignación de permiso'
-            }.get(obj.model_name, obj.model_name)
\ No newline at end of file
+            return MODEL_DISPLAY.get(obj.model_name, obj.model_name)
+
+class AuditLogFilterSerializer(serializers.Serializer):
+    """
+    query parameters accepted by the audit log list
+    """
+    model_name = serializers.CharField(required=False, max_length=100)
+    object_id = serializers.CharField(required=False, max_length=36)
+    user = serializers.UUIDField(required=False)
+    action = serializers.ChoiceField(choices=AuditLog.ACTION_CHOICES, required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+# columns read by the join-free list path
+VALUE_FIELDS = ('id', 'user', 'model_name', 'object_id', 'action', 'timestamp', 'changes')
+
+_timestamp_field = serializers.DateTimeField()
+
+def serialize_values(rows):
+    """
+    renders values() rows like AuditLogSerializer, reading the emails of the
+    users on the page with one query instead of a join or a lookup per row
+    """
+    user_ids = {row['user'] for row in rows if row['user'] is not None}
+    emails = dict(
+        get_user_model().objects.filter(pk__in=user_ids).values_list('pk', 'email')
+    ) if user_ids else {}
+    return [represent_values(row, emails.get(row['user'])) for row in rows]
+
+def represent_values(row, user_email):
+    return {
+        'id': row['id'],
+        'user': row['user'],
+        'user_email': user_email,
+        'model_name': row['model_name'],
+        'model_display': MODEL_DISPLAY.get(row['model_name'], row['model_name']),
+        'object_id': row['object_id'],
+        'action': row['action'],
+        'action_display': ACTION_DISPLAY.get(row['action'], row['action']),
+        'timestamp': _timestamp_field.to_representation(row['timestamp']),
+        'changes': row['changes'],
+    }
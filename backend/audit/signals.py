@@ -2,26 +2,29 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from rbac.models import UserRole
 from users.models import User
-from .models import AuditLog
+from .pipeline import record_event, related_value
 
 @receiver(post_save, sender=UserRole)
-def log_user_role_save(sender, instance, created, **kwargs):
+def log_user_role_save(sender, instance, created, using, **kwargs):
     action = 'create' if created else 'update'
-    AuditLog.objects.create(
+    record_event(
         user=getattr(instance, '_current_user', None),
         model_name='UserRole',
         object_id=str(instance.id),
         action=action,
+        # labels are read in bulk when the event is written unless already loaded
         changes={
-            'user': str(instance.user.email),
-            'role': str(instance.role.name)
-        }
+            'user': related_value(instance, 'user', 'email'),
+            'role': related_value(instance, 'role', 'name')
+        },
+        using=using
     )
 
 @receiver(post_delete, sender=UserRole)
-def log_user_role_delete(sender, instance, **kwargs):
+def log_user_role_delete(sender, instance, using, **kwargs):
     if getattr(instance, '_current_user', None):
-        AuditLog.objects.create(
+        # read now: the related rows may be gone by the time a buffered event is written
+        record_event(
             user = instance._current_user,
             model_name='UserRole',
             object_id=str(instance.id),
@@ -29,25 +32,28 @@ def log_user_role_delete(sender, instance, **kwargs):
             changes={
                 'user': str(instance.user.email),
                 'role': str(instance.role.name)
-            }
+            },
+            using=using
         )
 @receiver(post_save, sender=User)
-def log_user_save(sender, instance, created, **kwargs):
+def log_user_save(sender, instance, created, using, **kwargs):
     action = 'create' if created else 'update'
-    AuditLog.objects.create(
+    record_event(
         user=getattr(instance, '_current_user', None),
         model_name='User',
         object_id=str(instance.id),
         action=action,
-        changes=getattr(instance, "_changes", {})
+        changes=getattr(instance, "_changes", {}),
+        using=using
     )
 
 @receiver(post_delete, sender=User)
-def log_user_delete(sender, instance, **kwargs):
-    AuditLog.objects.create(
+def log_user_delete(sender, instance, using, **kwargs):
+    record_event(
         user=getattr(instance, '_current_user', None), 
         model_name='User', 
         object_id=str(instance.id),
         action='delete',
-        changes=getattr(instance,"_changes", {})
-    )
\ No newline at end of file
+        changes=getattr(instance,"_changes", {}),
+        using=using
+    )
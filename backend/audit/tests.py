@@ -1,3 +1,287 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from rbac.models import Role, UserRole
+from .models import AuditLog
+from .pipeline import audit_buffer, AuditEvent
+from .archive import AuditArchive, archive_before, to_representation
+from .serializer import AuditLogSerializer
 
-# Create your tests here.
+User = get_user_model()
+
+BUFFERED = {'MODE': 'buffered', 'MAX_EVENTS': 500, 'FLUSH_INTERVAL_MS': 60000}
+
+
+class SyncPipelineTests(TestCase):
+
+    def test_signal_writes_immediately(self):
+        user = User.objects.create(email="sync@joy.com")
+        role = Role.objects.create(name="SyncRole")
+        assignment = UserRole.objects.create(user=user, role=role)
+        log = AuditLog.objects.get(model_name='UserRole')
+        self.assertEqual(log.object_id, str(assignment.id))
+        self.assertEqual(log.changes, {'user': 'sync@joy.com', 'role': 'SyncRole'})
+
+
+@override_settings(AUDIT_PIPELINE=BUFFERED)
+class BufferedPipelineTests(TestCase):
+
+    def setUp(self):
+        audit_buffer.flush()
+        self.role = Role.objects.create(name="Buffered")
+        self.users = User.objects.bulk_create(
+            [User(email=f"buf{i}@joy.com", password="!") for i in range(20)]
+        )
+
+    def test_events_written_in_one_batch_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for user in self.users:
+                # only ids are set, labels are resolved when the batch is written
+                UserRole.objects.create(user_id=user.id, role_id=self.role.id)
+            self.assertEqual(AuditLog.objects.count(), 0)
+
+        # one callback per write, only the last one flushes:
+        # user emails + role names + actors + one insert
+        with self.assertNumQueries(3):
+            for callback in callbacks:
+                callback()
+        logs = AuditLog.objects.filter(model_name='UserRole')
+        self.assertEqual(logs.count(), 20)
+        self.assertEqual(
+            sorted(log.changes['user'] for log in logs),
+            sorted(u.email for u in self.users)
+        )
+
+    def test_rolled_back_events_are_discarded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    UserRole.objects.create(user=self.users[0], role=self.role)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(len(audit_buffer), 0)
+        self.assertFalse(AuditLog.objects.filter(model_name='UserRole').exists())
+
+    def test_rolled_back_last_write_keeps_earlier_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserRole.objects.create(user=self.users[0], role=self.role)
+            try:
+                with transaction.atomic():
+                    UserRole.objects.create(user=self.users[1], role=self.role)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        # kept for the flush timer
+        self.assertEqual(len(audit_buffer), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserRole.objects.create(user=self.users[2], role=self.role)
+        self.assertEqual(len(audit_buffer), 0)
+        self.assertEqual(
+            set(AuditLog.objects.filter(model_name='UserRole').values_list('changes__user', flat=True)),
+            {self.users[0].email, self.users[2].email}
+        )
+
+    @override_settings(AUDIT_PIPELINE={**BUFFERED, 'MAX_EVENTS': 5})
+    def test_flush_after_max_events(self):
+        events = [AuditEvent(None, 'User', str(u.id), 'update') for u in self.users[:5]]
+        audit_buffer.add(events[:4])
+        self.assertEqual(len(audit_buffer), 4)
+        self.assertEqual(AuditLog.objects.count(), 0)
+        audit_buffer.add(events[4:])
+        self.assertEqual(len(audit_buffer), 0)
+        self.assertEqual(AuditLog.objects.count(), 5)
+
+
+class ArchiveTests(APITestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        old = timezone.now() - timedelta(days=200)
+        AuditLog.objects.all().delete()
+        self.old_logs = [
+            AuditLog.objects.create(
+                user=self.admin, model_name='Role', object_id=f"obj-{i}",
+                action='update', timestamp=old + timedelta(minutes=i), changes={'i': i}
+            )
+            for i in range(5)
+        ]
+        self.recent = AuditLog.objects.create(model_name='User', object_id='recent', action='create')
+        self.client.force_authenticate(user=self.admin)
+
+    def archive(self):
+        archive = AuditArchive(self.tmp.name)
+        with override_settings(AUDIT_ARCHIVE={'DIR': self.tmp.name}):
+            moved = archive_before(timezone.now() - timedelta(days=90), archive, segment_rows=2)
+        return archive, moved
+
+    def test_old_rows_move_to_segments(self):
+        expected = AuditLogSerializer(self.old_logs[3]).data
+        archive, moved = self.archive()
+        self.assertEqual(moved, 5)
+        self.assertEqual(len(archive.segments()), 3)
+        self.assertEqual(list(AuditLog.objects.all()), [self.recent])
+        row = next(archive.search(object_id='obj-3'))
+        # byte-identical once rendered
+        self.assertEqual(JSONRenderer().render(to_representation(row)), JSONRenderer().render(expected))
+
+    def test_indexes_are_parsed_once(self):
+        archive, _ = self.archive()
+        first = archive.segments()
+        with mock.patch('audit.archive.json.load') as load:
+            self.assertEqual(AuditArchive(self.tmp.name).segments(), first)
+        load.assert_not_called()
+        self.assertNotIn('objects', first[0].__dict__)
+        next(archive.search(object_id='obj-4'))
+        self.assertIn('objects', first[0].__dict__)
+
+    def test_api_reads_archived_rows(self):
+        self.archive()
+        with override_settings(AUDIT_ARCHIVE={'DIR': self.tmp.name}):
+            response = self.client.get('/api/audit-logs/', {'include_archived': 'true', 'page_size': 10})
+            self.assertEqual(
+                [r['object_id'] for r in response.data['results']],
+                ['recent', 'obj-4', 'obj-3', 'obj-2', 'obj-1', 'obj-0']
+            )
+            response = self.client.get(f'/api/audit-logs/{self.old_logs[0].id}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['user_email'], 'root@joy.com')
+
+    def test_archived_list_requires_pagination(self):
+        self.archive()
+        with override_settings(AUDIT_ARCHIVE={'DIR': self.tmp.name}):
+            response = self.client.get('/api/audit-logs/', {'include_archived': 'true'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_keyset_pages_continue_into_archive(self):
+        self.archive()
+        with override_settings(AUDIT_ARCHIVE={'DIR': self.tmp.name}):
+            seen = []
+            response = self.client.get('/api/audit-logs/', {'include_archived': 'true', 'page_size': 4})
+            while True:
+                seen += [row['object_id'] for row in response.data['results']]
+                if not response.data['next']:
+                    break
+                response = self.client.get(response.data['next'])
+            self.assertEqual(seen, ['recent', 'obj-4', 'obj-3', 'obj-2', 'obj-1', 'obj-0'])
+
+
+class AuditLogQueryTests(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        self.other = User.objects.create(email="other@joy.com")
+        AuditLog.objects.all().delete()
+        now = timezone.now()
+        logs = []
+        for i in range(30):
+            logs.append(AuditLog(
+                user=self.admin if i % 2 else self.other,
+                model_name='Role' if i % 3 else 'User',
+                object_id=f"obj-{i % 5}",
+                action='update',
+                # pairs of rows share a timestamp to exercise the id tie-break
+                timestamp=now - timedelta(minutes=i // 2),
+            ))
+        AuditLog.objects.bulk_create(logs)
+        self.client.force_authenticate(user=self.admin)
+        self.url = '/api/audit-logs/'
+
+    def test_filters(self):
+        response = self.client.get(self.url, {'user': str(self.other.id), 'model_name': 'User'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data)
+        for row in response.data:
+            self.assertEqual(row['user_email'], 'other@joy.com')
+            self.assertEqual(row['model_name'], 'User')
+
+        since = (timezone.now() - timedelta(minutes=3, seconds=30)).isoformat()
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(len(response.data), 8)
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.url, {'action': 'explode'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_keyset_pages_cover_every_row_once(self):
+        expected = list(
+            AuditLog.objects.order_by('-timestamp', '-id').values_list('id', flat=True)
+        )
+        seen = []
+        response = self.client.get(self.url, {'page_size': 7})
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            # one query for the page and one for the emails on it
+            with self.assertNumQueries(2):
+                response = self.client.get(response.data['next'])
+        self.assertEqual(seen, expected)
+
+    def test_list_output_matches_serializer(self):
+        response = self.client.get(self.url, {'page_size': 3})
+        expected = AuditLogSerializer(
+            AuditLog.objects.order_by('-timestamp', '-id')[:3], many=True
+        ).data
+        self.assertEqual(JSONRenderer().render(response.data['results']), JSONRenderer().render(expected))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AuditExportTests(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        AuditLog.objects.all().delete()
+        AuditLog.objects.bulk_create([
+            AuditLog(user=self.admin, model_name='Role' if i % 2 else 'User',
+                     object_id=f"obj-{i}", action='create', changes={'n': i})
+            for i in range(10)
+        ])
+        self.client.force_authenticate(user=self.admin)
+        self.url = '/api/audit-logs/export/'
+
+    def test_ndjson_matches_list(self):
+        response = self.client.get(self.url, {'model_name': 'Role'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        listed = self.client.get('/api/audit-logs/', {'model_name': 'Role'})
+        self.assertEqual([json.loads(line) for line in lines], json.loads(JSONRenderer().render(listed.data)))
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'export_format': 'csv'})
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['user_email'], 'root@joy.com')
+        self.assertEqual(json.loads(rows[0]['changes']), {'n': 9})
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_rows_are_read_from_the_routed_alias(self):
+        with mock.patch('audit.views.iter_rows', return_value=iter(())) as rows:
+            response = self.client.get(self.url)
+            b''.join(response.streaming_content)
+        # still bound once the request's routing context is gone
+        self.assertEqual(rows.call_args.args[0].db, 'replica1')
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_superuser(self):
+        self.client.force_authenticate(user=User.objects.create(email="plain@joy.com"))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
@@ -1,15 +1,132 @@
 from django.shortcuts import render
+from django.db import router
+from django.http import Http404, StreamingHttpResponse
 from rest_framework.viewsets import ReadOnlyModelViewSet
+from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework import status
 from audit.models import AuditLog
-from audit.serializer import AuditLogSerializer
+from audit.serializer import AuditLogSerializer, AuditLogFilterSerializer, VALUE_FIELDS, serialize_values
 from audit.permissions import IsSuperUser
+from audit.archive import AuditArchive, to_representation
+from audit.pagination import KeysetPagination
+from audit.export import CONTENT_TYPES, iter_rows, export_lines
 
 # Create your views here.
 
 class AuditLogViewSet(ReadOnlyModelViewSet):
     """
     A viewset for viewing audit log instances.
+    Filters: model_name, object_id, user, action, since, until
+    Pagination: ?page_size= / ?cursor= (keyset on timestamp, id),
+    required with ?include_archived=
     """
-    queryset = AuditLog.objects.all().order_by('-timestamp')
+    queryset = AuditLog.objects.all().order_by('-timestamp', '-id')
     serializer_class = AuditLogSerializer
     permission_classes = [IsSuperUser]
+    pagination_class = KeysetPagination
+    # safe requests may read from a replica (authcore.db)
+    replica_reads = True
+
+    def get_filters(self):
+        if not hasattr(self, '_filters'):
+            serializer = AuditLogFilterSerializer(data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self._filters = serializer.validated_data
+        return self._filters
+
+    def filter_queryset(self, queryset):
+        filters = self.get_filters()
+        lookups = {
+            field: filters[field]
+            for field in ('model_name', 'object_id', 'user', 'action')
+            if field in filters
+        }
+        if 'since' in filters:
+            lookups['timestamp__gte'] = filters['since']
+        if 'until' in filters:
+            lookups['timestamp__lte'] = filters['until']
+        return queryset.filter(**lookups)
+
+    def include_archived(self):
+        return self.request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+    def archived_rows(self, before=None):
+        """
+        archived rows matching the list filters, newest first, or None
+        """
+        if not self.include_archived():
+            return None
+        filters = self.get_filters()
+        return AuditArchive().search(
+            start=filters.get('since'),
+            end=filters.get('until'),
+            model_name=filters.get('model_name'),
+            object_id=filters.get('object_id'),
+            user=filters.get('user'),
+            action=filters.get('action'),
+            before=before,
+        )
+
+    def serialize_rows(self, rows):
+        # archived rows carry their timestamp as a string
+        live = serialize_values([row for row in rows if not isinstance(row['timestamp'], str)])
+        live = iter(live)
+        return [
+            to_representation(row) if isinstance(row['timestamp'], str) else next(live)
+            for row in rows
+        ]
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).values(*VALUE_FIELDS)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.serialize_rows(page))
+
+        if self.include_archived():
+            # the archive can hold far more rows than a response should; the
+            # export endpoint streams all of them
+            return Response(
+                {"detail": "include_archived requiere page_size o cursor"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(serialize_values(list(queryset)))
+
+    @action(detail=False, methods=['GET'], url_path='export')
+    def export(self, request):
+        """
+        GET /audit-logs/export/?export_format=ndjson|csv
+        streams every row matching the list filters, newest first
+        """
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in CONTENT_TYPES:
+            return Response(
+                {"detail": "Formato no soportado, use ndjson o csv"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # the rows are read after the view returns, outside the request's
+        # replica routing (authcore.db), so the alias is fixed now
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.using(router.db_for_read(queryset.model))
+        archived = self.archived_rows()
+        if archived is not None:
+            archived = (to_representation(row) for row in archived)
+
+        response = StreamingHttpResponse(
+            export_lines(export_format, iter_rows(queryset, archived)),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="audit-logs.{export_format}"'
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            pk = self.kwargs[self.lookup_field]
+            row = AuditArchive().get(int(pk)) if str(pk).isdigit() else None
+            if row is None:
+                raise
+            return Response(to_representation(row))
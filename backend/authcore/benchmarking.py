@@ -0,0 +1,50 @@
+"""
+Small timing helpers shared by the benchmark management commands.
+"""
+import json
+import time
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, elapsed=None):
+    """
+    samples: per-call durations in seconds
+    """
+    elapsed = sum(samples) if elapsed is None else elapsed
+    return {
+        'count': len(samples),
+        'mean_us': sum(samples) / len(samples) * 1e6 if samples else 0.0,
+        'p50_us': percentile(samples, 50) * 1e6,
+        'p95_us': percentile(samples, 95) * 1e6,
+        'p99_us': percentile(samples, 99) * 1e6,
+        'ops_per_sec': len(samples) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(func, args_list):
+    """
+    calls func(*args) for every args tuple and returns summarize() of the timings
+    """
+    samples = []
+    started = time.perf_counter()
+    for args in args_list:
+        t0 = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def write_results(results, path=None, stdout=None):
+    payload = json.dumps(results, indent=2, default=str)
+    if path:
+        with open(path, 'w') as fh:
+            fh.write(payload + '\n')
+    if stdout is not None:
+        stdout.write(payload)
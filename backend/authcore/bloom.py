@@ -0,0 +1,50 @@
+"""
+A small Bloom filter: a compact set that can answer "definitely not
+present" without false negatives, at the cost of a tunable rate of false
+positives.
+"""
+import base64
+import hashlib
+import math
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[p >> 3] >> (p & 7) & 1 for p in self._positions(item))
+
+    def to_dict(self):
+        return {
+            'size': self.size,
+            'hashes': self.hashes,
+            'bits': base64.b64encode(bytes(self.bits)).decode(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        bloom = cls.__new__(cls)
+        bloom.size = data['size']
+        bloom.hashes = data['hashes']
+        bloom.bits = bytearray(base64.b64decode(data['bits']))
+        return bloom
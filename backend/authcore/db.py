@@ -0,0 +1,151 @@
+"""
+Read replica routing.
+
+Writes always go to "default". Reads go to a replica only while a request
+served by a view that opted in (replica_reads = True) runs with a safe
+method; everything else, management commands and tests included, reads the
+primary. A write request pins the client to the primary for STICKY_SECONDS
+through a cookie, so it reads its own writes while replicas catch up.
+
+Models of PRIMARY_APPS are always read from the primary. Loaders filling
+an in-process or shared cache (the RBAC permission cache and bitmask
+index) use read_from_primary(): a stale replica read would otherwise be
+kept for the cache timeout instead of the replica lag.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+DEFAULTS = {
+    'STICKY_SECONDS': 10,
+    'COOKIE': 'authcore_primary',
+    # a refresh right after a logout must see the blacklist row
+    'PRIMARY_APPS': ['token_blacklist'],
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# alias the reads of the current request or task go to; None reads the primary
+_read_alias = ContextVar('authcore_read_alias', default=None)
+
+
+def routing_setting(name):
+    return getattr(settings, 'READ_REPLICA_ROUTING', {}).get(name, DEFAULTS[name])
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@contextmanager
+def read_from_replica(alias=None):
+    """
+    routes the reads inside the block to a replica (a random one by default)
+    """
+    aliases = replicas()
+    token = _read_alias.set(alias or (random.choice(aliases) if aliases else None))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def read_from_primary():
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or model._meta.app_label in routing_setting('PRIMARY_APPS'):
+            return 'default'
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReadReplicaMiddleware:
+    """
+    sync and async capable: under ASGI it keeps the async views on the
+    event loop, the alias ContextVar is set and reset in the request's task
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # a sync process_view would be run through a thread
+            self.process_view = self.aprocess_view
+
+    def sticky(self, request):
+        try:
+            return float(request.COOKIES.get(routing_setting('COOKIE'), 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _read_alias.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.pin_to_primary(request, response)
+
+    async def __acall__(self, request):
+        token = _read_alias.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.pin_to_primary(request, response)
+
+    def pin_to_primary(self, request, response):
+        if request.method not in SAFE_METHODS and replicas() and response.status_code < 400:
+            seconds = routing_setting('STICKY_SECONDS')
+            response.set_cookie(
+                routing_setting('COOKIE'), str(time.time() + seconds),
+                max_age=seconds, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def route(self, request, view_func):
+        # DRF viewsets only set cls
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        aliases = replicas()
+        if (
+            aliases
+            and getattr(view_class, 'replica_reads', False)
+            and request.method in SAFE_METHODS
+            and not self.sticky(request)
+        ):
+            _read_alias.set(random.choice(aliases))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.route(request, view_func)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.route(request, view_func)
+        return None
@@ -0,0 +1,35 @@
+"""
+Conditional GET helpers shared by the cached read endpoints.
+"""
+import hashlib
+
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """
+    strong ETag derived from the values a representation depends on
+    """
+    digest = hashlib.sha1('\x1f'.join(str(p) for p in parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags
+
+
+def with_etag(response, etag, private=True):
+    response['ETag'] = etag
+    # clients must revalidate, which costs them a 304 at most
+    response['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    return response
+
+
+def not_modified(etag, private=True):
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag, private)
@@ -0,0 +1,231 @@
+"""
+Per-request SQL and latency instrumentation.
+
+MetricsMiddleware times every query of a request through
+connection.execute_wrapper (a counter and a clock read per query, nothing
+logged) and folds query count, database time, latency and response size
+into in-process histograms labelled by route. metrics_view renders them,
+with the RBAC cache counters, in the Prometheus text format, to scrapers
+that send METRICS['TOKEN'] as a bearer token or connect from
+METRICS['ALLOWED_IPS'].
+
+Each worker process keeps and reports its own numbers. Queries a view runs
+on another thread (sync_to_async in the async views) are not counted.
+"""
+import bisect
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from rbac.cache import get_cache_stats
+
+DEFAULTS = {
+    'ENABLED': False,
+    # add a Server-Timing header (db;dur=..., app;dur=...) to every response
+    'SERVER_TIMING': False,
+    # /metrics answers requests carrying "Authorization: Bearer <TOKEN>"...
+    'TOKEN': '',
+    # ...or coming from these addresses (REMOTE_ADDR, no proxy headers)
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def metrics_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+class Histogram:
+    """
+    cumulative-bucket histogram per label tuple
+    """
+    def __init__(self, name, help_text, buckets, labels=('view', 'method')):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series = {}   # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def samples(self):
+        """
+        (label values, cumulative bucket counts, count, sum) per series
+        """
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative, total = [], 0
+            for count in values[:-1]:
+                total += count
+                cumulative.append(total)
+            yield label_values, cumulative, total, values[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, cumulative, count, total in self.samples():
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            for bound, value in zip(self.buckets + ('+Inf',), cumulative):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_duration = Histogram(
+    'authcore_request_duration_seconds', 'Request latency in seconds.', LATENCY_BUCKETS
+)
+request_queries = Histogram(
+    'authcore_request_db_queries', 'SQL queries run per request.', QUERY_BUCKETS
+)
+request_db_duration = Histogram(
+    'authcore_request_db_duration_seconds', 'Time spent in SQL queries per request, in seconds.', LATENCY_BUCKETS
+)
+response_size = Histogram(
+    'authcore_response_size_bytes', 'Response body size in bytes.', SIZE_BUCKETS
+)
+HISTOGRAMS = (request_duration, request_queries, request_db_duration, response_size)
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.reset()
+
+
+class QueryTimer:
+    """
+    execute_wrapper counting the queries of one request and their time
+    """
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    # the URL name (or pattern) keeps ids out of the labels
+    return match.view_name or match.route or 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    sync and async capable, so it does not push ASGI requests (the async
+    /me view) onto a thread; removed from the stack when metrics are off
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer, started = QueryTimer(), time.perf_counter()
+        with self.timing(timer):
+            response = self.get_response(request)
+        return self.record(request, response, timer, started)
+
+    async def __acall__(self, request):
+        timer, started = QueryTimer(), time.perf_counter()
+        with self.timing(timer):
+            response = await self.get_response(request)
+        return self.record(request, response, timer, started)
+
+    def timing(self, timer):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        return stack
+
+    def record(self, request, response, timer, started):
+        elapsed = time.perf_counter() - started
+        labels = (_route(request), request.method)
+        request_duration.observe(elapsed, *labels)
+        request_queries.observe(timer.count, *labels)
+        request_db_duration.observe(timer.duration, *labels)
+        if not response.streaming:
+            response_size.observe(len(response.content), *labels)
+
+        if metrics_setting('SERVER_TIMING'):
+            response['Server-Timing'] = (
+                f'db;dur={timer.duration * 1000:.2f};desc="{timer.count} queries", '
+                f'app;dur={elapsed * 1000:.2f}'
+            )
+        return response
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    cache_stats = get_cache_stats()
+    for key in ('hits', 'misses'):
+        name = f'authcore_rbac_cache_{key}_total'
+        lines += [
+            f"# HELP {name} RBAC permission cache {key} in this process.",
+            f"# TYPE {name} counter",
+            f"{name} {cache_stats[key]}",
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def scrape_allowed(request):
+    token = metrics_setting('TOKEN')
+    header = request.headers.get('Authorization', '')
+    if token and constant_time_compare(header, f'Bearer {token}'):
+        return True
+    return request.META.get('REMOTE_ADDR') in metrics_setting('ALLOWED_IPS')
+
+
+def metrics_view(request):
+    """
+    GET /metrics: Prometheus text exposition of this worker's metrics
+    """
+    if not metrics_setting('ENABLED'):
+        raise Http404
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,171 @@
+"""
+Prebuilt OpenAPI schema.
+
+`manage.py build_openapi_schema` introspects the API once and writes
+swagger.json and swagger.yaml to API_SCHEMA_DIR; the schema routes stream
+those files with an ETag instead of regenerating the schema on every hit.
+The Swagger UI and ReDoc pages only need the API title and load the spec
+from those routes.
+
+The files are stamped with a fingerprint of the URLconf, the Django, DRF
+and drf_yasg versions and API_SCHEMA_BUILD_ID; a route that finds another
+stamp (files left by a previous deploy) rebuilds them.
+
+drf_yasg is imported here on first use, and the docs routes (and the
+drf_yasg app) are left out entirely when API_DOCS_ENABLED is False.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.urls import URLResolver, get_resolver
+
+from authcore.http import etag_matches, make_etag, with_etag
+
+FORMATS = {
+    '.json': ('swagger.json', 'application/json'),
+    '.yaml': ('swagger.yaml', 'application/yaml'),
+}
+
+STAMP_NAME = 'schema.fingerprint'
+
+_build_lock = threading.Lock()
+
+
+def schema_dir():
+    return Path(getattr(settings, 'API_SCHEMA_DIR', Path(settings.BASE_DIR) / 'openapi'))
+
+
+def api_info():
+    from drf_yasg import openapi
+    return openapi.Info(
+        title="AuthCore API",
+        default_version='v1',
+        description="API para AuthCore",
+    )
+
+
+def generate_schema():
+    """
+    introspects every endpoint, as the drf_yasg schema view does for an anonymous request
+    """
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    return OpenAPISchemaGenerator(api_info()).get_schema(request=None, public=True)
+
+
+def _routes(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _routes(pattern.url_patterns, prefix + str(pattern.pattern))
+            continue
+        callback = pattern.callback
+        view = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None) or callback
+        actions = sorted(getattr(callback, 'actions', None) or {})
+        yield f"{prefix}{pattern.pattern} {view.__module__}.{view.__qualname__} {actions}"
+
+
+@lru_cache(maxsize=None)
+def _fingerprint(urlconf, build_id):
+    import rest_framework
+    import drf_yasg
+
+    digest = hashlib.sha1()
+    for part in (build_id, django.get_version(), rest_framework.VERSION, drf_yasg.__version__,
+                 *_routes(get_resolver(urlconf).url_patterns)):
+        digest.update(part.encode() + b'\n')
+    return digest.hexdigest()
+
+
+def schema_fingerprint():
+    """
+    changes whenever the routes, the libraries that describe them or the
+    build id do; computed once per process and URLconf
+    """
+    return _fingerprint(settings.ROOT_URLCONF, getattr(settings, 'API_SCHEMA_BUILD_ID', ''))
+
+
+def write_schema_files(directory=None):
+    """
+    writes swagger.json and swagger.yaml; returns their paths
+    """
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+
+    directory = Path(directory or schema_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    schema = generate_schema()
+    paths = []
+    for (name, _), codec in zip(FORMATS.values(), (OpenAPICodecJson, OpenAPICodecYaml)):
+        path = directory / name
+        _replace(path, codec(validators=[]).encode(schema))
+        paths.append(path)
+    # stamped last, so a stamp never vouches for half-written files
+    _replace(directory / STAMP_NAME, schema_fingerprint().encode())
+    return paths
+
+
+def _replace(path, content):
+    """
+    writes a temporary file of its own and moves it over path: other workers
+    may be rebuilding the same files or streaming the previous ones
+    """
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'{path.name}.', suffix='.tmp', delete=False) as tmp:
+        tmp.write(content)
+    try:
+        os.chmod(tmp.name, 0o644)
+        os.replace(tmp.name, path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+
+def _is_current(path):
+    stamp = path.parent / STAMP_NAME
+    try:
+        return path.exists() and stamp.read_text() == schema_fingerprint()
+    except FileNotFoundError:
+        return False
+
+
+def _schema_file(name):
+    path = schema_dir() / name
+    if not _is_current(path):
+        # no build step ran for this code: build once, every later request streams the file
+        with _build_lock:
+            if not _is_current(path):
+                write_schema_files()
+    return path
+
+
+def schema_file_view(request, format):
+    """
+    GET /swagger.json, /swagger.yaml
+    """
+    if format not in FORMATS:
+        raise Http404
+    name, content_type = FORMATS[format]
+    path = _schema_file(name)
+    stat = path.stat()
+    etag = make_etag('openapi', name, stat.st_mtime_ns, stat.st_size)
+    if etag_matches(request, etag):
+        return with_etag(HttpResponseNotModified(), etag, private=False)
+    return with_etag(FileResponse(open(path, 'rb'), content_type=content_type), etag, private=False)
+
+
+def docs_ui_view(request, ui):
+    """
+    GET /swagger/, /redoc/: the UI page, which fetches the prebuilt spec
+    """
+    from drf_yasg import openapi
+    from drf_yasg.renderers import ReDocRenderer, SwaggerUIRenderer
+
+    renderer = SwaggerUIRenderer() if ui == 'swagger' else ReDocRenderer()
+    # the page only shows the title and version; the paths come from SPEC_URL
+    stub = openapi.Swagger(info=api_info(), _prefix='/', paths=openapi.Paths(paths={}))
+    content = renderer.render(stub, renderer_context={'request': request})
+    return HttpResponse(content, content_type='text/html; charset=utf-8')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -43,22 +44,34 @@ INSTALLED_APPS = [
     'rbac',
     'rest_framework',
     'rest_framework_simplejwt.token_blacklist',
-    'drf_yasg',
     'django_extensions',
     'audit.apps.AuditConfig',
     'corsheaders',
 
 ]
 
+# Swagger/ReDoc docs and the schema routes (authcore.schema); without them
+# drf_yasg is never imported
+API_DOCS_ENABLED = os.environ.get('API_DOCS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+if API_DOCS_ENABLED:
+    INSTALLED_APPS.append('drf_yasg')
+# where `manage.py build_openapi_schema` writes swagger.json and swagger.yaml
+API_SCHEMA_DIR = BASE_DIR / 'openapi'
+# part of the schema files' fingerprint; set it per release (e.g. the commit)
+# so serializer changes that leave the URLconf alone also rebuild them
+API_SCHEMA_BUILD_ID = os.environ.get('API_SCHEMA_BUILD_ID', '')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'authcore.db.ReadReplicaMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'authcore.metrics.MetricsMiddleware',
     
 
 ]
@@ -98,6 +111,101 @@ DATABASES = {
     }
 }
 
+# optional local Postgres, e.g. to run the benchmarks against it: set POSTGRES_DB
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
+# seconds a connection is reused (0 closes it after every request)
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 0))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replicas (authcore.db), comma separated in DB_REPLICAS: SQLite files
+# when the primary is SQLite (e.g. a copy of db.sqlite3 to try the routing
+# locally), host[:port] of Postgres replicas sharing the primary credentials
+# otherwise
+DATABASE_REPLICAS = []
+for number, location in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    replica = dict(DATABASES['default'], CONN_MAX_AGE=int(os.environ.get('DB_REPLICA_CONN_MAX_AGE', 60)))
+    if replica['ENGINE'].endswith('sqlite3'):
+        replica['NAME'] = location.strip()
+    else:
+        host, _, port = location.strip().partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'])
+    # tests read and write the primary
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES[f'replica{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['authcore.db.ReplicaRouter']
+
+# views with replica_reads = True read from a replica on safe requests;
+# a write pins its client to the primary for STICKY_SECONDS
+READ_REPLICA_ROUTING = {
+    'STICKY_SECONDS': 10,
+    'PRIMARY_APPS': ['token_blacklist'],
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# the RBAC version counter lives here, so several workers need a shared
+# backend: set REDIS_URL. A per-process cache fails the rbac.E001 check
+# unless RBAC_CACHE_SINGLE_PROCESS says one process serves every request
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'authcore',
+        }
+    }
+
+# RBAC effective-permission cache
+RBAC_CACHE_ALIAS = 'default'
+RBAC_CACHE_TIMEOUT = 300  # seconds
+# runserver and the test runner; multi-worker deployments must leave it off
+RBAC_CACHE_SINGLE_PROCESS = os.environ.get('RBAC_CACHE_SINGLE_PROCESS', str(DEBUG)).lower() in ('1', 'true', 'yes')
+# evaluate checks against the in-process bitmask index (rbac/bitmask.py)
+RBAC_BITMASK_INDEX = False
+# keep rbac.UserEffectivePermission in sync on every RBAC write and check
+# against it (rbac/effective.py); run `manage.py rebuild_effective_permissions`
+# after turning it on
+RBAC_MATERIALIZED_PERMISSIONS = False
+
+
+# Audit pipeline
+# MODE "sync" writes every audit row inside the signal handler; "buffered"
+# collects them and writes batches on commit, every MAX_EVENTS events or
+# FLUSH_INTERVAL_MS milliseconds
+AUDIT_PIPELINE = {
+    'MODE': 'sync',
+    'MAX_EVENTS': 500,
+    'FLUSH_INTERVAL_MS': 1000,
+}
+
+
+# Audit archive: rows older than RETENTION_DAYS are moved by
+# `manage.py archive_audit_logs` into gzip JSONL segments under DIR
+AUDIT_ARCHIVE = {
+    'DIR': BASE_DIR / 'audit_archive',
+    'RETENTION_DAYS': 90,
+    'SEGMENT_ROWS': 50000,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -158,9 +266,42 @@ SIMPLE_JWT = {
     "BLACKLIST_AFTER_ROTATION":True,
 
     "AUTH_HEADERS_TYPES": ("Bearer",),
+
+    # embed the RBAC permission claim in access tokens (opt-in)
+    # "TOKEN_OBTAIN_SERIALIZER": "authentication.serializers.RBACTokenObtainPairSerializer",
+    # "TOKEN_REFRESH_SERIALIZER": "authentication.serializers.RBACTokenRefreshSerializer",
+    # skip the blacklist query on refresh with TOKEN_BLACKLIST_FILTER (opt-in)
+    # "TOKEN_REFRESH_SERIALIZER": "authentication.serializers.BlacklistFilterTokenRefreshSerializer",
+}
+
+# serve /api/me/ with the async view when running under ASGI (authcore.asgi)
+ASYNC_ME_VIEW = False
+
+# in-process Bloom filter over blacklisted refresh tokens (authentication.blacklist)
+TOKEN_BLACKLIST_FILTER = {
+    'ENABLED': False,
+    'CAPACITY': 1000000,
+    'ERROR_RATE': 0.001,
+    'RESYNC_SECONDS': 5,
 }
 
+# per-request query count, DB time, latency and response size histograms
+# (authcore.metrics), exposed at /metrics when ENABLED to scrapers sending
+# the bearer TOKEN or connecting from ALLOWED_IPS
+METRICS = {
+    'ENABLED': False,
+    'SERVER_TIMING': False,
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+# serve the role, permission and user lists from values_list() rows instead
+# of model instances and ModelSerializer (authcore.fastlist); same JSON
+FAST_LIST_SERIALIZATION = False
+
 SWAGGER_SETTINGS = {
+    # the UI loads the prebuilt schema instead of generating it
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
     'SECURITY_DEFINITIONS': {
         'Bearer': {
             'type': 'apiKey',
@@ -168,4 +309,8 @@ SWAGGER_SETTINGS = {
             'in': 'header'
         }
     }
-}
\ No newline at end of file
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
@@ -14,30 +14,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include, re_path
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 from rest_framework.routers import DefaultRouter
 from rbac.views import RoleViewSet
 from audit.views import AuditLogViewSet
+from authcore.metrics import metrics_view
 
 router = DefaultRouter()
 router.register(r'roles', RoleViewSet)
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="AuthCore API",
-      default_version='v1',
-      description="API para AuthCore",
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-   authentication_classes=[],  # empty so that it does not use basic auth
-
-)
-
 urlpatterns = [
 
     path('admin/', admin.site.urls),
@@ -57,8 +44,16 @@ urlpatterns = [
     path('api/', include('audit.urls')),
 
 
-    # Swagger and Redoc
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    # Prometheus metrics of this worker (METRICS['ENABLED'])
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+if getattr(settings, 'API_DOCS_ENABLED', True):
+    from authcore.schema import docs_ui_view, schema_file_view
+
+    # Swagger and Redoc, served from the prebuilt schema (manage.py build_openapi_schema)
+    urlpatterns += [
+        re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_file_view, name='schema-json'),
+        path('swagger/', docs_ui_view, {'ui': 'swagger'}, name='schema-swagger-ui'),
+        path('redoc/', docs_ui_view, {'ui': 'redoc'}, name='schema-redoc'),
+    ]
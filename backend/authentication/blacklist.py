@@ -0,0 +1,123 @@
+"""
+In-process Bloom filter over blacklisted refresh token JTIs.
+
+Checking a refresh token normally costs a blacklist query. The filter
+answers "definitely not blacklisted" from memory; a hit is still confirmed
+with that query, so a false positive only costs the query it replaced.
+
+Tokens blacklisted by this process are added right away. Rows written by
+other processes are picked up by an incremental resync, at most every
+RESYNC_SECONDS, so another process can still refresh a revoked token for
+up to that long. Expired tokens are left out: they fail verification anyway.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from authcore.bloom import BloomFilter
+
+DEFAULTS = {
+    'ENABLED': False,
+    'CAPACITY': 1000000,
+    'ERROR_RATE': 0.001,
+    'RESYNC_SECONDS': 5,
+    # rows with lower ids can commit after a resync has read past them
+    'RESYNC_LOOKBACK': 1000,
+}
+
+
+def filter_setting(name):
+    return getattr(settings, 'TOKEN_BLACKLIST_FILTER', {}).get(name, DEFAULTS[name])
+
+
+class BlacklistFilter:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._bloom = None
+        self._capacity = 0
+        self._count = 0
+        self._last_id = 0
+        self._synced_at = 0.0
+
+    @property
+    def loaded(self):
+        return self._bloom is not None
+
+    def _rows(self, min_id=None):
+        rows = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+        if min_id is not None:
+            rows = rows.filter(id__gt=min_id)
+        return rows.values_list('id', 'token__jti').order_by('id').iterator(chunk_size=10000)
+
+    def rebuild(self):
+        """
+        loads every unexpired blacklisted JTI into a new filter
+        """
+        with self._lock:
+            count = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).count()
+            capacity = max(filter_setting('CAPACITY'), count * 2)
+            bloom = BloomFilter(capacity, filter_setting('ERROR_RATE'))
+            last_id = 0
+            for pk, jti in self._rows():
+                bloom.add(jti)
+                last_id = pk
+            self._bloom, self._capacity, self._count, self._last_id = bloom, capacity, count, last_id
+            self._synced_at = time.monotonic()
+
+    def sync(self):
+        """
+        adds the rows blacklisted since the last sync
+        """
+        with self._lock:
+            if self._bloom is None:
+                return self.rebuild()
+            lookback = filter_setting('RESYNC_LOOKBACK')
+            last_id = self._last_id
+            for pk, jti in self._rows(min_id=max(0, self._last_id - lookback)):
+                if pk > self._last_id:
+                    self._count += 1
+                self._bloom.add(jti)
+                last_id = max(last_id, pk)
+            self._last_id = last_id
+            self._synced_at = time.monotonic()
+            if self._count > self._capacity:
+                # past capacity the false positive rate climbs; rebuilding also drops expired tokens
+                self.rebuild()
+
+    def _refresh(self):
+        if self._bloom is not None and time.monotonic() - self._synced_at < filter_setting('RESYNC_SECONDS'):
+            return
+        # one thread resyncs while the others keep using the current filter;
+        # the first load has to be waited for
+        if not self._lock.acquire(blocking=self._bloom is None):
+            return
+        try:
+            if self._bloom is None or time.monotonic() - self._synced_at >= filter_setting('RESYNC_SECONDS'):
+                self.sync()
+        finally:
+            self._lock.release()
+
+    def might_contain(self, jti):
+        """
+        False means the token is not blacklisted; True needs the database to confirm
+        """
+        self._refresh()
+        return jti in self._bloom
+
+    def add(self, jti):
+        bloom = self._bloom
+        if bloom is not None:
+            bloom.add(jti)
+
+    def clear(self):
+        with self._lock:
+            self._bloom = None
+            self._capacity = self._count = self._last_id = 0
+            self._synced_at = 0.0
+
+
+blacklist_filter = BlacklistFilter()
@@ -0,0 +1,94 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authcore.benchmarking import measure, write_results
+from authentication.blacklist import blacklist_filter
+from authentication.serializers import BlacklistFilterTokenRefreshSerializer
+from users.models import User
+
+BATCH_SIZE = 20000
+
+
+def refresh(serializer_class, token):
+    serializer = serializer_class(data={'refresh': token})
+    serializer.is_valid(raise_exception=True)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare refresh throughput with and without the blacklist filter. "
+        "Seeds outstanding and blacklisted tokens inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--outstanding', type=int, default=10000000)
+        parser.add_argument('--blacklisted-ratio', type=float, default=0.05)
+        parser.add_argument('--refreshes', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            blacklisted = self.seed(rng, options)
+            seed_seconds = time.perf_counter() - started
+            self.stdout.write(f"seeded in {seed_seconds:.1f}s", self.style.NOTICE)
+
+            user = User.objects.create(email=f"bench-{uuid.uuid4().hex}@bench.local", password='!')
+            tokens = [(str(RefreshToken.for_user(user)),) for _ in range(options['refreshes'])]
+
+            filter_settings = {'ENABLED': True, 'CAPACITY': max(1, blacklisted * 2), 'RESYNC_SECONDS': 3600}
+            with override_settings(TOKEN_BLACKLIST_FILTER=filter_settings):
+                blacklist_filter.clear()
+                started = time.perf_counter()
+                blacklist_filter.rebuild()
+                build_seconds = time.perf_counter() - started
+                false_positives = sum(blacklist_filter.might_contain(RefreshToken(t)['jti']) for t, in tokens)
+
+                results = {
+                    'dataset': {
+                        'outstanding': options['outstanding'],
+                        'blacklisted': blacklisted,
+                        'refreshes': options['refreshes'],
+                    },
+                    'seed_seconds': seed_seconds,
+                    'filter_build_seconds': build_seconds,
+                    'filter_bytes': len(blacklist_filter._bloom.bits),
+                    'filter_false_positives': false_positives,
+                    'refresh_database': measure(lambda t: refresh(TokenRefreshSerializer, t), tokens),
+                    'refresh_filter': measure(lambda t: refresh(BlacklistFilterTokenRefreshSerializer, t), tokens),
+                }
+                blacklist_filter.clear()
+            transaction.set_rollback(True)
+
+        write_results(results, options['output'], self.stdout)
+
+    def seed(self, rng, options):
+        expires_at = timezone.now() + timedelta(days=1)
+        blacklisted = 0
+        batch = []
+        for i in range(options['outstanding']):
+            batch.append(OutstandingToken(jti=uuid.UUID(int=rng.getrandbits(128)).hex, token='', expires_at=expires_at))
+            if len(batch) >= BATCH_SIZE or i == options['outstanding'] - 1:
+                OutstandingToken.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+                saved = [t.pk for t in batch]
+                if saved[0] is None:
+                    # bulk_create does not return primary keys on every backend
+                    saved = OutstandingToken.objects.filter(jti__in=[t.jti for t in batch]).values_list('id', flat=True)
+                revoked = [BlacklistedToken(token_id=pk) for pk in saved if rng.random() < options['blacklisted_ratio']]
+                BlacklistedToken.objects.bulk_create(revoked, batch_size=BATCH_SIZE)
+                blacklisted += len(revoked)
+                batch = []
+        return blacklisted
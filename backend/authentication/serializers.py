@@ -0,0 +1,17 @@
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from .tokens import BlacklistFilterRefreshToken, RBACRefreshToken
+
+# opt-in: point SIMPLE_JWT["TOKEN_OBTAIN_SERIALIZER"] and
+# SIMPLE_JWT["TOKEN_REFRESH_SERIALIZER"] at these classes
+
+
+class RBACTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = RBACRefreshToken
+
+
+class RBACTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RBACRefreshToken
+
+
+class BlacklistFilterTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = BlacklistFilterRefreshToken
@@ -1,3 +1,118 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rbac.models import Role, Permission, UserRole
+from rbac.services import has_permission
+from rbac.claims import PERMISSIONS_CLAIM, VERSION_CLAIM
+from .serializers import RBACTokenObtainPairSerializer, RBACTokenRefreshSerializer
+from .serializers import BlacklistFilterTokenRefreshSerializer
+from .tokens import BlacklistFilterRefreshToken
+from .blacklist import blacklist_filter
 
-# Create your tests here.
+User = get_user_model()
+
+
+class PermissionClaimTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="claims@joy.com", password="password123")
+        self.role = Role.objects.create(name="ClaimRole")
+        self.role.permissions.add(Permission.objects.create(name="user.view"))
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def obtain_access(self):
+        serializer = RBACTokenObtainPairSerializer(
+            data={"email": "claims@joy.com", "password": "password123"}
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def test_access_token_carries_claim(self):
+        access = AccessToken(self.obtain_access()["access"])
+        self.assertEqual(access[PERMISSIONS_CLAIM], ["user.view"])
+        self.assertIn(VERSION_CLAIM, access)
+
+    def test_current_claim_needs_no_query(self):
+        access = AccessToken(self.obtain_access()["access"])
+        with self.assertNumQueries(0):
+            self.assertTrue(has_permission(self.user, "user.view", token=access))
+            self.assertFalse(has_permission(self.user, "user.delete", token=access))
+
+    def test_stale_claim_falls_back_to_database(self):
+        access = AccessToken(self.obtain_access()["access"])
+        UserRole.objects.filter(user=self.user).delete()
+        self.assertFalse(has_permission(self.user, "user.view", token=access))
+
+    def test_refresh_reissues_claim(self):
+        tokens = self.obtain_access()
+        self.role.permissions.add(Permission.objects.create(name="user.change"))
+        serializer = RBACTokenRefreshSerializer(data={"refresh": tokens["refresh"]})
+        serializer.is_valid(raise_exception=True)
+        access = AccessToken(serializer.validated_data["access"])
+        self.assertEqual(access[PERMISSIONS_CLAIM], ["user.change", "user.view"])
+        self.assertTrue(has_permission(self.user, "user.change", token=access))
+
+
+@override_settings(TOKEN_BLACKLIST_FILTER={'ENABLED': True, 'CAPACITY': 1000, 'RESYNC_SECONDS': 3600})
+class BlacklistFilterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="revoked@joy.com")
+        blacklist_filter.clear()
+        self.addCleanup(blacklist_filter.clear)
+
+    def test_clean_token_skips_blacklist_query(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        blacklist_filter.rebuild()
+        with self.assertNumQueries(0):
+            BlacklistFilterRefreshToken(refresh)
+
+    def test_local_blacklist_is_seen_immediately(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        blacklist_filter.rebuild()
+        BlacklistFilterRefreshToken(refresh).blacklist()
+        with self.assertRaises(TokenError):
+            BlacklistFilterRefreshToken(refresh)
+
+    def test_resync_picks_up_other_processes(self):
+        refresh = RefreshToken.for_user(self.user)
+        blacklist_filter.rebuild()
+        outstanding = OutstandingToken.objects.get(jti=refresh["jti"])
+        BlacklistedToken.objects.create(token=outstanding)
+
+        # not seen until the next resync
+        BlacklistFilterRefreshToken(str(refresh))
+        blacklist_filter.sync()
+        with self.assertRaises(TokenError):
+            BlacklistFilterRefreshToken(str(refresh))
+
+    def test_grows_past_capacity(self):
+        tokens = [RefreshToken.for_user(self.user) for _ in range(3)]
+        with override_settings(TOKEN_BLACKLIST_FILTER={'ENABLED': True, 'CAPACITY': 1}):
+            blacklist_filter.rebuild()
+            for token in tokens:
+                BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token["jti"]))
+            blacklist_filter.sync()
+            self.assertEqual(blacklist_filter._capacity, 6)
+        for token in tokens:
+            self.assertTrue(blacklist_filter.might_contain(token["jti"]))
+
+    def test_refresh_serializer(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        serializer = BlacklistFilterTokenRefreshSerializer(data={"refresh": refresh})
+        self.assertTrue(serializer.is_valid())
+        BlacklistFilterRefreshToken(refresh).blacklist()
+        serializer = BlacklistFilterTokenRefreshSerializer(data={"refresh": refresh})
+        with self.assertRaises(TokenError):
+            serializer.is_valid()
+
+    @override_settings(TOKEN_BLACKLIST_FILTER={'ENABLED': False})
+    def test_disabled_uses_database(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        with self.assertNumQueries(1):
+            BlacklistFilterRefreshToken(refresh)
+        self.assertFalse(blacklist_filter.loaded)
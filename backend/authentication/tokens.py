@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rbac.claims import add_permission_claims
+from .blacklist import blacklist_filter, filter_setting
+
+
+class BlacklistFilterRefreshToken(RefreshToken):
+    """
+    Refresh token that asks the in-process blacklist filter first and only
+    queries the blacklist when the filter reports a possible match.
+    Enabled by TOKEN_BLACKLIST_FILTER["ENABLED"].
+    """
+
+    def check_blacklist(self):
+        if filter_setting('ENABLED'):
+            jti = self.payload[api_settings.JTI_CLAIM]
+            if not blacklist_filter.might_contain(jti):
+                return
+        super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+class RBACRefreshToken(BlacklistFilterRefreshToken):
+    """
+    Refresh token whose access tokens carry the user's RBAC permission claim.
+    The claim lives only on access tokens so every refresh re-reads it.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token._user = user
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = getattr(self, '_user', None)
+        if user is None:
+            user = get_user_model().objects.filter(
+                **{api_settings.USER_ID_FIELD: self.payload.get(api_settings.USER_ID_CLAIM)}
+            ).first()
+        if user is not None:
+            add_permission_claims(access, user)
+        return access
@@ -1,7 +1,7 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+from .tokens import BlacklistFilterRefreshToken
 from rest_framework.permissions import IsAuthenticated
 
 class LogoutView(APIView):
@@ -11,7 +11,7 @@ class LogoutView(APIView):
         try:
             # get the refresh token sent from the frontend
             refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
+            token = BlacklistFilterRefreshToken(refresh_token)
 
             # mark as revoked
             token.blacklist()
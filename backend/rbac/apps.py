@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RbacConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rbac'
+
+    def ready(self):
+        import rbac.signals
+        import rbac.checks
@@ -0,0 +1,254 @@
+import threading
+
+from .models import Permission, Role, RoleClosure, RoleParent, RolePermission, UserRole
+from authcore.db import read_from_primary
+from .cache import get_rbac_version, bumped_locally
+from .wildcards import compile_grants, is_pattern
+
+
+class RBACIndex:
+    """
+    In-process compiled view of the RBAC tables.
+
+    Every permission name gets a bit position, every role an integer mask
+    holding its own and its inherited permissions, and a user's effective
+    permissions are the OR of their role masks. Wildcard grants are bits
+    like any other and are matched through their compiled trie.
+    Writes made by this process are applied incrementally; a version bump
+    coming from another process triggers a full rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self.bits = {}          # permission name -> bit position
+        self._free_bits = []
+        self._next_bit = 0
+        self._patterns = {}     # wildcard permission name -> bit position
+        self._wildcard_mask = 0
+        self.role_masks = {}    # role id -> mask
+        self.user_roles = {}    # user id -> frozenset of role ids
+        self._user_masks = {}   # user id -> mask, filled lazily
+        self._dirty_roles = set()
+        self._dirty_users = set()
+        self._reload_roles = False
+        self._reload_users = False
+
+    #-------------------------------
+    # Building
+    #-------------------------------
+    def _bit_for(self, name):
+        bit = self.bits.get(name)
+        if bit is None:
+            bit = self._free_bits.pop() if self._free_bits else self._next_bit
+            if bit == self._next_bit:
+                self._next_bit += 1
+            self.bits[name] = bit
+            if is_pattern(name):
+                self._patterns[name] = bit
+                self._wildcard_mask |= 1 << bit
+        return bit
+
+    def _load_catalog(self):
+        # keeps the bit of every permission that still exists
+        names = set(Permission.objects.values_list('name', flat=True))
+        for name in [n for n in self.bits if n not in names]:
+            bit = self.bits.pop(name)
+            if self._patterns.pop(name, None) is not None:
+                self._wildcard_mask &= ~(1 << bit)
+            self._free_bits.append(bit)
+        for name in sorted(names):
+            self._bit_for(name)
+
+    def _role_permission_rows(self, role_ids=None):
+        # (role, permission name) for every permission a role holds directly or inherits
+        rows = RoleClosure.objects.all()
+        if role_ids is not None:
+            rows = rows.filter(descendant_id__in=role_ids)
+        return rows.filter(ancestor__role_permissions__isnull=False).values_list(
+            'descendant_id', 'ancestor__role_permissions__permission__name'
+        )
+
+    def _load_role_masks(self):
+        masks = dict.fromkeys(Role.objects.values_list('id', flat=True), 0)
+        for role_id, name in self._role_permission_rows().iterator(chunk_size=10000):
+            masks[role_id] = masks.get(role_id, 0) | (1 << self.bits[name])
+        self.role_masks = masks
+        self._user_masks = {}
+
+    def _load_user_roles(self):
+        user_roles = {}
+        rows = UserRole.objects.values_list('user_id', 'role_id').order_by('user_id')
+        for user_id, role_id in rows.iterator(chunk_size=10000):
+            user_roles.setdefault(user_id, set()).add(role_id)
+        self.user_roles = {user_id: frozenset(roles) for user_id, roles in user_roles.items()}
+        self._user_masks = {}
+
+    def rebuild(self):
+        with self._lock:
+            version = get_rbac_version()
+            self._load_catalog()
+            self._load_role_masks()
+            self._load_user_roles()
+            self._dirty_roles.clear()
+            self._dirty_users.clear()
+            self._reload_roles = self._reload_users = False
+            self.version = version
+
+    def _apply_dirty(self):
+        if self._reload_roles:
+            self._load_catalog()
+            self._load_role_masks()
+            self._dirty_roles.clear()
+        elif self._dirty_roles:
+            # roles inheriting from a changed role change with it
+            roles = set(self._dirty_roles) | set(
+                RoleClosure.objects.filter(ancestor_id__in=self._dirty_roles).values_list('descendant_id', flat=True)
+            )
+            self._dirty_roles.clear()
+            masks = dict.fromkeys(Role.objects.filter(id__in=roles).values_list('id', flat=True), 0)
+            for role_id, name in self._role_permission_rows(roles):
+                masks[role_id] |= 1 << self._bit_for(name)
+            for role_id in roles:
+                if role_id in masks:
+                    self.role_masks[role_id] = masks[role_id]
+                else:
+                    self.role_masks.pop(role_id, None)
+            # any user may hold one of these roles
+            self._user_masks = {}
+
+        if self._reload_users:
+            self._load_user_roles()
+            self._dirty_users.clear()
+        elif self._dirty_users:
+            users = list(self._dirty_users)
+            self._dirty_users.clear()
+            user_roles = {}
+            for user_id, role_id in UserRole.objects.filter(user_id__in=users).values_list('user_id', 'role_id'):
+                user_roles.setdefault(user_id, set()).add(role_id)
+            for user_id in users:
+                self._user_masks.pop(user_id, None)
+                if user_id in user_roles:
+                    self.user_roles[user_id] = frozenset(user_roles[user_id])
+                else:
+                    self.user_roles.pop(user_id, None)
+
+        self._reload_roles = self._reload_users = False
+
+    def sync(self):
+        """
+        brings the index up to date with the current RBAC version
+        """
+        # the index outlives any replica lag, so it is loaded from the primary
+        with self._lock, read_from_primary():
+            version = get_rbac_version()
+            if self.version is None:
+                self.rebuild()
+            elif version != self.version and not bumped_locally(self.version, version):
+                self.rebuild()
+            else:
+                self._apply_dirty()
+                self.version = version
+
+    def mark_dirty(self, sender, instances=None):
+        """
+        records a committed change; it is applied on the next sync()
+        """
+        with self._lock:
+            if sender is Permission:
+                self._reload_roles = True
+            elif sender is Role:
+                if instances is None:
+                    self._reload_roles = True
+                else:
+                    self._dirty_roles.update(obj.pk for obj in instances)
+            elif sender is RoleParent:
+                if instances is None:
+                    self._reload_roles = True
+                else:
+                    self._dirty_roles.update(obj.role_id for obj in instances)
+            elif sender is RolePermission:
+                if instances is None:
+                    self._reload_roles = True
+                else:
+                    self._dirty_roles.update(obj.role_id for obj in instances)
+            elif sender is UserRole:
+                if instances is None:
+                    self._reload_users = True
+                else:
+                    self._dirty_users.update(obj.user_id for obj in instances)
+
+    #-------------------------------
+    # Checks
+    #-------------------------------
+    def mask_of(self, names):
+        """
+        returns the mask of the given names, or None if one of them is unknown
+        """
+        mask = 0
+        for name in names:
+            bit = self.bits.get(name)
+            if bit is None:
+                return None
+            mask |= 1 << bit
+        return mask
+
+    def user_mask(self, user_id):
+        mask = self._user_masks.get(user_id)
+        if mask is None:
+            mask = 0
+            for role_id in self.user_roles.get(user_id, ()):
+                mask |= self.role_masks.get(role_id, 0)
+            self._user_masks[user_id] = mask
+        return mask
+
+    def _wildcards_of(self, mask):
+        """
+        compiled trie of the wildcard grants in mask, or None
+        """
+        wildcards = mask & self._wildcard_mask
+        if not wildcards:
+            return None
+        return compile_grants(frozenset(n for n, bit in self._patterns.items() if wildcards >> bit & 1))
+
+    def _grants(self, mask, name, trie):
+        bit = self.bits.get(name)
+        if bit is not None and mask >> bit & 1:
+            return True
+        return trie is not None and trie.matches(name)
+
+    def has_permission(self, user_id, name):
+        with self._lock:
+            self.sync()
+            mask = self.user_mask(user_id)
+            return self._grants(mask, name, self._wildcards_of(mask))
+
+    def has_any(self, user_id, names):
+        with self._lock:
+            self.sync()
+            names = list(names)
+            user_mask = self.user_mask(user_id)
+            if user_mask & self.mask_of(n for n in names if n in self.bits):
+                return True
+            trie = self._wildcards_of(user_mask)
+            return trie is not None and any(trie.matches(n) for n in names)
+
+    def has_all(self, user_id, names):
+        with self._lock:
+            self.sync()
+            names = list(names)
+            user_mask = self.user_mask(user_id)
+            mask = self.mask_of(names)
+            if mask is not None and user_mask & mask == mask:
+                return True
+            trie = self._wildcards_of(user_mask)
+            return trie is not None and all(self._grants(user_mask, n, trie) for n in names)
+
+    def permissions_of(self, user_id):
+        with self._lock:
+            self.sync()
+            mask = self.user_mask(user_id)
+            return frozenset(name for name, bit in self.bits.items() if mask >> bit & 1)
+
+
+rbac_index = RBACIndex()
@@ -0,0 +1,319 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from authcore.db import read_from_primary
+
+VERSION_KEY = 'rbac:version'
+USER_PERMISSIONS_KEY = 'rbac:perms:{version}:{user_id}'
+USER_SUMMARY_KEY = 'rbac:summary:{version}:{user_id}:{superuser}'
+CATALOG_VERSION_KEY = 'rbac:catalog'
+CATALOG_RESPONSE_KEY = 'rbac:catalog:{version}:{name}'
+
+# versions produced by this process, so in-process structures can tell
+# their own writes apart from writes made by other workers
+_local_versions = deque(maxlen=1024)
+
+
+def _cache():
+    return caches[getattr(settings, 'RBAC_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'RBAC_CACHE_TIMEOUT', 300)
+
+
+class CacheStats:
+    """
+    In-process hit/miss counters for the effective-permission cache
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+stats = CacheStats()
+
+
+def get_cache_stats():
+    """
+    returns the hit/miss counters of this process
+    """
+    return stats.snapshot()
+
+
+def reset_cache_stats():
+    stats.reset()
+
+
+#-------------------------------
+# Global RBAC version
+#-------------------------------
+def _initial_version():
+    # seeded from the clock so a lost counter never restarts at a value
+    # that old per-user entries were stored under
+    return int(time.time() * 1000)
+
+
+def _get_version(key) -> int:
+    cache = _cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    # a cache that stores nothing (DummyCache) has nothing to invalidate either
+    return _initial_version() if version is None else version
+
+
+def _bump_version(key) -> int:
+    cache = _cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return _initial_version()
+
+
+def get_rbac_version() -> int:
+    return _get_version(VERSION_KEY)
+
+
+def bump_rbac_version() -> int:
+    """
+    invalidates every cached effective-permission set at once
+    """
+    version = _bump_version(VERSION_KEY)
+    _local_versions.append(version)
+    return version
+
+
+async def aget_rbac_version() -> int:
+    cache = _cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, _initial_version(), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return _initial_version() if version is None else version
+
+
+def bumped_locally(since: int, until: int) -> bool:
+    """
+    True when every version in (since, until] was produced by this process
+    """
+    if until < since or until - since > _local_versions.maxlen:
+        return False
+    produced = set(_local_versions)
+    return all(v in produced for v in range(since + 1, until + 1))
+
+
+class _CommitBump:
+    """
+    one bump per commit: every write in a transaction schedules a callback
+    (a rolled back savepoint drops its own) and the first that runs bumps.
+    The pending flag lives on the connection; one left behind by a rollback
+    is picked up by the next transaction
+    """
+    def __init__(self, bump, connection):
+        self.bump = bump
+        self.connection = connection
+        self.done = False
+
+    def __call__(self):
+        if self.done:
+            return
+        self.done = True
+        pending = getattr(self.connection, 'rbac_pending_bumps', {})
+        if pending.get(self.bump) is self:
+            del pending[self.bump]
+        self.bump()
+
+
+def _bump_now_and_on_commit(bump, using):
+    bump()
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        return
+    pending = connection.__dict__.setdefault('rbac_pending_bumps', {})
+    commit_bump = pending.get(bump)
+    if commit_bump is None:
+        commit_bump = pending[bump] = _CommitBump(bump, connection)
+    transaction.on_commit(commit_bump, using=using)
+
+
+def invalidate_rbac(using='default'):
+    """
+    Bump the version now and once more when the current transaction commits,
+    so readers in other processes cannot cache rows they read before commit.
+    """
+    _bump_now_and_on_commit(bump_rbac_version, using)
+
+
+#-------------------------------
+# Catalog version
+#-------------------------------
+# Moves on Role, Permission and RolePermission writes only: the role and
+# permission lists do not depend on who holds which role.
+def get_catalog_version() -> int:
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version() -> int:
+    return _bump_version(CATALOG_VERSION_KEY)
+
+
+def invalidate_catalog(using='default'):
+    _bump_now_and_on_commit(bump_catalog_version, using)
+
+
+def get_cached_catalog(name, version, loader):
+    """
+    returns the (response data, ETag) of a catalog list for version, calling loader() on a miss
+    """
+    cache = _cache()
+    key = CATALOG_RESPONSE_KEY.format(version=version, name=name)
+    entry = cache.get(key)
+    if entry is not None:
+        stats.hit()
+        return entry
+
+    stats.miss()
+    with read_from_primary():
+        entry = loader()
+    cache.set(key, entry, _timeout())
+    return entry
+
+
+#-------------------------------
+# Per-user effective permissions
+#-------------------------------
+def get_cached_permissions(user_id, loader):
+    """
+    returns the permission names of a user, calling loader() on a miss
+    """
+    cache = _cache()
+    version = get_rbac_version()
+    key = USER_PERMISSIONS_KEY.format(version=version, user_id=user_id)
+    permissions = cache.get(key)
+    if permissions is not None:
+        stats.hit()
+        return permissions
+
+    stats.miss()
+    # a replica read would be cached past the replica lag
+    with read_from_primary():
+        permissions = frozenset(loader())
+    cache.set(key, permissions, _timeout())
+    return permissions
+
+
+def get_cached_permissions_many(user_ids, loader):
+    """
+    bulk variant of get_cached_permissions; loader(missing_ids) returns a
+    dict of user id -> permission names for the ids that were not cached
+    """
+    cache = _cache()
+    version = get_rbac_version()
+    keys = {USER_PERMISSIONS_KEY.format(version=version, user_id=user_id): user_id for user_id in user_ids}
+    found = cache.get_many(keys.keys())
+    result = {keys[key]: permissions for key, permissions in found.items()}
+    for _ in result:
+        stats.hit()
+
+    missing = [user_id for user_id in user_ids if user_id not in result]
+    if missing:
+        with read_from_primary():
+            loaded = loader(missing)
+        to_store = {}
+        for user_id in missing:
+            stats.miss()
+            permissions = frozenset(loaded.get(user_id, ()))
+            result[user_id] = permissions
+            to_store[USER_PERMISSIONS_KEY.format(version=version, user_id=user_id)] = permissions
+        cache.set_many(to_store, _timeout())
+    return result
+
+
+def get_cached_summary(user, loader):
+    """
+    returns the cached roles/permissions summary of a user, calling loader() on a miss
+    """
+    cache = _cache()
+    key = USER_SUMMARY_KEY.format(
+        version=get_rbac_version(), user_id=user.pk, superuser=int(user.is_superuser)
+    )
+    summary = cache.get(key)
+    if summary is not None:
+        stats.hit()
+        return summary
+
+    stats.miss()
+    with read_from_primary():
+        summary = loader()
+    cache.set(key, summary, _timeout())
+    return summary
+
+
+#-------------------------------
+# Async variants, loader() returns an awaitable
+#-------------------------------
+async def aget_cached_permissions(user_id, loader):
+    cache = _cache()
+    version = await aget_rbac_version()
+    key = USER_PERMISSIONS_KEY.format(version=version, user_id=user_id)
+    permissions = await cache.aget(key)
+    if permissions is not None:
+        stats.hit()
+        return permissions
+
+    stats.miss()
+    with read_from_primary():
+        permissions = frozenset(await loader())
+    await cache.aset(key, permissions, _timeout())
+    return permissions
+
+
+async def aget_cached_summary(user, loader):
+    cache = _cache()
+    key = USER_SUMMARY_KEY.format(
+        version=await aget_rbac_version(), user_id=user.pk, superuser=int(user.is_superuser)
+    )
+    summary = await cache.aget(key)
+    if summary is not None:
+        stats.hit()
+        return summary
+
+    stats.miss()
+    with read_from_primary():
+        summary = await loader()
+    await cache.aset(key, summary, _timeout())
+    return summary
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.caches)
+def check_rbac_cache_is_shared(app_configs, **kwargs):
+    """
+    revocations bump the RBAC version in the cache; with a per-process
+    backend the other workers keep serving the old permissions until
+    RBAC_CACHE_TIMEOUT
+    """
+    if getattr(settings, 'RBAC_CACHE_SINGLE_PROCESS', False):
+        return []
+    alias = getattr(settings, 'RBAC_CACHE_ALIAS', 'default')
+    if isinstance(caches[alias], LocMemCache):
+        return [Error(
+            f"RBAC_CACHE_ALIAS '{alias}' uses a per-process cache: a role revoked through one "
+            "worker stays granted in the others for up to RBAC_CACHE_TIMEOUT.",
+            hint="Point it at a shared backend (Redis, Memcached; REDIS_URL), or set "
+                 "RBAC_CACHE_SINGLE_PROCESS = True when one process serves every request.",
+            id='rbac.E001',
+        )]
+    return []
@@ -0,0 +1,43 @@
+from .cache import aget_rbac_version, get_rbac_version
+
+PERMISSIONS_CLAIM = 'perms'
+VERSION_CLAIM = 'rbac_v'
+
+
+def add_permission_claims(token, user):
+    """
+    stamps the user's effective permissions and the current RBAC version on a token
+    """
+    from .services import get_user_permissions
+
+    token[VERSION_CLAIM] = get_rbac_version()
+    token[PERMISSIONS_CLAIM] = [] if user.is_superuser else sorted(get_user_permissions(user))
+    return token
+
+
+def _read_claims(token):
+    if token is None or not hasattr(token, 'get'):
+        return None, None
+    return token.get(PERMISSIONS_CLAIM), token.get(VERSION_CLAIM)
+
+
+def permissions_from_token(token):
+    """
+    returns the permission names claimed by a token, or None when the token
+    has no claim or was issued before the last RBAC change
+    """
+    claimed, version = _read_claims(token)
+    if claimed is None or version is None:
+        return None
+    if version != get_rbac_version():
+        return None
+    return frozenset(claimed)
+
+
+async def apermissions_from_token(token):
+    claimed, version = _read_claims(token)
+    if claimed is None or version is None:
+        return None
+    if version != await aget_rbac_version():
+        return None
+    return frozenset(claimed)
@@ -0,0 +1,174 @@
+"""
+Materialized effective permissions.
+
+UserEffectivePermission holds one row per (user, permission) a user is
+granted through their global roles, inherited permissions included, so a
+check is one probe on its (user, permission) unique index instead of the
+UserRole -> RoleClosure -> RolePermission join. Wildcard grants are stored
+as the pattern permissions they are; a check looks up the requested name
+and every pattern that would match it (wildcards.candidate_patterns).
+Scoped roles stay in rbac.scopes.
+
+Every RBAC write recomputes only the slice it can affect (the holders of
+the roles involved, and the permissions involved when known) and applies
+the difference. Opt-in with RBAC_MATERIALIZED_PERMISSIONS; after turning
+it on, or to repair drift reported by the checker, run
+`manage.py rebuild_effective_permissions`.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .models import RoleParent, RolePermission, UserEffectivePermission, UserRole
+from .wildcards import candidate_patterns
+
+BATCH_SIZE = 2000
+# UserRole -> roles it inherits from (itself included) -> their permissions
+GRANTED_PERMISSION = 'role__ancestor_links__ancestor__role_permissions__permission_id'
+
+
+def materialized_enabled():
+    return getattr(settings, 'RBAC_MATERIALIZED_PERMISSIONS', False)
+
+
+def _batches(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def holders(role_ids):
+    """
+    ids of the users holding one of the roles or a role inheriting from them
+    """
+    return set(
+        UserRole.objects.filter(role__ancestor_links__ancestor_id__in=list(role_ids))
+        .values_list('user_id', flat=True)
+    )
+
+
+def diff(user_ids, permission_ids=None):
+    """
+    compares the table with the grants of the users, limited to
+    permission_ids when given; returns (missing pairs, ids of extra rows)
+    """
+    # one filter() call, so the selected permission comes from the filtered join
+    lookups = {f'{GRANTED_PERMISSION}__isnull': False}
+    stored = UserEffectivePermission.objects.filter(user_id__in=user_ids)
+    if permission_ids is not None:
+        lookups = {f'{GRANTED_PERMISSION}__in': permission_ids}
+        stored = stored.filter(permission_id__in=permission_ids)
+
+    wanted = set(
+        UserRole.objects.filter(user_id__in=user_ids, **lookups).values_list('user_id', GRANTED_PERMISSION)
+    )
+    extra = []
+    for pk, user_id, permission_id in stored.values_list('pk', 'user_id', 'permission_id'):
+        if (user_id, permission_id) in wanted:
+            wanted.discard((user_id, permission_id))
+        else:
+            extra.append(pk)
+    return wanted, extra
+
+
+def sync(user_ids, permission_ids=None):
+    """
+    brings the rows of the users (and permissions) in line with their
+    grants; returns (rows added, rows removed)
+    """
+    added = removed = 0
+    if permission_ids is not None:
+        permission_ids = list(permission_ids)
+    with transaction.atomic():
+        for batch in _batches(user_ids):
+            missing, extra = diff(batch, permission_ids)
+            if missing:
+                UserEffectivePermission.objects.bulk_create(
+                    [UserEffectivePermission(user_id=u, permission_id=p) for u, p in missing],
+                    batch_size=1000, ignore_conflicts=True
+                )
+            if extra:
+                UserEffectivePermission.objects.filter(pk__in=extra).delete()
+            added += len(missing)
+            removed += len(extra)
+    return added, removed
+
+
+def _all_user_ids():
+    return (
+        set(UserRole.objects.values_list('user_id', flat=True))
+        | set(UserEffectivePermission.objects.values_list('user_id', flat=True))
+    )
+
+
+def rebuild():
+    """
+    syncs every user that holds a role or has rows; returns (rows added, rows removed)
+    """
+    return sync(_all_user_ids())
+
+
+def check(samples=20):
+    """
+    returns {'missing', 'extra', 'samples'} without writing anything
+    """
+    report = {'missing': 0, 'extra': 0, 'samples': []}
+    for batch in _batches(_all_user_ids()):
+        missing, extra = diff(batch)
+        report['missing'] += len(missing)
+        report['extra'] += len(extra)
+        if len(report['samples']) < samples:
+            report['samples'] += [('missing', u, p) for u, p in missing]
+            report['samples'] += [
+                ('extra', u, p) for u, p in
+                UserEffectivePermission.objects.filter(pk__in=extra[:samples]).values_list('user_id', 'permission_id')
+            ]
+            report['samples'] = report['samples'][:samples]
+    return report
+
+
+def _candidates(names):
+    candidates = []
+    for name in names:
+        patterns = candidate_patterns(name)
+        if patterns is None:
+            return None
+        candidates += patterns
+    return candidates
+
+
+def probe(user_id, names):
+    """
+    True when the table grants the user one of the names, exactly or through
+    a stored wildcard pattern; None when a name cannot be enumerated
+    """
+    candidates = _candidates(names)
+    if candidates is None:
+        return None
+    return UserEffectivePermission.objects.filter(user_id=user_id, permission__name__in=candidates).exists()
+
+
+async def aprobe(user_id, names):
+    candidates = _candidates(names)
+    if candidates is None:
+        return None
+    return await UserEffectivePermission.objects.filter(user_id=user_id, permission__name__in=candidates).aexists()
+
+
+def maintain_effective_permissions(sender, instances=None, **kwargs):
+    """
+    rbac_changed receiver; connected after maintain_closure, so it reads the current closure.
+    Permission deletes cascade to the table; Role deletes notify through
+    their UserRole, RolePermission and RoleParent rows
+    """
+    if not materialized_enabled() or sender not in (UserRole, RolePermission, RoleParent):
+        return
+    if instances is None:
+        # a queryset update can move rows anywhere
+        rebuild()
+    elif sender is UserRole:
+        sync({obj.user_id for obj in instances})
+    elif sender is RolePermission:
+        sync(holders({obj.role_id for obj in instances}), {obj.permission_id for obj in instances})
+    else:
+        # inheritance changed for the role and every role below it
+        sync(holders({obj.role_id for obj in instances}))
@@ -0,0 +1,193 @@
+"""
+Role inheritance.
+
+RoleParent holds the edges (a role inherits from its parents) and
+RoleClosure every (ancestor, descendant, depth) pair, depth 0 included, so
+permission loaders resolve inherited permissions with one indexed join.
+The closure is rewritten only for the roles below a changed edge.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Role, RoleClosure, RoleParent
+
+
+class RoleCycleError(ValueError):
+    pass
+
+
+def lock_roles(role_id, parent_ids):
+    """
+    row locks on the role, the parents and every ancestor of the parents. Two
+    transactions adding edges that would only close a cycle together both
+    lock the roles at their ends, so the second one checks after the first commits
+    """
+    role_ids = {role_id, *parent_ids} | set(
+        RoleClosure.objects.filter(descendant_id__in=parent_ids).values_list('ancestor_id', flat=True)
+    )
+    list(Role.objects.select_for_update().filter(id__in=role_ids).order_by('id').values_list('id', flat=True))
+
+
+def check_cycle(role_id, *parent_ids):
+    """
+    raises RoleCycleError if role inheriting from the parents would close a
+    cycle, that is if one of them already descends from role. Runs inside
+    the transaction that adds the edges, which keeps the locks until it commits
+    """
+    lock_roles(role_id, parent_ids)
+    if role_id in parent_ids or RoleClosure.objects.filter(
+        ancestor_id=role_id, descendant_id__in=parent_ids
+    ).exists():
+        raise RoleCycleError("La jerarquía de roles no puede tener ciclos")
+
+
+def ensure_self_rows(role_ids):
+    # bulk_create(ignore_conflicts=True) also hands back roles it skipped
+    role_ids = Role.objects.filter(id__in=list(role_ids)).values_list('id', flat=True)
+    RoleClosure.objects.bulk_create(
+        [RoleClosure(ancestor_id=role_id, descendant_id=role_id, depth=0) for role_id in role_ids],
+        ignore_conflicts=True
+    )
+
+
+def _ancestors(parents, role_id):
+    """
+    breadth-first walk up the edges; returns {ancestor: shortest depth}
+    """
+    depths = {role_id: 0}
+    frontier = [role_id]
+    while frontier:
+        following = []
+        for current in frontier:
+            for parent_id in parents.get(current, ()):
+                if parent_id not in depths:
+                    depths[parent_id] = depths[current] + 1
+                    following.append(parent_id)
+        frontier = following
+    return depths
+
+
+def _parent_map():
+    parents = defaultdict(set)
+    for role_id, parent_id in RoleParent.objects.values_list('role_id', 'parent_id'):
+        parents[role_id].add(parent_id)
+    return parents
+
+
+def _resolve(role_id, parents, known):
+    """
+    fills known[role_id] with {ancestor: shortest depth}, resolving the
+    parents first; known already holds the roles whose rows are kept
+    """
+    stack = [role_id]
+    while stack:
+        current = stack[-1]
+        if current in known:
+            stack.pop()
+            continue
+        pending = [parent_id for parent_id in parents.get(current, ()) if parent_id not in known]
+        if pending:
+            stack.extend(pending)
+            continue
+        depths = {current: 0}
+        for parent_id in parents.get(current, ()):
+            for ancestor_id, depth in known[parent_id].items():
+                if depth + 1 < depths.get(ancestor_id, depth + 2):
+                    depths[ancestor_id] = depth + 1
+        known[current] = depths
+        stack.pop()
+
+
+def update_closure(role_ids):
+    """
+    rewrites the closure rows of the given roles and of every role below them,
+    after edges starting at those roles were added or removed. Reads only the
+    edges of those roles and the closure rows of their parents outside them
+    """
+    role_ids = set(role_ids)
+    if not role_ids:
+        return
+    with transaction.atomic():
+        affected = role_ids | set(
+            RoleClosure.objects.filter(ancestor_id__in=role_ids).values_list('descendant_id', flat=True)
+        )
+        # roles removed by a cascade have no rows left to rewrite
+        affected = set(Role.objects.filter(id__in=affected).values_list('id', flat=True))
+        parents = defaultdict(set)
+        for role_id, parent_id in RoleParent.objects.filter(role_id__in=affected).values_list('role_id', 'parent_id'):
+            parents[role_id].add(parent_id)
+
+        # a role outside the affected ones is not below a changed edge: its rows stand
+        outside = set().union(*parents.values()) - affected
+        known = {}
+        for ancestor_id, descendant_id, depth in RoleClosure.objects.filter(
+            descendant_id__in=outside
+        ).values_list('ancestor_id', 'descendant_id', 'depth'):
+            known.setdefault(descendant_id, {})[ancestor_id] = depth
+        for role_id in affected:
+            _resolve(role_id, parents, known)
+
+        rows = [
+            RoleClosure(ancestor_id=ancestor_id, descendant_id=role_id, depth=depth)
+            for role_id in affected
+            for ancestor_id, depth in known[role_id].items()
+        ]
+        RoleClosure.objects.filter(descendant_id__in=affected).delete()
+        RoleClosure.objects.bulk_create(rows, batch_size=1000)
+
+
+def rebuild_closure():
+    """
+    recomputes the whole closure from RoleParent
+    """
+    with transaction.atomic():
+        parents = _parent_map()
+        RoleClosure.objects.all().delete()
+        RoleClosure.objects.bulk_create(
+            [
+                RoleClosure(ancestor_id=ancestor_id, descendant_id=role_id, depth=depth)
+                for role_id in Role.objects.values_list('id', flat=True).iterator(chunk_size=10000)
+                for ancestor_id, depth in _ancestors(parents, role_id).items()
+            ],
+            batch_size=1000
+        )
+
+
+def add_parents(role, parent_ids):
+    """
+    makes role inherit from every given parent; returns the number of new edges
+    """
+    with transaction.atomic():
+        existing = set(RoleParent.objects.filter(role=role).values_list('parent_id', flat=True))
+        new = [parent_id for parent_id in dict.fromkeys(parent_ids) if parent_id not in existing]
+        if new:
+            check_cycle(role.pk, *new)
+        RoleParent.objects.bulk_create([RoleParent(role=role, parent_id=parent_id) for parent_id in new])
+    return len(new)
+
+
+def remove_parents(role, parent_ids):
+    return len(RoleParent.objects.filter(role=role, parent_id__in=parent_ids).bulk_delete())
+
+
+def drop_closure_rows(sender, instance, **kwargs):
+    """
+    post_delete receiver for Role. The edge signals of a cascade run before
+    the role row is deleted and may have rewritten its rows
+    """
+    RoleClosure.objects.filter(Q(ancestor_id=instance.pk) | Q(descendant_id=instance.pk)).delete()
+
+
+def maintain_closure(sender, instances=None, created=False, **kwargs):
+    """
+    rbac_changed receiver keeping RoleClosure in step with Role and RoleParent
+    """
+    if sender is Role and instances and created:
+        ensure_self_rows(obj.pk for obj in instances)
+    elif sender is RoleParent:
+        if instances is None:
+            rebuild_closure()
+        else:
+            update_closure(obj.role_id for obj in instances)
@@ -0,0 +1,109 @@
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from authcore.benchmarking import measure, write_results
+from rbac.bitmask import RBACIndex
+from rbac.models import Permission, Role, RolePermission, UserRole
+from users.models import User
+
+BATCH_SIZE = 20000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Permission.objects.filter(...).exists() with the bitmask index. "
+        "Seeds a synthetic dataset inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roles', type=int, default=10000)
+        parser.add_argument('--assignments', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=None,
+                            help='defaults to assignments / 10')
+        parser.add_argument('--permissions', type=int, default=200)
+        parser.add_argument('--perms-per-role', type=int, default=10)
+        parser.add_argument('--checks', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = options['users'] or max(1, options['assignments'] // 10)
+        options['users'] = users
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            user_ids, perm_names = self.seed(rng, options)
+            seed_seconds = time.perf_counter() - started
+            self.stdout.write(f"seeded in {seed_seconds:.1f}s", self.style.NOTICE)
+
+            checks = [(rng.choice(user_ids), rng.choice(perm_names)) for _ in range(options['checks'])]
+            groups = [(rng.choice(user_ids), rng.sample(perm_names, 3)) for _ in range(options['checks'])]
+
+            def orm_check(user_id, name):
+                return Permission.objects.filter(
+                    name=name,
+                    permission_roles__role__role_assignments__user_id=user_id
+                ).exists()
+
+            index = RBACIndex()
+            started = time.perf_counter()
+            index.rebuild()
+            build_seconds = time.perf_counter() - started
+
+            # both paths must agree before their timings mean anything
+            for user_id, name in checks[:200]:
+                if orm_check(user_id, name) != index.has_permission(user_id, name):
+                    raise CommandError(f"the ORM and the index disagree on user {user_id} and {name!r}")
+
+            results = {
+                'dataset': {k: options[k] for k in ('roles', 'assignments', 'users', 'permissions', 'perms_per_role')},
+                'seed_seconds': seed_seconds,
+                'index_build_seconds': build_seconds,
+                'orm_exists': measure(orm_check, checks),
+                'index_has_permission': measure(index.has_permission, checks),
+                'index_has_any': measure(index.has_any, groups),
+                'index_has_all': measure(index.has_all, groups),
+            }
+            transaction.set_rollback(True)
+
+        write_results(results, options['output'], self.stdout)
+
+    def seed(self, rng, options):
+        perm_names = [f"bench.perm{i}" for i in range(options['permissions'])]
+        permissions = Permission.objects.bulk_create(
+            [Permission(name=name) for name in perm_names], batch_size=BATCH_SIZE
+        )
+        roles = Role.objects.bulk_create(
+            [Role(name=f"bench-role-{uuid.uuid4().hex}") for _ in range(options['roles'])],
+            batch_size=BATCH_SIZE
+        )
+        per_role = min(options['perms_per_role'], len(permissions))
+        RolePermission.objects.bulk_create(
+            [RolePermission(role=role, permission=perm)
+             for role in roles for perm in rng.sample(permissions, per_role)],
+            batch_size=BATCH_SIZE
+        )
+
+        users = User.objects.bulk_create(
+            [User(email=f"bench-{uuid.uuid4().hex}@bench.local", password='!') for _ in range(options['users'])],
+            batch_size=BATCH_SIZE
+        )
+        user_ids = [u.id for u in users]
+        role_ids = [r.id for r in roles]
+        per_user = max(1, min(len(role_ids), options['assignments'] // len(user_ids)))
+
+        batch = []
+        for user_id in user_ids:
+            for role_id in rng.sample(role_ids, per_user):
+                batch.append(UserRole(user_id=user_id, role_id=role_id))
+            if len(batch) >= BATCH_SIZE:
+                UserRole.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+                batch = []
+        if batch:
+            UserRole.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+        return user_ids, perm_names
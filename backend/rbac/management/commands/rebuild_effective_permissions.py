@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rbac.effective import check, materialized_enabled, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the materialized user -> permission table (rbac.UserEffectivePermission) from "
+        "the roles, role inheritance and role permissions. With --check, only report rows that "
+        "are missing or should not be there, and fail if there are any."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='compare without writing')
+        parser.add_argument('--samples', type=int, default=20, help='differences listed by --check')
+
+    def handle(self, *args, **options):
+        if not materialized_enabled():
+            self.stdout.write(self.style.WARNING(
+                "RBAC_MATERIALIZED_PERMISSIONS is off: the table is not kept in sync nor read"
+            ))
+
+        if options['check']:
+            report = check(options['samples'])
+            for kind, user_id, permission_id in report['samples']:
+                self.stdout.write(f"{kind}: user {user_id} permission {permission_id}")
+            if report['missing'] or report['extra']:
+                raise CommandError(
+                    f"{report['missing']} rows missing, {report['extra']} extra rows; "
+                    f"run rebuild_effective_permissions"
+                )
+            self.stdout.write(self.style.SUCCESS("Effective permissions are consistent"))
+            return
+
+        added, removed = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Effective permissions rebuilt: {added} rows added, {removed} removed"))
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:31
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+def add_self_rows(apps, schema_editor):
+    # every existing role is its own depth 0 ancestor
+    Role = apps.get_model('rbac', 'Role')
+    RoleClosure = apps.get_model('rbac', 'RoleClosure')
+    RoleClosure.objects.bulk_create(
+        [RoleClosure(ancestor_id=pk, descendant_id=pk, depth=0)
+         for pk in Role.objects.values_list('id', flat=True)],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rbac', '0002_alter_userrole_role'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoleClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='rbac.role')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='rbac.role')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='rbac_closure_desc_idx')],
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RoleParent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='child_links', to='rbac.role')),
+                ('role', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parent_links', to='rbac.role')),
+            ],
+            options={
+                'unique_together': {('role', 'parent')},
+            },
+        ),
+        migrations.RunPython(add_self_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:36
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('rbac', '0003_role_hierarchy'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScopedUserRole',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('object_id', models.CharField(max_length=64)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('role', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scoped_assignments', to='rbac.role')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scoped_roles', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'content_type', 'object_id'], name='rbac_scoped_user_idx'), models.Index(fields=['content_type', 'object_id'], name='rbac_scoped_object_idx')],
+                'unique_together': {('user', 'role', 'content_type', 'object_id')},
+            },
+        ),
+    ]
@@ -1,13 +1,92 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.contrib.contenttypes.models import ContentType
 import uuid
 from users.models import User # user custom
 from django.conf import settings
 
+
+class RBACQuerySet(models.QuerySet):
+    """
+    Bulk writes skip post_save/post_delete, so they announce the change
+    through rbac_changed themselves
+    """
+    def _changed(self, instances=None, created=False):
+        from .signals import rbac_changed
+        rbac_changed.send(sender=self.model, instances=instances, using=self.db, created=created)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            self._changed(list(objs), created=True)
+        return objs
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            self._changed()
+        return rows
+    update.alters_data = True
+
+    def bulk_delete(self, batch_size=500):
+        """
+        deletes the matching rows with one DELETE per batch and a single
+        rbac_changed, instead of one post_delete per row. Only for rows nothing
+        else references (UserRole, RolePermission); returns the deleted objects
+        """
+        instances = list(self)
+        # plain SQL: QuerySet.delete() would announce the rows again, and
+        # UserRole has a post_delete receiver (audit) that loads them one by one
+        connection = connections[self.db]
+        pk = self.model._meta.pk
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        column = connection.ops.quote_name(pk.column)
+        with connection.cursor() as cursor:
+            for start in range(0, len(instances), batch_size):
+                pks = [pk.get_db_prep_value(obj.pk, connection) for obj in instances[start:start + batch_size]]
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(pks))})", pks
+                )
+        if instances:
+            self._changed(instances)
+        return instances
+    bulk_delete.alters_data = True
+
+
+class RBACLinkQuerySet(RBACQuerySet):
+    """
+    rows linking users, roles and permissions. They have no post_delete
+    receiver, so deleting a user or a role cascades to them with one DELETE;
+    rbac.signals announces those cascades once per delete
+    """
+    def delete(self):
+        instances = list(self)
+        result = super().delete()
+        if instances:
+            self._changed(instances)
+        return result
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class RBACLinkMixin:
+    """
+    announces an instance delete, the same way RBACLinkQuerySet does for a queryset
+    """
+    def delete(self, using=None, keep_parents=False):
+        from .signals import rbac_changed
+        using = using or self._state.db
+        result = super().delete(using=using, keep_parents=keep_parents)
+        rbac_changed.send(sender=type(self), instances=[self], using=using, created=False)
+        return result
+
+
 class Permission(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
 
+    objects = RBACQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Permission"
         verbose_name_plural = "Permissions"
@@ -28,6 +107,8 @@ class Role(models.Model):
         blank=True
     )
 
+    objects = RBACQuerySet.as_manager()
+
     class Meta:
         verbose_name ="Role"
         verbose_name_plural = "Roles"
@@ -35,17 +116,53 @@ class Role(models.Model):
     def __str__(self):
         return self.name
     
-class RolePermission(models.Model):
+class RoleParent(RBACLinkMixin, models.Model):
+    """
+    role inherits every permission of parent
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    role = models.ForeignKey(Role, on_delete=models.CASCADE, related_name="parent_links")
+    parent = models.ForeignKey(Role, on_delete=models.CASCADE, related_name="child_links")
+
+    objects = RBACLinkQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("role", "parent")
+
+    def save(self, *args, **kwargs):
+        from .hierarchy import check_cycle
+        with transaction.atomic():
+            check_cycle(self.role_id, self.parent_id)
+            super().save(*args, **kwargs)
+
+
+class RoleClosure(models.Model):
+    """
+    transitive closure of RoleParent, maintained by rbac.hierarchy. Every role
+    has a depth 0 row to itself, so "roles whose permissions apply" is one join
+    """
+    ancestor = models.ForeignKey(Role, on_delete=models.CASCADE, related_name="descendant_links")
+    descendant = models.ForeignKey(Role, on_delete=models.CASCADE, related_name="ancestor_links")
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+        indexes = [
+            models.Index(fields=["descendant", "ancestor"], name="rbac_closure_desc_idx"),
+        ]
+
+
+class RolePermission(RBACLinkMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     role = models.ForeignKey(Role, on_delete=models.CASCADE, related_name="role_permissions")
     permission  = models.ForeignKey(Permission, on_delete=models.CASCADE, related_name="permission_roles")
-        
-        
+
+    objects = RBACLinkQuerySet.as_manager()
 
     class Meta:
         unique_together = ("role", "permission")
 
-class UserRole(models.Model):
+class UserRole(RBACLinkMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     
     user = models.ForeignKey(
@@ -58,5 +175,50 @@ class UserRole(models.Model):
         on_delete=models.CASCADE,
         related_name="role_assignments",
     )
+
+    objects = RBACLinkQuerySet.as_manager()
+
     class Meta:
         unique_together = ("user", "role")
+
+
+class ScopedUserRole(models.Model):
+    """
+    role granted to a user on one object only (content_type, object_id),
+    e.g. a group or tenant, instead of globally
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="scoped_roles",
+    )
+    role = models.ForeignKey(Role, on_delete=models.CASCADE, related_name="scoped_assignments")
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ("user", "role", "content_type", "object_id")
+        indexes = [
+            # "objects of this type the user holds a role on"
+            models.Index(fields=["user", "content_type", "object_id"], name="rbac_scoped_user_idx"),
+            # "who holds a role on this object"
+            models.Index(fields=["content_type", "object_id"], name="rbac_scoped_object_idx"),
+        ]
+
+
+class UserEffectivePermission(models.Model):
+    """
+    (user, permission) for every permission a user holds through their global
+    roles, inherited ones included. Maintained by rbac.effective when
+    RBAC_MATERIALIZED_PERMISSIONS is on; scoped roles are not included
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="effective_permissions",
+    )
+    permission = models.ForeignKey(Permission, on_delete=models.CASCADE, related_name="effective_grants")
+
+    class Meta:
+        unique_together = ("user", "permission")
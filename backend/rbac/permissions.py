@@ -1,20 +1,39 @@
+from django.contrib.auth import get_user_model
 from rest_framework.permissions import BasePermission
 from rbac.services import has_permission
+from rbac.scopes import has_scoped_permission
     
 class RBACPermission(BasePermission):
    """
    Generic permmission based in RBAC
    """
    permission_map = {}
+   # actions a scoped grant is enough for; the view narrows their queryset
+   # to the objects in scope (rbac.scopes.filter_queryset_for_user)
+   scoped_actions = ()
+
+   def get_required_permission(self, request, view):
+      return self.permission_map.get(view.action)
+
+   def get_scope_model(self):
+      return None
+
+   def has_scoped_permission(self, request, view, required_permission):
+      scope_model = self.get_scope_model()
+      if getattr(view, 'action', None) not in self.scoped_actions or scope_model is None:
+         return False
+      return has_scoped_permission(request.user, required_permission, scope_model)
 
    def has_permission(self, request, view):
       if not request.user or not request.user.is_authenticated:
          return False
       
-      required_permission = self.permission_map.get(view.action)
+      required_permission = self.get_required_permission(request, view)
       if not required_permission:
          return False
-      return has_permission(request.user, required_permission)
+      if has_permission(request.user, required_permission, token=request.auth):
+         return True
+      return self.has_scoped_permission(request, view, required_permission)
    
 class UserPermission(RBACPermission):
       """
@@ -30,6 +49,10 @@ class UserPermission(RBACPermission):
         'roles': 'assign.role',
         'roles': 'user_role.delete'
       }
+      scoped_actions = ('list', 'retrieve', 'update', 'partial_update', 'destroy')
+
+      def get_scope_model(self):
+        return get_user_model()
 
 class RolePermission(RBACPermission):
       """
@@ -43,24 +66,24 @@ class RolePermission(RBACPermission):
         'partial_update': 'role.change',
         'destroy': 'role.delete',
         "assign_permissions": "role.view", 
+        "parents": "role.view",
+        "delete_parents": "role.change",
       }
 
+      def get_required_permission(self, request, view):
+        if view.action in ("assign_permissions", "parents"):
+          if request.method == "GET":
+            return "role.view"
+          elif request.method in ("POST", "PUT"):
+            return "role.change"
+        return self.permission_map.get(view.action)
+
       def has_permission(self, request, view):
         if not request.user or not request.user.is_authenticated:
           return False
         if request.user.is_superuser:
                return True
-           
-        required_permission = self.permission_map.get(view.action)
-        if not required_permission:
-          return False
-           
-        if view.action == "assign_permissions":
-          if request.method == "GET":
-            required_permission = "role.view"
-          elif request.method == "POST":
-            required_permission = "role.change"
-        return has_permission(request.user, required_permission)
+        return super().has_permission(request, view)
 
 class PermissionPermission(RBACPermission):
       """
@@ -74,4 +97,22 @@ class PermissionPermission(RBACPermission):
         'partial_update': 'permission.change',
         'destroy': 'permission.delete',
         
-      }
\ No newline at end of file
+      }
+
+class BulkUserRolePermission(RBACPermission):
+      """
+      RBAC permissions for the bulk role assignment endpoints
+      """
+      permission_map = {
+        'bulk_assign': 'assign.role',
+        'bulk_unassign': 'user_role.delete',
+      }
+
+class AuthzCheckPermission(RBACPermission):
+      """
+      RBAC permission for the batch authorization endpoint
+      """
+      required_permission = 'authz.check'
+
+      def get_required_permission(self, request, view):
+        return self.required_permission
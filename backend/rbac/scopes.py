@@ -0,0 +1,126 @@
+"""
+Object-level authorization through ScopedUserRole.
+
+A role granted on one object gives its permissions (inherited ones and
+wildcards included) on that object only. filter_queryset_for_user narrows a
+queryset to the objects a user may act on with one lookup on the scoped
+assignments, kept as a subquery so the rows are authorized in SQL.
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import UUIDField, Value
+from django.db.models.functions import Cast, Replace
+
+from .models import ScopedUserRole
+from .services import has_permission
+from .wildcards import candidate_patterns, grants
+
+
+def grant_scoped_role(user, role, obj):
+    assignment, _ = ScopedUserRole.objects.get_or_create(
+        user=user,
+        role=role,
+        content_type=ContentType.objects.get_for_model(obj),
+        object_id=str(obj.pk),
+    )
+    return assignment
+
+
+def scoped_assignments(user, permission_name, model):
+    """
+    the user's ScopedUserRole rows on model objects that give permission_name,
+    exactly or through a wildcard; None when the name has too many segments
+    to look up its candidate patterns
+    """
+    patterns = candidate_patterns(permission_name)
+    if patterns is None:
+        return None
+    return ScopedUserRole.objects.filter(
+        user=user,
+        content_type=ContentType.objects.get_for_model(model),
+        role__ancestor_links__ancestor__role_permissions__permission__name__in=patterns,
+    )
+
+
+def _matched_object_ids(user, permission_name, model):
+    # names too long for candidate_patterns: match the grants of each object
+    rows = ScopedUserRole.objects.filter(
+        user=user, content_type=ContentType.objects.get_for_model(model)
+    ).values_list('object_id', 'role__ancestor_links__ancestor__role_permissions__permission__name')
+
+    granted = defaultdict(set)
+    for object_id, name in rows:
+        if name is not None:
+            granted[object_id].add(name)
+    return [object_id for object_id, names in granted.items() if grants(frozenset(names), permission_name)]
+
+
+def _object_id_as_pk(model):
+    """
+    object_id (str(obj.pk)) as the model's primary key column holds it
+    """
+    pk = model._meta.pk
+    if isinstance(pk, UUIDField) and not connection.features.has_native_uuid_field:
+        # stored as 32 hex characters
+        return Replace('object_id', Value('-'), Value(''))
+    return Cast('object_id', output_field=pk.__class__())
+
+
+def scoped_object_ids_query(user, permission_name, model):
+    """
+    primary keys of the model objects on which a scoped role gives the user
+    permission_name, as a subquery for pk__in (or a list for long names)
+    """
+    assignments = scoped_assignments(user, permission_name, model)
+    if assignments is None:
+        return _matched_object_ids(user, permission_name, model)
+    return assignments.values_list(_object_id_as_pk(model), flat=True)
+
+
+def scoped_object_ids(user, permission_name, model):
+    """
+    primary keys of the model objects on which a scoped role gives the user
+    permission_name, with one query
+    """
+    if not user or not user.is_authenticated:
+        return []
+    assignments = scoped_assignments(user, permission_name, model)
+    if assignments is None:
+        object_ids = _matched_object_ids(user, permission_name, model)
+    else:
+        object_ids = assignments.values_list('object_id', flat=True).distinct()
+    to_python = model._meta.pk.to_python
+    return [to_python(object_id) for object_id in object_ids]
+
+
+def has_scoped_permission(user, permission_name, model):
+    """
+    True when the user holds permission_name on at least one model object
+    """
+    if not user or not user.is_authenticated:
+        return False
+    assignments = scoped_assignments(user, permission_name, model)
+    if assignments is None:
+        return bool(_matched_object_ids(user, permission_name, model))
+    return assignments.exists()
+
+
+def filter_queryset_for_user(user, queryset, permission_name, scope_model=None, scope_field='pk'):
+    """
+    returns the part of queryset the user may act on with permission_name:
+    everything for a global grant, otherwise the rows whose scope_field
+    points at an object the user holds a scoped grant on.
+
+    scope_model / scope_field: the scope objects and the path to them,
+    e.g. Group and 'group_id'; by default rows are their own scope
+    """
+    if has_permission(user, permission_name):
+        return queryset
+    if not user or not user.is_authenticated:
+        return queryset.none()
+    scope_model = scope_model or queryset.model
+    return queryset.filter(**{
+        f'{scope_field}__in': scoped_object_ids_query(user, permission_name, scope_model)
+    })
@@ -1,4 +1,7 @@
+from collections import defaultdict
+
 from rest_framework import serializers
+from authcore.fastlist import ValuesRenderer
 from .models import Role, Permission, UserRole, RolePermission
 
 
@@ -72,8 +75,83 @@ class AssignPermissionsSerializer(serializers.Serializer):
                 f"Permisos no existentes: {', '.join(invalid_ids)}"
             )
         return value
+class AssignParentsSerializer(serializers.Serializer):
+    parents = serializers.ListField(
+        child=serializers.UUIDField(),
+        allow_empty=True
+    )
+
+    def validate_parents(self, value):
+        """
+        check that all parent roles exist in the database
+        """
+        existing_ids = set(Role.objects.filter(id__in=value).values_list('id', flat=True))
+        invalid_ids = [str(v) for v in value if v not in existing_ids]
+        if invalid_ids:
+            raise serializers.ValidationError(
+                f"Roles no existentes: {', '.join(invalid_ids)}"
+            )
+        return value
+
 class AssignRolesSerializer(serializers.Serializer):
     roles = serializers.ListField(
         child=serializers.UUIDField(),
         allow_empty=False
     )
+
+class AuthzCheckItemSerializer(serializers.Serializer):
+    user = serializers.UUIDField()
+    permission = serializers.CharField(max_length=100)
+
+class AuthzCheckSerializer(serializers.Serializer):
+    checks = AuthzCheckItemSerializer(many=True, allow_empty=False, max_length=1000)
+
+class BulkUserRoleSerializer(serializers.Serializer):
+    users = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=10000)
+    roles = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=100)
+
+    def validate_users(self, value):
+        """
+        check that all users exist with one query; returns {id: email}
+        """
+        found = dict(get_user_model().objects.filter(id__in=set(value)).values_list('id', 'email'))
+        invalid_ids = sorted({str(v) for v in value if v not in found})
+        if invalid_ids:
+            raise serializers.ValidationError(
+                f"Usuarios no existentes: {', '.join(invalid_ids)}"
+            )
+        return found
+
+    def validate_roles(self, value):
+        """
+        check that all roles exist with one query; returns {id: name}
+        """
+        found = dict(Role.objects.filter(id__in=set(value)).values_list('id', 'name'))
+        invalid_ids = sorted({str(v) for v in value if v not in found})
+        if invalid_ids:
+            raise serializers.ValidationError(
+                f"Roles no existentes: {', '.join(invalid_ids)}"
+            )
+        return found
+
+
+#-------------------------------
+# values_list() renderers for the list endpoints (authcore.fastlist)
+#-------------------------------
+PERMISSION_VALUES = ValuesRenderer(PermissionSerializer)
+
+
+def _role_permissions(role_ids):
+    # same rows, in the same order, as the viewset's permissions prefetch
+    permissions = defaultdict(list)
+    rows = (
+        Permission.objects.filter(roles__in=role_ids)
+        .order_by('name')
+        .values_list('roles__id', *PERMISSION_VALUES.columns)
+    )
+    for role_id, *row in rows:
+        permissions[role_id].append(PERMISSION_VALUES.render_row(row))
+    return permissions
+
+
+ROLE_VALUES = ValuesRenderer(RoleSerializer, computed={'permissions': (_role_permissions, [])})
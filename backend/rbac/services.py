@@ -1,11 +1,239 @@
-from .models import Permission
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from .models import Permission, UserEffectivePermission, UserRole
+from .cache import get_cached_permissions, get_cached_permissions_many, get_cached_summary
+from .cache import aget_cached_permissions, aget_cached_summary
+from .claims import permissions_from_token, apermissions_from_token
+from .bitmask import rbac_index
+from .effective import aprobe, materialized_enabled, probe
+from .wildcards import grants, grants_any, grants_all
 
-def has_permission(user, permission_name: str) -> bool:
+
+def _use_bitmask_index():
+    return getattr(settings, 'RBAC_BITMASK_INDEX', False)
+
+
+# inherited permissions come through RoleClosure: a user's role is the
+# descendant, the roles whose permissions apply are its ancestors (itself included)
+def _load_permission_names(user):
+    if materialized_enabled():
+        return UserEffectivePermission.objects.filter(user=user).values_list('permission__name', flat=True)
+    return Permission.objects.filter(
+        permission_roles__role__descendant_links__descendant__role_assignments__user=user
+    ).values_list('name', flat=True).distinct()
+
+
+def _load_permission_names_many(user_ids):
+    result = {}
+    if materialized_enabled():
+        rows = UserEffectivePermission.objects.filter(user_id__in=user_ids).values_list('user_id', 'permission__name')
+        for user_id, name in rows:
+            result.setdefault(user_id, set()).add(name)
+        return result
+    rows = UserRole.objects.filter(user_id__in=user_ids).values_list(
+        'user_id', 'role__ancestor_links__ancestor__role_permissions__permission__name'
+    )
+    for user_id, name in rows:
+        permissions = result.setdefault(user_id, set())
+        if name is not None:
+            permissions.add(name)
+    return result
+
+
+def get_user_permissions(user) -> frozenset:
+    """
+    returns the names of the permissions granted to the user through their roles
+    """
+    if _use_bitmask_index():
+        return rbac_index.permissions_of(user.pk)
+    return get_cached_permissions(user.pk, lambda: _load_permission_names(user))
+
+
+def has_permission(user, permission_name: str, token=None) -> bool:
+    """
+    token: optional validated access token; its permission claim is trusted
+    while its RBAC version stamp is current
+    """
     if not user or not user.is_authenticated:
         return False
     if user.is_superuser:
         return True
-    return Permission.objects.filter(
-        name=permission_name,
-        permission_roles__role__role_assignments__user=user
-    ).exists()
+    claimed = permissions_from_token(token)
+    if claimed is not None:
+        return grants(claimed, permission_name)
+    if _use_bitmask_index():
+        return rbac_index.has_permission(user.pk, permission_name)
+    if materialized_enabled():
+        # one probe of the (user, permission) index, no cache round trip
+        granted = probe(user.pk, [permission_name])
+        if granted is not None:
+            return granted
+    return grants(get_user_permissions(user), permission_name)
+
+
+def has_any_permission(user, permission_names, token=None) -> bool:
+    if not user or not user.is_authenticated:
+        return False
+    if user.is_superuser:
+        return True
+    claimed = permissions_from_token(token)
+    if claimed is not None:
+        return grants_any(claimed, permission_names)
+    if _use_bitmask_index():
+        return rbac_index.has_any(user.pk, permission_names)
+    if materialized_enabled():
+        permission_names = list(permission_names)
+        granted = probe(user.pk, permission_names)
+        if granted is not None:
+            return granted
+    return grants_any(get_user_permissions(user), permission_names)
+
+
+def has_all_permissions(user, permission_names, token=None) -> bool:
+    if not user or not user.is_authenticated:
+        return False
+    if user.is_superuser:
+        return True
+    claimed = permissions_from_token(token)
+    if claimed is not None:
+        return grants_all(claimed, permission_names)
+    if _use_bitmask_index():
+        return rbac_index.has_all(user.pk, permission_names)
+    return grants_all(get_user_permissions(user), permission_names)
+
+
+def _summary_rows(user):
+    # one query: every role of the user joined with the permissions it grants
+    return UserRole.objects.filter(user=user).values_list(
+        'role__name',
+        'role__ancestor_links__ancestor__role_permissions__permission__name',
+        'role__ancestor_links__ancestor__role_permissions__permission__description',
+    )
+
+
+def _build_summary(rows, all_permissions=None):
+    roles = set()
+    permissions = {}
+    for role_name, name, description in rows:
+        roles.add(role_name)
+        if name is not None:
+            permissions[name] = description
+    if all_permissions is not None:
+        permissions = all_permissions
+    return {
+        'roles': sorted(roles),
+        'permissions': [
+            {'name': name, 'description': permissions[name]} for name in sorted(permissions)
+        ],
+    }
+
+
+def _effective_permission_rows(user):
+    return UserEffectivePermission.objects.filter(user=user).values_list('permission__name', 'permission__description')
+
+
+def _role_names(user):
+    return UserRole.objects.filter(user=user).values_list('role__name', flat=True)
+
+
+def _load_summary(user):
+    all_permissions = None
+    if user.is_superuser:
+        all_permissions = dict(Permission.objects.values_list('name', 'description'))
+    elif materialized_enabled():
+        # roles only, the permissions come from the materialized table
+        rows = [(name, None, None) for name in _role_names(user)]
+        return _build_summary(rows, dict(_effective_permission_rows(user)))
+    return _build_summary(_summary_rows(user), all_permissions)
+
+
+def get_user_rbac_summary(user) -> dict:
+    """
+    returns {'roles': [...], 'permissions': [{'name', 'description'}, ...]}
+    as shown by /me, cached per user and RBAC version
+    """
+    return get_cached_summary(user, lambda: _load_summary(user))
+
+
+def check_permissions_bulk(pairs):
+    """
+    pairs: iterable of (user_id, permission_name)
+    returns one decision per pair, in order, with a constant number of
+    queries: one for the users and at most one for their permissions
+    """
+    pairs = list(pairs)
+    user_ids = list(dict.fromkeys(user_id for user_id, _ in pairs))
+    users = dict(
+        get_user_model().objects.filter(pk__in=user_ids).values_list('pk', 'is_superuser')
+    )
+    # same short-circuit as has_permission
+    regular = [user_id for user_id, is_superuser in users.items() if not is_superuser]
+    if not regular:
+        granted = {}
+    elif _use_bitmask_index():
+        granted = {user_id: rbac_index.permissions_of(user_id) for user_id in regular}
+    else:
+        granted = get_cached_permissions_many(regular, _load_permission_names_many)
+
+    decisions = []
+    for user_id, permission_name in pairs:
+        if user_id not in users:
+            decisions.append(False)
+        elif users[user_id]:
+            decisions.append(True)
+        else:
+            decisions.append(grants(granted[user_id], permission_name))
+    return decisions
+
+
+#-------------------------------
+# Async variants for ASGI views
+#-------------------------------
+async def _aload_permission_names(user):
+    return [name async for name in _load_permission_names(user)]
+
+
+async def _aload_summary(user):
+    all_permissions = None
+    if user.is_superuser:
+        all_permissions = {
+            name: description
+            async for name, description in Permission.objects.values_list('name', 'description')
+        }
+    elif materialized_enabled():
+        return _build_summary(
+            [(name, None, None) async for name in _role_names(user)],
+            {name: description async for name, description in _effective_permission_rows(user)}
+        )
+    return _build_summary([row async for row in _summary_rows(user)], all_permissions)
+
+
+async def aget_user_permissions(user) -> frozenset:
+    if _use_bitmask_index():
+        # the index may have to sync from the database
+        return await sync_to_async(rbac_index.permissions_of)(user.pk)
+    return await aget_cached_permissions(user.pk, lambda: _aload_permission_names(user))
+
+
+async def ahas_permission(user, permission_name: str, token=None) -> bool:
+    """
+    async has_permission: same decisions, reading the cache and the database
+    without blocking the event loop
+    """
+    if not user or not user.is_authenticated:
+        return False
+    if user.is_superuser:
+        return True
+    claimed = await apermissions_from_token(token)
+    if claimed is not None:
+        return grants(claimed, permission_name)
+    if materialized_enabled():
+        granted = await aprobe(user.pk, [permission_name])
+        if granted is not None:
+            return granted
+    return grants(await aget_user_permissions(user), permission_name)
+
+
+async def aget_user_rbac_summary(user) -> dict:
+    return await aget_cached_summary(user, lambda: _aload_summary(user))
@@ -0,0 +1,88 @@
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import Signal, receiver
+from users.models import User
+from .models import Permission, Role, RoleParent, RolePermission, UserRole
+from .cache import invalidate_catalog, invalidate_rbac
+from .bitmask import rbac_index
+from .hierarchy import drop_closure_rows, maintain_closure
+from .effective import maintain_effective_permissions
+
+# sent whenever RBAC rows change, including bulk writes that skip model
+# signals. kwargs: instances (list or None when unknown), using, created
+# (True when the instances were just inserted)
+rbac_changed = Signal()
+
+RBAC_MODELS = (Permission, Role, RoleParent, RolePermission, UserRole)
+# link rows removed by a cascade, and the foreign keys pointing at the deleted object;
+# edges first, the closure has to be current before anything reads it
+CASCADES = {
+    User: ((UserRole, ('user',)),),
+    Role: ((RoleParent, ('role', 'parent')), (RolePermission, ('role',)), (UserRole, ('role',))),
+    Permission: ((RolePermission, ('permission',)),),
+}
+# rows the role and permission lists are built from
+CATALOG_MODELS = (Permission, Role, RolePermission)
+
+
+def _notify(sender, instance, using, created=False, **kwargs):
+    rbac_changed.send(sender=sender, instances=[instance], using=using, created=created)
+
+
+def _collect_cascade(sender, instance, using, **kwargs):
+    """
+    pre_delete: reads the link rows the cascade is about to remove, with one
+    query per model; the cascade itself deletes them without loading them
+    """
+    instance._rbac_cascade = [
+        (model, list(model._base_manager.using(using).filter(
+            Q(*[Q(**{field: instance.pk}) for field in fields], _connector=Q.OR)
+        )))
+        for model, fields in CASCADES[sender]
+    ]
+
+
+def _announce_cascade(sender, instance, using, **kwargs):
+    for model, rows in instance.__dict__.pop('_rbac_cascade', ()):
+        if rows:
+            rbac_changed.send(sender=model, instances=rows, using=using, created=False)
+
+
+for model in RBAC_MODELS:
+    post_save.connect(_notify, sender=model, dispatch_uid=f'rbac_save_{model.__name__}')
+for model in (Permission, Role):
+    # nothing cascades into these, so a receiver costs no fast deletes; the
+    # link models announce their own deletes (RBACLinkQuerySet, RBACLinkMixin)
+    post_delete.connect(_notify, sender=model, dispatch_uid=f'rbac_delete_{model.__name__}')
+for model in CASCADES:
+    pre_delete.connect(_collect_cascade, sender=model, dispatch_uid=f'rbac_cascade_{model.__name__}')
+    post_delete.connect(_announce_cascade, sender=model, dispatch_uid=f'rbac_cascaded_{model.__name__}')
+
+
+# the closure has to be current before anything reads effective permissions
+rbac_changed.connect(maintain_closure, dispatch_uid='rbac_role_closure')
+post_delete.connect(drop_closure_rows, sender=Role, dispatch_uid='rbac_role_closure_delete')
+# reads the closure, so it is connected after it
+rbac_changed.connect(maintain_effective_permissions, dispatch_uid='rbac_effective_permissions')
+
+
+@receiver(rbac_changed)
+def invalidate_permission_cache(sender, using='default', **kwargs):
+    invalidate_rbac(using or 'default')
+
+
+@receiver(rbac_changed)
+def invalidate_catalog_cache(sender, using='default', **kwargs):
+    if sender in CATALOG_MODELS:
+        invalidate_catalog(using or 'default')
+
+
+@receiver(rbac_changed)
+def update_bitmask_index(sender, instances=None, using='default', **kwargs):
+    if not getattr(settings, 'RBAC_BITMASK_INDEX', False):
+        return
+    # only committed rows are compiled into the index
+    transaction.on_commit(partial(rbac_index.mark_dirty, sender, instances), using=using or 'default')
@@ -4,10 +4,33 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from rbac.models import Role, Permission, RolePermission
+from rbac.models import Role, Permission, RolePermission, UserRole, RoleParent, RoleClosure
+from rbac.models import RBACQuerySet, UserEffectivePermission
+from rbac import effective
+from rbac.hierarchy import RoleCycleError, add_parents, rebuild_closure, remove_parents
+from rbac.wildcards import PermissionTrie, grants, candidate_patterns
+from rbac.scopes import grant_scoped_role, scoped_object_ids, filter_queryset_for_user
+from rbac.services import has_permission, has_any_permission, has_all_permissions, ahas_permission
+from rbac.services import check_permissions_bulk, get_user_rbac_summary
+from rbac.permissions import UserPermission
+from rbac.bitmask import RBACIndex
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from rbac.cache import get_cache_stats, reset_cache_stats, get_catalog_version, CATALOG_RESPONSE_KEY
+from rbac.cache import get_rbac_version
+from rbac.checks import check_rbac_cache_is_shared
+from rbac.signals import rbac_changed
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 import uuid
 from rest_framework_simplejwt.tokens import RefreshToken
+from audit.models import AuditLog
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
 
 User = get_user_model()
 
@@ -237,6 +260,67 @@ class RolePermissionExtraTests(APITestCase):
         self.assertEqual(self.role.permissions.count(), 1)
         self.assertEqual(self.role.permissions.first().id, self.permission2.id)
 
+class RoleReplacePermissionsTests(APITestCase):
+
+    def setUp(self):
+        self.superuser = User.objects.create(email='admin@joy.com', is_superuser=True)
+        self.role = Role.objects.create(name="SyncRole")
+        self.perms = Permission.objects.bulk_create(
+            [Permission(name=f"sync.perm{i}") for i in range(300)]
+        )
+        self.url = reverse('role-assign-permissions', args=[self.role.id])
+        self.client.force_authenticate(user=self.superuser)
+
+    def ids(self, perms):
+        return [str(p.id) for p in perms]
+
+    def test_put_replaces_permission_set(self):
+        self.role.permissions.add(*self.perms[:200])
+
+        # role, validation, diff, insert, select + delete of stale rows, plus savepoints
+        with self.assertNumQueries(8):
+            response = self.client.put(self.url, {"permissions": self.ids(self.perms[100:])}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["added"], 100)
+        self.assertEqual(response.data["removed"], 100)
+        self.assertEqual(
+            set(self.role.permissions.values_list('id', flat=True)),
+            {p.id for p in self.perms[100:]}
+        )
+
+    def test_put_is_idempotent(self):
+        data = {"permissions": self.ids(self.perms[:10])}
+        self.client.put(self.url, data, format='json')
+        response = self.client.put(self.url, data, format='json')
+        self.assertEqual((response.data["added"], response.data["removed"]), (0, 0))
+        self.assertEqual(self.role.permissions.count(), 10)
+
+    def test_put_rejects_unknown_ids_without_changes(self):
+        self.role.permissions.add(self.perms[0])
+        data = {"permissions": [str(uuid.uuid4())]}
+        response = self.client.put(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.role.permissions.count(), 1)
+
+    def test_post_adds_in_constant_queries(self):
+        self.role.permissions.add(*self.perms[:50])
+        # role, validation, diff, insert, plus savepoints
+        with self.assertNumQueries(6):
+            response = self.client.post(self.url, {"permissions": self.ids(self.perms)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.role.permissions.count(), 300)
+
+    def test_put_invalidates_permission_cache(self):
+        member = User.objects.create(email='member@joy.com')
+        UserRole.objects.create(user=member, role=self.role)
+        self.role.permissions.add(self.perms[0])
+        self.assertTrue(has_permission(member, "sync.perm0"))
+        self.client.put(self.url, {"permissions": self.ids(self.perms[1:2])}, format='json')
+        self.assertFalse(has_permission(member, "sync.perm0"))
+        self.assertTrue(has_permission(member, "sync.perm1"))
+
+
 class AuthTests(APITestCase):
 
     def setUp(self):
@@ -290,3 +374,817 @@ class AuthTests(APITestCase):
         data = {"refresh": "invalidtoken123"}
         response = self.client.post(url, data, format="json")
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class PermissionCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+        self.user = User.objects.create(email="cached@joy.com")
+        self.role = Role.objects.create(name="CacheRole")
+        self.permission = Permission.objects.create(name="user.view")
+        RolePermission.objects.create(role=self.role, permission=self.permission)
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def test_second_check_hits_cache(self):
+        self.assertTrue(has_permission(self.user, "user.view"))
+        with self.assertNumQueries(0):
+            self.assertTrue(has_permission(self.user, "user.view"))
+            self.assertFalse(has_permission(self.user, "user.delete"))
+        self.assertEqual(get_cache_stats()["misses"], 1)
+        self.assertEqual(get_cache_stats()["hits"], 2)
+
+    def test_one_bump_per_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for name in ("a", "b", "c"):
+                Role.objects.create(name=name)
+        version = get_rbac_version()
+        for callback in callbacks:
+            callback()
+        # the catalog bump and the RBAC bump, each once
+        self.assertEqual(get_rbac_version(), version + 1)
+
+    def test_bump_survives_a_rolled_back_savepoint(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    Role.objects.create(name="gone")
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            Role.objects.create(name="kept")
+        version = get_rbac_version()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_rbac_version(), version + 1)
+
+    @override_settings(RBAC_CACHE_SINGLE_PROCESS=False)
+    def test_system_check_rejects_per_process_cache(self):
+        self.assertEqual([e.id for e in check_rbac_cache_is_shared(None)], ["rbac.E001"])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(check_rbac_cache_is_shared(None), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_cache_that_stores_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.role.permissions.add(Permission.objects.create(name="user.delete"))
+        self.assertTrue(has_permission(self.user, "user.delete"))
+        UserRole.objects.filter(user=self.user).bulk_delete()
+        self.assertFalse(has_permission(self.user, "user.delete"))
+
+    def test_cascades_are_announced_once_per_model(self):
+        users = User.objects.bulk_create([User(email=f"held{i}@joy.com", password="!") for i in range(20)])
+        UserRole.objects.bulk_create([UserRole(user=user, role=self.role) for user in users])
+        self.assertTrue(has_permission(self.user, "user.view"))
+        sent = []
+
+        def record(sender, instances=None, **kwargs):
+            sent.append((sender, len(instances or ())))
+        rbac_changed.connect(record, weak=False, dispatch_uid='test_cascade')
+        self.addCleanup(rbac_changed.disconnect, dispatch_uid='test_cascade')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.role.delete()
+        self.assertCountEqual(sent, [(RolePermission, 1), (UserRole, 21), (Role, 1)])
+        # the cascade deleted the rows without loading them again
+        self.assertEqual(
+            len([q for q in queries if q['sql'].startswith('SELECT') and '"rbac_rolepermission"' in q['sql']]), 1
+        )
+        self.assertFalse(has_permission(self.user, "user.view"))
+
+    def test_role_permission_change_invalidates(self):
+        self.assertFalse(has_permission(self.user, "user.delete"))
+        delete_perm = Permission.objects.create(name="user.delete")
+        self.role.permissions.add(delete_perm)  # bulk_create path
+        self.assertTrue(has_permission(self.user, "user.delete"))
+
+    def test_bulk_assignment_invalidates(self):
+        other_role = Role.objects.create(name="OtherRole")
+        other_role.permissions.add(Permission.objects.create(name="role.view"))
+        self.assertFalse(has_permission(self.user, "role.view"))
+        UserRole.objects.bulk_create([UserRole(user=self.user, role=other_role)])
+        self.assertTrue(has_permission(self.user, "role.view"))
+
+    def test_cascade_delete_invalidates(self):
+        self.assertTrue(has_permission(self.user, "user.view"))
+        self.role.delete()
+        self.assertFalse(has_permission(self.user, "user.view"))
+
+    def test_queryset_update_invalidates(self):
+        self.assertTrue(has_permission(self.user, "user.view"))
+        Permission.objects.filter(pk=self.permission.pk).update(name="user.read")
+        self.assertFalse(has_permission(self.user, "user.view"))
+        self.assertTrue(has_permission(self.user, "user.read"))
+
+
+class BitmaskIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.index = RBACIndex()
+        self.user = User.objects.create(email="bits@joy.com")
+        self.role = Role.objects.create(name="BitsRole")
+        self.view = Permission.objects.create(name="user.view")
+        self.change = Permission.objects.create(name="user.change")
+        self.role.permissions.add(self.view)
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.index.rebuild()
+
+    def test_checks(self):
+        self.assertTrue(self.index.has_permission(self.user.pk, "user.view"))
+        self.assertFalse(self.index.has_permission(self.user.pk, "user.change"))
+        self.assertFalse(self.index.has_permission(self.user.pk, "missing"))
+        self.assertTrue(self.index.has_any(self.user.pk, ["user.change", "user.view"]))
+        self.assertFalse(self.index.has_all(self.user.pk, ["user.change", "user.view"]))
+        self.assertEqual(self.index.permissions_of(self.user.pk), {"user.view"})
+
+    @override_settings(RBAC_BITMASK_INDEX=True)
+    def test_local_change_is_applied_incrementally(self):
+        with mock.patch('rbac.signals.rbac_index', self.index):
+            with self.captureOnCommitCallbacks(execute=True):
+                RolePermission.objects.create(role=self.role, permission=self.change)
+        with mock.patch.object(self.index, 'rebuild') as rebuild:
+            self.assertTrue(self.index.has_all(self.user.pk, ["user.change", "user.view"]))
+            rebuild.assert_not_called()
+
+    def test_unassigned_user_loses_permissions(self):
+        assignment = UserRole.objects.get(user=self.user)
+        assignment.delete()
+        self.index.mark_dirty(UserRole, [assignment])
+        self.assertFalse(self.index.has_permission(self.user.pk, "user.view"))
+
+    @override_settings(RBAC_BITMASK_INDEX=True)
+    def test_services_use_index(self):
+        with mock.patch('rbac.services.rbac_index', self.index), \
+                mock.patch('rbac.signals.rbac_index', self.index):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.role.permissions.add(self.change)
+            self.assertTrue(has_all_permissions(self.user, ["user.view", "user.change"]))
+            self.assertTrue(has_any_permission(self.user, ["role.view", "user.change"]))
+
+
+class AuthzCheckTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.caller = User.objects.create(email="service@joy.com")
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        self.user = User.objects.create(email="member@joy.com")
+        service_role = Role.objects.create(name="Service")
+        service_role.permissions.add(Permission.objects.create(name="authz.check"))
+        UserRole.objects.create(user=self.caller, role=service_role)
+        member_role = Role.objects.create(name="Member")
+        member_role.permissions.add(Permission.objects.create(name="user.view"))
+        UserRole.objects.create(user=self.user, role=member_role)
+        self.url = reverse('authz-check')
+
+    def test_decisions_match_has_permission(self):
+        self.client.force_authenticate(user=self.caller)
+        pairs = [
+            (self.user, "user.view"),
+            (self.user, "user.delete"),
+            (self.admin, "anything"),
+            (self.caller, "user.view"),
+        ]
+        data = {"checks": [{"user": str(u.id), "permission": p} for u, p in pairs]}
+        data["checks"].append({"user": str(uuid.uuid4()), "permission": "user.view"})
+
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        allowed = [r["allowed"] for r in response.data["results"]]
+        self.assertEqual(allowed, [has_permission(u, p) for u, p in pairs] + [False])
+        self.assertEqual(allowed, [True, False, True, False, False])
+
+    def test_constant_number_of_queries(self):
+        users = User.objects.bulk_create(
+            [User(email=f"bulk{i}@joy.com", password="!") for i in range(50)]
+        )
+        checks = [
+            {"user": str(u.id), "permission": name}
+            for u in users for name in ("user.view", "role.view", "user.change")
+        ]
+        self.client.force_authenticate(user=self.admin)
+        cache.clear()
+        # users + permissions of the users
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {"checks": checks}, format='json')
+        self.assertEqual(len(response.data["results"]), 150)
+
+    def test_forbidden_without_permission(self):
+        self.client.force_authenticate(user=self.user)
+        data = {"checks": [{"user": str(self.user.id), "permission": "user.view"}]}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class UserListQueryTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        roles = Role.objects.bulk_create([Role(name=f"Role{i}") for i in range(5)])
+        users = User.objects.bulk_create(
+            [User(email=f"user{i}@joy.com", password="!") for i in range(10000)],
+            batch_size=2000
+        )
+        UserRole.objects.bulk_create(
+            [UserRole(user=u, role=roles[i % 5]) for i, u in enumerate(users)],
+            batch_size=2000
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.admin)
+
+    def test_list_uses_constant_queries(self):
+        # users + prefetched role assignments
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('user-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 10001)
+        first = next(u for u in response.data if u["email"] == "user1@joy.com")
+        self.assertEqual([r["role__name"] for r in first["roles"]], ["Role1"])
+
+    def test_list_pagination_is_opt_in(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('user-list'), {"limit": 50})
+        self.assertEqual(response.data["count"], 10001)
+        self.assertEqual(len(response.data["results"]), 50)
+
+
+class BulkUserRoleTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        self.users = User.objects.bulk_create(
+            [User(email=f"staff{i}@joy.com", password="!") for i in range(50)]
+        )
+        self.roles = [Role.objects.create(name="Staff"), Role.objects.create(name="Support")]
+        self.view = Permission.objects.create(name="user.view")
+        self.roles[0].permissions.add(self.view)
+        self.data = {
+            "users": [str(u.id) for u in self.users],
+            "roles": [str(r.id) for r in self.roles],
+        }
+        self.client.force_authenticate(user=self.admin)
+
+    def test_bulk_assign(self):
+        UserRole.objects.create(user=self.users[0], role=self.roles[0])
+        self.assertFalse(has_permission(self.users[1], "user.view"))
+        AuditLog.objects.all().delete()
+
+        # users, roles, savepoint, existing pairs, insert, inserted pairs, audit insert,
+        # release; larger requests only add insert batches
+        with self.assertNumQueries(8):
+            response = self.client.post(reverse('userrole-bulk-assign'), self.data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 99)
+        self.assertEqual(response.data["existing"], 1)
+        self.assertEqual(UserRole.objects.count(), 100)
+        self.assertEqual(AuditLog.objects.filter(model_name='UserRole', action='create').count(), 99)
+        log = AuditLog.objects.get(object_id=str(UserRole.objects.get(user=self.users[5], role=self.roles[1]).id))
+        self.assertEqual(log.changes, {"user": "staff5@joy.com", "role": "Support"})
+        self.assertTrue(has_permission(self.users[1], "user.view"))
+
+        response = self.client.post(reverse('userrole-bulk-assign'), self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 0)
+
+    def test_pairs_inserted_concurrently_are_not_audited(self):
+        AuditLog.objects.all().delete()
+        bulk_create = RBACQuerySet.bulk_create
+
+        def racing(queryset, objs, *args, **kwargs):
+            # another request assigns one pair after the existing ones were read
+            bulk_create(UserRole.objects.all(), [UserRole(user=self.users[2], role=self.roles[1])])
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(RBACQuerySet, 'bulk_create', autospec=True, side_effect=racing):
+            response = self.client.post(reverse('userrole-bulk-assign'), self.data, format='json')
+        self.assertEqual(response.data["created"], 99)
+        self.assertEqual(UserRole.objects.count(), 100)
+        self.assertEqual(AuditLog.objects.filter(model_name='UserRole', action='create').count(), 99)
+
+    def test_unknown_ids_are_rejected(self):
+        missing = str(uuid.uuid4())
+        self.data["roles"].append(missing)
+        response = self.client.post(reverse('userrole-bulk-assign'), self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(missing, str(response.data["roles"]))
+        self.assertFalse(UserRole.objects.exists())
+
+    def test_bulk_unassign(self):
+        self.client.post(reverse('userrole-bulk-assign'), self.data, format='json')
+        self.assertTrue(has_permission(self.users[1], "user.view"))
+        AuditLog.objects.all().delete()
+
+        data = {"users": self.data["users"][:25], "roles": [str(self.roles[0].id)]}
+        response = self.client.post(reverse('userrole-bulk-unassign'), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["removed"], 25)
+        self.assertEqual(UserRole.objects.count(), 75)
+        self.assertEqual(AuditLog.objects.filter(model_name='UserRole', action='delete').count(), 25)
+        self.assertFalse(has_permission(self.users[1], "user.view"))
+        self.assertTrue(has_permission(self.users[40], "user.view"))
+
+    def test_forbidden_without_permission(self):
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.post(reverse('userrole-bulk-assign'), self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AsyncPermissionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="async@joy.com")
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        role = Role.objects.create(name="Viewer")
+        role.permissions.add(Permission.objects.create(name="user.view"))
+        UserRole.objects.create(user=self.user, role=role)
+
+    async def test_matches_sync_decisions(self):
+        for user in (self.user, self.admin):
+            for name in ("user.view", "user.delete"):
+                expected = await sync_to_async(has_permission)(user, name)
+                self.assertEqual(await ahas_permission(user, name), expected)
+
+    async def test_second_check_hits_cache(self):
+        await ahas_permission(self.user, "user.view")
+        reset_cache_stats()
+        self.assertTrue(await ahas_permission(self.user, "user.view"))
+        self.assertEqual(get_cache_stats()["hits"], 1)
+
+
+class RoleHierarchyTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        self.user = User.objects.create(email="boss@joy.com")
+        self.viewer = Role.objects.create(name="Viewer")
+        self.editor = Role.objects.create(name="Editor")
+        self.manager = Role.objects.create(name="Manager")
+        self.viewer.permissions.add(Permission.objects.create(name="user.view"))
+        self.editor.permissions.add(Permission.objects.create(name="user.change"))
+        self.manager.permissions.add(Permission.objects.create(name="user.delete"))
+        # Manager -> Editor -> Viewer
+        RoleParent.objects.create(role=self.editor, parent=self.viewer)
+        RoleParent.objects.create(role=self.manager, parent=self.editor)
+        UserRole.objects.create(user=self.user, role=self.manager)
+
+    def closure(self):
+        return set(RoleClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def test_closure_rows(self):
+        self.assertIn((self.viewer.id, self.manager.id, 2), self.closure())
+        self.assertIn((self.manager.id, self.manager.id, 0), self.closure())
+        before = self.closure()
+        rebuild_closure()
+        self.assertEqual(self.closure(), before)
+
+    def test_inherited_permissions(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(has_permission(self.user, "user.view"))
+        self.assertTrue(has_all_permissions(self.user, ["user.view", "user.change", "user.delete"]))
+        self.assertEqual(
+            check_permissions_bulk([(self.user.id, "user.view"), (self.user.id, "role.view")]),
+            [True, False]
+        )
+        summary = get_user_rbac_summary(self.user)
+        self.assertEqual(summary["roles"], ["Manager"])
+        self.assertEqual([p["name"] for p in summary["permissions"]], ["user.change", "user.delete", "user.view"])
+
+    def test_removing_an_edge(self):
+        RoleParent.objects.get(role=self.editor, parent=self.viewer).delete()
+        self.assertFalse(has_permission(self.user, "user.view"))
+        self.assertTrue(has_permission(self.user, "user.change"))
+        self.assertNotIn(self.viewer.id, {a for a, d, _ in self.closure() if d == self.manager.id})
+
+    def test_deleting_a_middle_role(self):
+        self.editor.delete()
+        self.assertFalse(has_permission(self.user, "user.view"))
+        self.assertEqual(
+            {a for a, d, _ in self.closure() if d == self.manager.id}, {self.manager.id}
+        )
+
+    def test_incremental_closure_matches_rebuild(self):
+        # Lead -> Manager and Lead -> Auditor -> Viewer: two paths of different depth
+        lead = Role.objects.create(name="Lead")
+        auditor = Role.objects.create(name="Auditor")
+        add_parents(lead, [self.manager.id, auditor.id])
+        add_parents(auditor, [self.viewer.id])
+        self.assertIn((self.viewer.id, lead.id, 2), self.closure())
+        remove_parents(auditor, [self.viewer.id])
+        add_parents(self.viewer, [Role.objects.create(name="Root").id])
+        updated = self.closure()
+        rebuild_closure()
+        self.assertEqual(updated, self.closure())
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaises(RoleCycleError):
+            RoleParent.objects.create(role=self.viewer, parent=self.manager)
+
+        self.client.force_authenticate(user=self.admin)
+        url = reverse('role-parents', args=[self.viewer.id])
+        response = self.client.post(url, {"parents": [str(self.manager.id)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(RoleParent.objects.filter(role=self.viewer).exists())
+
+    def test_parents_endpoints(self):
+        self.client.force_authenticate(user=self.admin)
+        auditor = Role.objects.create(name="Auditor")
+        auditor.permissions.add(Permission.objects.create(name="audit.view"))
+        url = reverse('role-parents', args=[self.manager.id])
+
+        response = self.client.post(url, {"parents": [str(auditor.id)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(has_permission(self.user, "audit.view"))
+        names = [r["name"] for r in self.client.get(url).data]
+        self.assertEqual(sorted(names), ["Auditor", "Editor"])
+
+        response = self.client.post(
+            reverse('role-delete-parents', args=[self.manager.id]),
+            {"parents": [str(auditor.id)]}, format='json'
+        )
+        self.assertEqual(response.data["parents"], ["Editor"])
+        self.assertFalse(has_permission(self.user, "audit.view"))
+
+    @override_settings(RBAC_BITMASK_INDEX=True)
+    def test_bitmask_index_inherits(self):
+        index = RBACIndex()
+        with mock.patch('rbac.services.rbac_index', index), \
+                mock.patch('rbac.signals.rbac_index', index):
+            self.assertTrue(has_permission(self.user, "user.view"))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.viewer.permissions.add(Permission.objects.create(name="role.view"))
+            self.assertTrue(has_permission(self.user, "role.view"))
+            with self.captureOnCommitCallbacks(execute=True):
+                RoleParent.objects.filter(role=self.manager).bulk_delete()
+            self.assertFalse(has_permission(self.user, "role.view"))
+            self.assertTrue(has_permission(self.user, "user.delete"))
+
+
+class WildcardPermissionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="ops@joy.com")
+        self.role = Role.objects.create(name="Ops")
+        self.role.permissions.add(
+            Permission.objects.create(name="user.*"),
+            Permission.objects.create(name="report.*.view"),
+            Permission.objects.create(name="role.view"),
+        )
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def test_trie_semantics(self):
+        trie = PermissionTrie(["user.*", "report.*.view", "audit"])
+        self.assertTrue(trie.matches("user.view"))
+        self.assertTrue(trie.matches("user.profile.edit"))
+        self.assertFalse(trie.matches("user"))
+        self.assertFalse(trie.matches("username.view"))
+        self.assertTrue(trie.matches("report.sales.view"))
+        self.assertFalse(trie.matches("report.sales.edit"))
+        self.assertTrue(trie.matches("audit"))
+        self.assertTrue(PermissionTrie(["*"]).matches("anything.at.all"))
+
+    def test_exact_grants_unchanged(self):
+        granted = frozenset({"role.view"})
+        self.assertTrue(grants(granted, "role.view"))
+        self.assertFalse(grants(granted, "role.change"))
+        self.assertFalse(grants(granted, "role.*"))
+
+    def test_services(self):
+        self.assertTrue(has_permission(self.user, "user.delete"))
+        self.assertTrue(has_permission(self.user, "role.view"))
+        self.assertFalse(has_permission(self.user, "role.change"))
+        self.assertTrue(has_all_permissions(self.user, ["user.view", "role.view", "report.q1.view"]))
+        self.assertFalse(has_all_permissions(self.user, ["user.view", "role.change"]))
+        self.assertTrue(has_any_permission(self.user, ["role.change", "user.add"]))
+        self.assertEqual(
+            check_permissions_bulk([(self.user.id, "user.add"), (self.user.id, "permission.add")]),
+            [True, False]
+        )
+
+    def test_global_wildcard(self):
+        self.role.permissions.add(Permission.objects.create(name="*"))
+        self.assertTrue(has_permission(self.user, "permission.delete"))
+
+    @override_settings(RBAC_BITMASK_INDEX=True)
+    def test_bitmask_index(self):
+        index = RBACIndex()
+        with mock.patch('rbac.services.rbac_index', index), \
+                mock.patch('rbac.signals.rbac_index', index):
+            self.assertTrue(has_permission(self.user, "user.delete"))
+            self.assertFalse(has_permission(self.user, "role.change"))
+            self.assertTrue(has_all_permissions(self.user, ["user.view", "role.view"]))
+            self.assertTrue(has_any_permission(self.user, ["role.change", "report.x.view"]))
+            with self.captureOnCommitCallbacks(execute=True):
+                Permission.objects.filter(name="user.*").delete()
+            self.assertFalse(has_permission(self.user, "user.delete"))
+
+
+class ScopedRoleTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create(email="manager@joy.com")
+        self.users = [User.objects.create(email=f"member{i}@joy.com") for i in range(5)]
+        self.viewer = Role.objects.create(name="Viewer")
+        self.viewer.permissions.add(Permission.objects.create(name="user.view"))
+        self.editor = Role.objects.create(name="Editor")
+        self.editor.permissions.add(Permission.objects.create(name="user.*"))
+        self.client.force_authenticate(user=self.manager)
+
+    def test_scoped_ids(self):
+        grant_scoped_role(self.manager, self.viewer, self.users[0])
+        grant_scoped_role(self.manager, self.editor, self.users[1])
+        with self.assertNumQueries(1):
+            ids = scoped_object_ids(self.manager, "user.view", User)
+        self.assertEqual(set(ids), {self.users[0].id, self.users[1].id})
+        self.assertEqual(scoped_object_ids(self.manager, "user.change", User), [self.users[1].id])
+        self.assertFalse(has_permission(self.manager, "user.view"))
+
+    def test_inherited_permissions_apply_in_scope(self):
+        child = Role.objects.create(name="Junior")
+        RoleParent.objects.create(role=child, parent=self.viewer)
+        grant_scoped_role(self.manager, child, self.users[2])
+        self.assertEqual(scoped_object_ids(self.manager, "user.view", User), [self.users[2].id])
+
+    def test_list_is_filtered_to_scope(self):
+        grant_scoped_role(self.manager, self.viewer, self.users[0])
+        grant_scoped_role(self.manager, self.viewer, self.users[3])
+        response = self.client.get(reverse('user-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {u["email"] for u in response.data},
+            {"member0@joy.com", "member3@joy.com"}
+        )
+
+    def test_object_outside_scope_is_not_found(self):
+        grant_scoped_role(self.manager, self.viewer, self.users[0])
+        response = self.client.get(reverse('user-detail', args=[self.users[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('user-detail', args=[self.users[1].id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # viewing does not grant changing
+        response = self.client.patch(
+            reverse('user-detail', args=[self.users[0].id]), {"first_name": "X"}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_without_grants_list_is_forbidden(self):
+        response = self.client.get(reverse('user-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_global_grant_sees_everyone(self):
+        grant_scoped_role(self.manager, self.viewer, self.users[0])
+        UserRole.objects.create(user=self.manager, role=self.viewer)
+        response = self.client.get(reverse('user-list'))
+        self.assertEqual(len(response.data), 6)
+
+    def test_filter_by_scope_field(self):
+        # rows scoped through a related object: role assignments of the users in scope
+        for user in self.users:
+            UserRole.objects.create(user=user, role=self.viewer)
+        grant_scoped_role(self.manager, self.viewer, self.users[4])
+        queryset = filter_queryset_for_user(
+            self.manager, UserRole.objects.all(), "user.view", scope_model=User, scope_field='user_id'
+        )
+        self.assertEqual([ur.user_id for ur in queryset], [self.users[4].id])
+
+    def test_scope_is_a_subquery(self):
+        grant_scoped_role(self.manager, self.editor, self.users[1])
+        grant_scoped_role(self.manager, self.viewer, self.users[3])
+        queryset = filter_queryset_for_user(self.manager, User.objects.all(), "user.view")
+        # the grants are read inside the query of the rows
+        with self.assertNumQueries(1):
+            emails = {u.email for u in queryset}
+        self.assertEqual(emails, {"member1@joy.com", "member3@joy.com"})
+        queryset = filter_queryset_for_user(self.manager, User.objects.all(), "user.change")
+        self.assertEqual([u.email for u in queryset], ["member1@joy.com"])
+
+
+class CatalogCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        self.role = Role.objects.create(name="Editor")
+        self.role.permissions.add(Permission.objects.create(name="user.view"))
+        self.client.force_authenticate(user=self.admin)
+
+    def test_repeat_reads_skip_the_database(self):
+        for name in ("role-list", "permission-list"):
+            first = self.client.get(reverse(name))
+            with self.assertNumQueries(0):
+                second = self.client.get(reverse(name))
+            self.assertEqual(second.data, first.data)
+            self.assertEqual(second["ETag"], first["ETag"])
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=first["ETag"])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_catalog_writes_invalidate(self):
+        etag = self.client.get(reverse("role-list"))["ETag"]
+        self.role.permissions.add(Permission.objects.create(name="user.change"))
+        response = self.client.get(reverse("role-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(p["name"] for p in response.data[0]["permissions"]), ["user.change", "user.view"]
+        )
+
+        etag = response["ETag"]
+        Permission.objects.filter(name="user.change").update(description="editar")
+        self.assertNotEqual(self.client.get(reverse("role-list"))["ETag"], etag)
+
+    def test_assignments_keep_the_catalog(self):
+        etag = self.client.get(reverse("permission-list"))["ETag"]
+        UserRole.objects.create(user=User.objects.create(email="new@joy.com"), role=self.role)
+        response = self.client.get(reverse("permission-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_follows_the_payload(self):
+        etag = self.client.get(reverse("permission-list"))["ETag"]
+        # another worker wrote and this one's version counter did not move
+        with mock.patch("rbac.signals.invalidate_catalog"):
+            Permission.objects.create(name="user.change")
+        cache.delete(CATALOG_RESPONSE_KEY.format(version=get_catalog_version(), name="permissions"))
+        response = self.client.get(reverse("permission-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_query_strings_share_the_entry(self):
+        first = self.client.get(reverse("role-list"), {"junk": "1"})
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse("role-list"), {"other": "2"})
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_permission_check_still_applies(self):
+        self.client.get(reverse("role-list"))
+        self.client.force_authenticate(user=User.objects.create(email="nobody@joy.com"))
+        self.assertEqual(self.client.get(reverse("role-list")).status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(FAST_LIST_SERIALIZATION=False)
+class FastListTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(email="root@joy.com", is_superuser=True, first_name="Root")
+        editor = Role.objects.create(name="Editor", description="edita")
+        Role.objects.create(name="Empty")
+        editor.permissions.add(
+            Permission.objects.create(name="user.view", description="ver"),
+            Permission.objects.create(name="user.change"),
+        )
+        for i in range(3):
+            user = User.objects.create(email=f"user{i}@joy.com", is_active=bool(i % 2))
+            if i:
+                UserRole.objects.create(user=user, role=editor)
+        self.client.force_authenticate(user=self.admin)
+
+    def _both(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as slow:
+            expected = self.client.get(url)
+        cache.clear()
+        with override_settings(FAST_LIST_SERIALIZATION=True), CaptureQueriesContext(connection) as fast:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+        self.assertLessEqual(len(fast), len(slow))
+        return response
+
+    def test_same_json_as_the_serializers(self):
+        for url in (reverse("role-list"), reverse("permission-list"), reverse("user-list")):
+            self._both(url)
+
+    def test_pagination(self):
+        response = self._both(reverse("user-list") + "?limit=2&offset=1")
+        self.assertEqual(len(response.json()["results"]), 2)
+
+    def test_scoped_list(self):
+        member = User.objects.get(email="user1@joy.com")
+        grant_scoped_role(self.admin, Role.objects.get(name="Editor"), member)
+        self.admin.is_superuser = False
+        self.admin.save()
+        response = self._both(reverse("user-list"))
+        self.assertEqual([u["email"] for u in response.json()], ["user1@joy.com"])
+
+
+@override_settings(RBAC_MATERIALIZED_PERMISSIONS=True)
+class MaterializedPermissionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="boss@joy.com")
+        self.viewer = Role.objects.create(name="Viewer")
+        self.manager = Role.objects.create(name="Manager")
+        self.view = Permission.objects.create(name="user.view")
+        self.delete = Permission.objects.create(name="user.delete")
+        self.viewer.permissions.add(self.view)
+        self.manager.permissions.add(self.delete)
+        RoleParent.objects.create(role=self.manager, parent=self.viewer)
+        UserRole.objects.create(user=self.user, role=self.manager)
+
+    def rows(self, user=None):
+        return set(
+            UserEffectivePermission.objects.filter(user=user or self.user).values_list('permission__name', flat=True)
+        )
+
+    def assertConsistent(self):
+        report = effective.check()
+        self.assertEqual((report["missing"], report["extra"]), (0, 0), report["samples"])
+
+    def test_single_probe(self):
+        self.assertEqual(self.rows(), {"user.view", "user.delete"})
+        with self.assertNumQueries(1):
+            self.assertTrue(has_permission(self.user, "user.view"))
+        with self.assertNumQueries(1):
+            self.assertFalse(has_permission(self.user, "role.view"))
+        self.assertTrue(has_any_permission(self.user, ["role.view", "user.delete"]))
+        self.assertTrue(has_all_permissions(self.user, ["user.view", "user.delete"]))
+        self.assertEqual(
+            check_permissions_bulk([(self.user.id, "user.view"), (self.user.id, "role.view")]), [True, False]
+        )
+
+    def test_wildcards(self):
+        ops = Role.objects.create(name="Ops")
+        ops.permissions.add(Permission.objects.create(name="report.*.view"), Permission.objects.create(name="audit.*"))
+        UserRole.objects.create(user=self.user, role=ops)
+        self.assertTrue(has_permission(self.user, "report.sales.view"))
+        self.assertTrue(has_permission(self.user, "audit.log.export"))
+        self.assertFalse(has_permission(self.user, "report.sales.edit"))
+        self.assertFalse(has_permission(self.user, "audit"))
+
+    def test_role_grants_and_revocations(self):
+        other = User.objects.create(email="new@joy.com")
+        assignment = UserRole.objects.create(user=other, role=self.viewer)
+        self.assertEqual(self.rows(other), {"user.view"})
+        assignment.delete()
+        self.assertEqual(self.rows(other), set())
+        UserRole.objects.bulk_create([UserRole(user=other, role=self.manager)])
+        self.assertEqual(self.rows(other), {"user.view", "user.delete"})
+        UserRole.objects.filter(user=other).bulk_delete()
+        self.assertEqual(self.rows(other), set())
+        self.assertConsistent()
+
+    def test_role_permission_changes(self):
+        change = Permission.objects.create(name="user.change")
+        self.viewer.permissions.add(change)
+        self.assertIn("user.change", self.rows())
+        # still granted through Manager
+        self.manager.permissions.add(change)
+        self.viewer.permissions.remove(change)
+        self.assertIn("user.change", self.rows())
+        RolePermission.objects.filter(role=self.manager, permission=change).bulk_delete()
+        self.assertNotIn("user.change", self.rows())
+        self.assertConsistent()
+
+    def test_inheritance_changes(self):
+        RoleParent.objects.get(role=self.manager, parent=self.viewer).delete()
+        self.assertEqual(self.rows(), {"user.delete"})
+        RoleParent.objects.create(role=self.manager, parent=self.viewer)
+        self.assertEqual(self.rows(), {"user.view", "user.delete"})
+        self.assertConsistent()
+
+    def test_deletes(self):
+        self.viewer.delete()
+        self.assertEqual(self.rows(), {"user.delete"})
+        self.delete.delete()
+        self.assertEqual(self.rows(), set())
+        self.assertConsistent()
+
+    def test_scoped_roles_are_not_materialized(self):
+        other = User.objects.create(email="member@joy.com")
+        grant_scoped_role(other, self.viewer, self.user)
+        self.assertEqual(self.rows(other), set())
+        self.assertFalse(has_permission(other, "user.view"))
+
+    def test_summary_matches_the_joins(self):
+        with override_settings(RBAC_MATERIALIZED_PERMISSIONS=False):
+            expected = get_user_rbac_summary(self.user)
+        cache.clear()
+        self.assertEqual(get_user_rbac_summary(self.user), expected)
+
+    def test_check_and_rebuild_command(self):
+        UserEffectivePermission.objects.filter(user=self.user, permission=self.view).delete()
+        UserEffectivePermission.objects.create(
+            user=User.objects.create(email="stale@joy.com"), permission=self.delete
+        )
+        with self.assertRaises(CommandError):
+            call_command("rebuild_effective_permissions", "--check", stdout=StringIO())
+        call_command("rebuild_effective_permissions", stdout=StringIO())
+        self.assertConsistent()
+        self.assertEqual(self.rows(), {"user.view", "user.delete"})
+
+    def test_candidate_patterns(self):
+        for name in ("user.view", "report.sales.view", "audit", "a.b.c.d"):
+            candidates = set(candidate_patterns(name))
+            for pattern in ("*", "user.*", "report.*.view", "*.sales.*", "audit", "a.*.c.*", "a.b"):
+                self.assertEqual(pattern in candidates, grants(frozenset([pattern]), name), (name, pattern))
@@ -1,7 +1,7 @@
 from django.urls import path, include 
 from rest_framework.routers import DefaultRouter
 from .views import RoleViewSet, PermissionViewSet
-from .views import UserViewSet, UserRoleViewset
+from .views import UserViewSet, UserRoleViewset, AuthzCheckView
 
 # DefaultRouter: create automaticalli GET/api/roles, 
 # POST/api/roles, GET/api/roles<id>, PUT/DELETE
@@ -13,4 +13,5 @@ router.register(r'user_role', UserRoleViewset)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('authz/check', AuthzCheckView.as_view(), name='authz-check'),
 ]
\ No newline at end of file
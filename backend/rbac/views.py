@@ -1,36 +1,117 @@
+import hashlib
+
 from django.shortcuts import render
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework import viewsets, permissions
 from .models import Permission, Role, RolePermission as RolePermissionModel
 from .serializers import PermissionSerializer, RoleSerializer, RoleListSerializer
-from .serializers import AssignPermissionsSerializer, RoleListSerializer
-from .serializers import UserRoleSerializer
+from .serializers import AssignPermissionsSerializer, RoleListSerializer, AssignParentsSerializer
+from .serializers import UserRoleSerializer, AuthzCheckSerializer, BulkUserRoleSerializer
+from .serializers import PERMISSION_VALUES, ROLE_VALUES
 from users.models import User
-from users.serializers import UserSerializer
+from users.serializers import UserSerializer, USER_VALUES
 from .models import UserRole
-from .permissions import UserPermission, RolePermission, PermissionPermission
+from .permissions import UserPermission, RolePermission, PermissionPermission, AuthzCheckPermission
+from .permissions import BulkUserRolePermission
+from .services import check_permissions_bulk
+from .scopes import filter_queryset_for_user
+from .hierarchy import RoleCycleError, add_parents, remove_parents
+from rest_framework.views import APIView
+from authcore.http import make_etag, etag_matches, not_modified, with_etag
+from authcore.fastlist import FastListMixin
+from .cache import get_catalog_version, get_cached_catalog
 from audit.models import AuditLog
+from audit.pipeline import AuditEvent, record_events
 
 
 
-class PermissionViewSet(viewsets.ModelViewSet): # create automatically  GET, POST, PUT, DELETE with Model Viewset
-    queryset = Permission.objects.all()
-    serializer_class = PermissionSerializer
-    permission_classes = [PermissionPermission]
+class CatalogCacheMixin:
+    """
+    list() served from a response cache keyed on the catalog version, with
+    ETag / If-None-Match; a repeat read costs a cache get and no serialization
+    """
+    catalog_name = None
+
+    def list(self, request, *args, **kwargs):
+        # neither catalog reads query parameters: one entry per catalog
+        data, etag = get_cached_catalog(
+            self.catalog_name, get_catalog_version(), lambda: self.render_catalog(request, *args, **kwargs)
+        )
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        return with_etag(Response(data), etag)
+
+    def render_catalog(self, request, *args, **kwargs):
+        data = super(CatalogCacheMixin, self).list(request, *args, **kwargs).data
+        # taken from the payload, not the version: a worker whose version
+        # counter missed a write still changes the ETag once it reloads
+        digest = hashlib.sha1(JSONRenderer().render(data)).hexdigest()
+        return data, make_etag('catalog', self.catalog_name, digest)
 
 
-class RoleViewSet(viewsets.ModelViewSet):
-    queryset = Role.objects.prefetch_related('permissions')
+class PermissionViewSet(CatalogCacheMixin, FastListMixin, viewsets.ModelViewSet): # create automatically  GET, POST, PUT, DELETE with Model Viewset
+    queryset = Permission.objects.order_by('name')
+    serializer_class = PermissionSerializer
+    permission_classes = [PermissionPermission]
+    # safe requests may read from a replica (authcore.db)
+    replica_reads = True
+    catalog_name = 'permissions'
+    # list() from values_list() rows when FAST_LIST_SERIALIZATION is on (authcore.fastlist)
+    values_renderer = PERMISSION_VALUES
+
+
+class RoleViewSet(CatalogCacheMixin, FastListMixin, viewsets.ModelViewSet):
+    # stable orders, so the serializer and the fast list path render the same JSON
+    queryset = Role.objects.prefetch_related(
+        Prefetch('permissions', queryset=Permission.objects.order_by('name'))
+    ).order_by('name')
     serializer_class = RoleSerializer
     permission_classes = [RolePermission]
+    replica_reads = True
+    catalog_name = 'roles'
+    values_renderer = ROLE_VALUES
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return super().get_queryset()
+        # the permission writes diff by id, the prefetched rows would go unused
+        if self.action in ('delete_permissions', 'parents', 'delete_parents') or (
+                self.action == 'assign_permissions' and self.request.method != 'GET'):
+            return Role.objects.all()
+        return super().get_queryset()
+
+    def _sync_permissions(self, role, permission_ids, replace=False):
+        """
+        diffs the submitted ids against the role's permissions with one query
+        and applies it with one bulk insert and, on replace, one bulk delete
+        returns (added, removed)
+        """
+        wanted = set(permission_ids)
+        current = set(
+            RolePermissionModel.objects.filter(role=role).values_list('permission_id', flat=True)
+        )
+        added = wanted - current
+        removed = current - wanted if replace else set()
+        if added:
+            RolePermissionModel.objects.bulk_create(
+                [RolePermissionModel(role=role, permission_id=perm_id) for perm_id in added],
+                ignore_conflicts=True
+            )
+        if removed:
+            RolePermissionModel.objects.filter(role=role, permission_id__in=removed).bulk_delete()
+        return added, removed
 
     #-------------------------------
     # Assign permissions to role
     #-------------------------------
-    @action(detail=True, methods=['GET', 'POST'],
+    @action(detail=True, methods=['GET', 'POST', 'PUT'],
              url_path='permissions',
              serializer_class=AssignPermissionsSerializer)
     
@@ -46,18 +127,32 @@ class RoleViewSet(viewsets.ModelViewSet):
             serializer.is_valid(raise_exception=True)
             permissions_ids = serializer.validated_data['permissions']      
 
-            for perm_id in permissions_ids:
-                permission = get_object_or_404(Permission, id=perm_id)
-                RolePermissionModel.objects.get_or_create(
-                    role=role,
-                    permission=permission
-                )
+            with transaction.atomic():
+                self._sync_permissions(role, permissions_ids)
 
             return Response(
                 {"detail": "Permisos asignados correctamente"},
                 status=status.HTTP_200_OK
             )
     #-------------------------------
+    # PUT: replace the permissions of the role
+    #-------------------------------
+        if request.method == 'PUT':
+
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            permissions_ids = serializer.validated_data['permissions']
+
+            with transaction.atomic():
+                added, removed = self._sync_permissions(role, permissions_ids, replace=True)
+
+            return Response(
+                {"detail": "Permisos actualizados correctamente",
+                 "added": len(added),
+                 "removed": len(removed)},
+                status=status.HTTP_200_OK
+            )
+    #-------------------------------
     # GET: list permissions
     # -------------------------------
         permissions = role.permissions.all()
@@ -74,16 +169,11 @@ class RoleViewSet(viewsets.ModelViewSet):
     def delete_permissions(self, request, pk=None):
         role = self.get_object()
 
+        # unknown ids are rejected by the serializer
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         permissions_ids = serializer.validated_data['permissions']
-        permission_qs = Permission.objects.filter(id__in=permissions_ids)
 
-        if permission_qs.count() != len(permissions_ids):
-            return Response(
-                {"detail": "Uno o más permisos no existen"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
         #validate empty list
         if not permissions_ids:
             return Response(
@@ -93,18 +183,78 @@ class RoleViewSet(viewsets.ModelViewSet):
         RolePermissionModel.objects.filter(
             role=role,
             permission__id__in=permissions_ids
-        ).delete()
+        ).bulk_delete()
 
         return Response(
             {"detail": "Permisos removidos correctamente",
-             "permissions": [p.name for p in role.permissions.all()]},
+             "permissions": list(role.permissions.values_list('name', flat=True))},
+            status=status.HTTP_200_OK
+        )
+
+    #-------------------------------
+    # Parent roles, whose permissions the role inherits
+    #-------------------------------
+    @action(detail=True, methods=['GET', 'POST'],
+            url_path='parents',
+            serializer_class=AssignParentsSerializer)
+    def parents(self, request, pk=None):
+        role = self.get_object()
+
+        if request.method == 'POST':
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            try:
+                add_parents(role, serializer.validated_data['parents'])
+            except RoleCycleError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {"detail": "Roles padre asignados correctamente"},
+                status=status.HTTP_200_OK
+            )
+
+        parents = Role.objects.filter(child_links__role=role)
+        serializer = RoleListSerializer(parents, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['POST'], #POST for the same reason as permissions/delete
+            url_path='parents/delete',
+            serializer_class=AssignParentsSerializer)
+    def delete_parents(self, request, pk=None):
+        role = self.get_object()
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        remove_parents(role, serializer.validated_data['parents'])
+
+        return Response(
+            {"detail": "Roles padre removidos correctamente",
+             "parents": list(Role.objects.filter(child_links__role=role).values_list('name', flat=True))},
             status=status.HTTP_200_OK
         )
 
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+class UserViewSet(FastListMixin, viewsets.ModelViewSet):
+    queryset = User.objects.prefetch_related(
+        Prefetch('user_roles', queryset=UserRole.objects.select_related('role').order_by('role__name'))
+    ).order_by('date_joined', 'id')
     serializer_class = UserSerializer
     permission_classes = [UserPermission]
+    # opt-in: ?limit=&offset= paginates, plain requests still get the full list
+    pagination_class = LimitOffsetPagination
+    values_renderer = USER_VALUES
+
+    def get_queryset(self):
+        """
+        users holding only scoped grants see the users in their scope
+        """
+        queryset = super().get_queryset()
+        if getattr(self, 'swagger_fake_view', False):
+            return queryset
+        permission = UserPermission()
+        if self.action not in permission.scoped_actions:
+            return queryset
+        return filter_queryset_for_user(
+            self.request.user, queryset, permission.get_required_permission(self.request, self)
+        )
 
     def perform_create(self, serializer):
         serializer.save(_current_user=self.request.user)
@@ -218,4 +368,102 @@ class UserRoleViewset(viewsets.ModelViewSet):
         user_role.delete()
         return Response({
             "detail": "Rol removido correctamente"},
-            status=status.HTTP_200_OK)
\ No newline at end of file
+            status=status.HTTP_200_OK)
+
+    #-------------------------------
+    # Bulk assignment
+    #-------------------------------
+    @action(detail=False, methods=['POST'], url_path='bulk_assign',
+            serializer_class=BulkUserRoleSerializer,
+            permission_classes=[BulkUserRolePermission])
+    def bulk_assign(self, request):
+        """
+        POST /user_role/bulk_assign
+        assigns every role to every user in one transaction
+        Body: { "users": ["<user_id>", ...], "roles": ["<role_id>", ...] }
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        users = serializer.validated_data['users']
+        roles = serializer.validated_data['roles']
+
+        with transaction.atomic():
+            existing = set(
+                UserRole.objects.filter(user__in=users, role__in=roles).values_list('user_id', 'role_id')
+            )
+            new = [
+                UserRole(user_id=user_id, role_id=role_id)
+                for user_id in users for role_id in roles
+                if (user_id, role_id) not in existing
+            ]
+            # ignore_conflicts covers a concurrent request assigning the same pair;
+            # the rows it skipped keep the other request's ids, so only ours are audited
+            UserRole.objects.bulk_create(new, batch_size=1000, ignore_conflicts=True)
+            inserted = set(UserRole.objects.filter(user__in=users, role__in=roles).values_list('id', flat=True))
+            new = [obj for obj in new if obj.id in inserted]
+            record_events(
+                AuditEvent(request.user, 'UserRole', str(obj.id), 'create',
+                           {'user': users[obj.user_id], 'role': roles[obj.role_id]})
+                for obj in new
+            )
+
+        return Response({
+            "detail": "Roles asignados correctamente",
+            "created": len(new),
+            "existing": len(existing)},
+            status=status.HTTP_201_CREATED if new else status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['POST'], url_path='bulk_unassign',  #POST for the same reason as remove_role
+            serializer_class=BulkUserRoleSerializer,
+            permission_classes=[BulkUserRolePermission])
+    def bulk_unassign(self, request):
+        """
+        POST /user_role/bulk_unassign
+        removes every role from every user in one transaction
+        Body: { "users": ["<user_id>", ...], "roles": ["<role_id>", ...] }
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        users = serializer.validated_data['users']
+        roles = serializer.validated_data['roles']
+
+        with transaction.atomic():
+            removed = UserRole.objects.filter(user__in=users, role__in=roles).only(
+                'id', 'user_id', 'role_id'
+            ).select_for_update().bulk_delete()
+            record_events(
+                AuditEvent(request.user, 'UserRole', str(obj.id), 'delete',
+                           {'user': users[obj.user_id], 'role': roles[obj.role_id]})
+                for obj in removed
+            )
+
+        return Response({
+            "detail": "Roles removidos correctamente",
+            "removed": len(removed)},
+            status=status.HTTP_200_OK
+        )
+
+class AuthzCheckView(APIView):
+    """
+    POST /authz/check
+    evaluates many (user, permission) pairs in one request
+    Body: { "checks": [{ "user": "<user_id>", "permission": "<name>" }, ...] }
+    """
+    permission_classes = [AuthzCheckPermission]
+
+    def post(self, request):
+        serializer = AuthzCheckSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        checks = serializer.validated_data['checks']
+
+        decisions = check_permissions_bulk(
+            (check['user'], check['permission']) for check in checks
+        )
+        return Response({
+            "results": [
+                {"user": check['user'], "permission": check['permission'], "allowed": allowed}
+                for check, allowed in zip(checks, decisions)
+            ]},
+            status=status.HTTP_200_OK
+        )
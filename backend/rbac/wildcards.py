@@ -0,0 +1,129 @@
+"""
+Wildcard permission grants.
+
+A granted name may end in "*" ("user.*" grants every permission under
+"user", "*" grants everything) or use "*" for a single segment
+("report.*.view"). The wildcard patterns of a grant set are compiled once
+into a segment trie, so a check walks the segments of the requested name
+instead of scanning the grants. Grant sets without wildcards keep plain set
+membership.
+"""
+from functools import lru_cache
+
+WILDCARD = '*'
+SEPARATOR = '.'
+
+
+class _Node:
+    __slots__ = ('children', 'terminal', 'tail')
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False   # a pattern ends here
+        self.tail = False       # a pattern ends here with ".*": one or more segments follow
+
+
+class PermissionTrie:
+
+    def __init__(self, patterns):
+        self.root = _Node()
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        node = self.root
+        segments = pattern.split(SEPARATOR)
+        if segments[-1] == WILDCARD:
+            segments.pop()
+            tail = True
+        else:
+            tail = False
+        for segment in segments:
+            node = node.children.setdefault(segment, _Node())
+        if tail:
+            node.tail = True
+        else:
+            node.terminal = True
+
+    def matches(self, name):
+        segments = name.split(SEPARATOR)
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if i == len(segments):
+                if node.terminal:
+                    return True
+                continue
+            if node.tail:
+                return True
+            child = node.children.get(segments[i])
+            if child is not None:
+                stack.append((child, i + 1))
+            child = node.children.get(WILDCARD)
+            if child is not None:
+                stack.append((child, i + 1))
+        return False
+
+
+def is_pattern(name):
+    return WILDCARD in name
+
+
+@lru_cache(maxsize=4096)
+def compile_grants(granted: frozenset):
+    """
+    returns the trie of the wildcard patterns in granted, or None when there are none;
+    cached per grant set, which the permission cache shares between checks
+    """
+    patterns = [name for name in granted if is_pattern(name)]
+    return PermissionTrie(patterns) if patterns else None
+
+
+def grants(granted: frozenset, name: str) -> bool:
+    """
+    True when the grant set holds name exactly or through a wildcard
+    """
+    if name in granted:
+        return True
+    trie = compile_grants(granted)
+    return trie is not None and trie.matches(name)
+
+
+def grants_any(granted: frozenset, names) -> bool:
+    names = list(names)
+    if not granted.isdisjoint(names):
+        return True
+    trie = compile_grants(granted)
+    return trie is not None and any(trie.matches(name) for name in names)
+
+
+def grants_all(granted: frozenset, names) -> bool:
+    names = list(names)
+    if granted.issuperset(names):
+        return True
+    trie = compile_grants(granted)
+    return trie is not None and all(name in granted or trie.matches(name) for name in names)
+
+
+# names with more segments fall back to matching the grant set
+MAX_CANDIDATE_SEGMENTS = 6
+
+
+def candidate_patterns(name):
+    """
+    every grant that matches name: name itself and each wildcard pattern
+    that would match it, so a check can look the grants up by name instead
+    of reading them all. None when name has too many segments to enumerate
+    """
+    segments = name.split(SEPARATOR)
+    if len(segments) > MAX_CANDIDATE_SEGMENTS:
+        return None
+    prefixes = [[]]
+    candidates = []
+    for segment in segments:
+        # a prefix followed by ".*" matches one or more remaining segments
+        candidates += [SEPARATOR.join(prefix + [WILDCARD]) for prefix in prefixes]
+        prefixes = [prefix + [option] for prefix in prefixes for option in (segment, WILDCARD)]
+    # full length, the last segment literal (a final "*" is a tail pattern)
+    candidates += [SEPARATOR.join(prefix) for prefix in prefixes if prefix[-1] == segments[-1]]
+    return list(dict.fromkeys(candidates))
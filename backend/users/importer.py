@@ -0,0 +1,263 @@
+"""
+Bulk user import.
+
+Records are streamed from a CSV or JSONL file and written per chunk: one
+query for the emails that already exist, one bulk_create for the users and
+one for their role assignments, and the audit events of the chunk in one
+batch. Passwords may come pre-hashed in any format of PASSWORD_HASHERS;
+plain passwords are hashed in a process pool.
+
+After every committed chunk the number of records consumed is saved to a
+state file, so an interrupted import resumes where it stopped. Emails that
+already exist are skipped, which also makes a plain re-run safe.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from audit.pipeline import AuditEvent, record_events
+from rbac.models import Role, UserRole
+from .models import User
+
+ROLE_SEPARATOR = '|'
+MAX_ERROR_SAMPLES = 20
+
+
+def read_records(path, fmt=None):
+    """
+    yields one dict per user; fmt is "csv" or "jsonl", by default taken from the extension
+    """
+    fmt = fmt or ('jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as fh:
+        if fmt == 'csv':
+            for row in csv.DictReader(fh):
+                yield row
+        else:
+            for line in fh:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    # keeps the numbering, so a resume skips the line instead of failing on it again
+                    yield InvalidRecord(f"JSON inválido: {exc.msg}")
+                    continue
+                yield record if isinstance(record, dict) else InvalidRecord("se esperaba un objeto JSON")
+
+
+class InvalidRecord:
+    """
+    a line that could not be read; counted as an error when its chunk is written
+    """
+    def __init__(self, message):
+        self.message = message
+
+
+def _truthy(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
+def _init_worker(settings_module):
+    # spawned workers have to set Django up; forked ones already are
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+class UserImporter:
+
+    def __init__(self, batch_size=5000, workers=0, state_path=None, actor=None, stdout=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.state_path = state_path
+        self.actor = actor
+        self.stdout = stdout
+        self.stats = {'records': 0, 'created': 0, 'skipped': 0, 'errors': 0, 'role_assignments': 0}
+        self.error_samples = []
+        self._pool = None
+        self._roles = None
+
+    #-------------------------------
+    # State
+    #-------------------------------
+    def load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as fh:
+            self.stats.update(json.load(fh))
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'w') as fh:
+            json.dump(self.stats, fh)
+        os.replace(tmp, self.state_path)
+
+    #-------------------------------
+    # Records
+    #-------------------------------
+    def error(self, number, message):
+        self.stats['errors'] += 1
+        if len(self.error_samples) < MAX_ERROR_SAMPLES:
+            self.error_samples.append(f"registro {number}: {message}")
+
+    def roles(self):
+        if self._roles is None:
+            self._roles = dict(Role.objects.values_list('name', 'id'))
+        return self._roles
+
+    def prepare(self, number, record):
+        """
+        returns (User, plain password or None, role ids), or None when the record is invalid
+        """
+        if isinstance(record, InvalidRecord):
+            return self.error(number, record.message)
+        email = User.objects.normalize_email((record.get('email') or '').strip())
+        try:
+            validate_email(email)
+        except ValidationError:
+            return self.error(number, f"email inválido {email!r}")
+
+        password_hash = record.get('password_hash') or ''
+        plain = record.get('password') or None
+        if password_hash.startswith(UNUSABLE_PASSWORD_PREFIX):
+            pass
+        elif password_hash:
+            try:
+                identify_hasher(password_hash)
+            except ValueError:
+                return self.error(number, "formato de password_hash desconocido")
+        elif plain is None:
+            # no password: the user has to reset it
+            password_hash = make_password(None)
+
+        roles = self.roles()
+        names = record.get('roles') or []
+        if isinstance(names, str):
+            names = [r.strip() for r in names.split(ROLE_SEPARATOR) if r.strip()]
+        unknown = [name for name in names if name not in roles]
+        if unknown:
+            return self.error(number, f"roles inexistentes {unknown}")
+
+        user = User(
+            email=email,
+            first_name=record.get('first_name') or '',
+            last_name=record.get('last_name') or '',
+            is_active=_truthy(record.get('is_active'), True),
+            is_staff=_truthy(record.get('is_staff'), False),
+            password=password_hash,
+        )
+        return user, None if password_hash else plain, [roles[name] for name in names]
+
+    def hash_passwords(self, passwords):
+        if not passwords:
+            return []
+        if self.workers <= 1 or len(passwords) < 2:
+            return [make_password(p) for p in passwords]
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'authcore.settings'),)
+            )
+        return list(self._pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (self.workers * 4))))
+
+    #-------------------------------
+    # Writing
+    #-------------------------------
+    def write_chunk(self, chunk):
+        """
+        chunk: (record number, record) pairs
+        """
+        prepared = {}
+        for number, record in chunk:
+            row = self.prepare(number, record)
+            if row is None:
+                continue
+            if row[0].email in prepared:
+                self.stats['skipped'] += 1
+                continue
+            prepared[row[0].email] = row
+
+        existing = set(User.objects.filter(email__in=list(prepared)).values_list('email', flat=True))
+        self.stats['skipped'] += len(existing)
+        rows = [row for email, row in prepared.items() if email not in existing]
+
+        to_hash = [row for row in rows if row[1] is not None]
+        for row, encoded in zip(to_hash, self.hash_passwords([row[1] for row in to_hash])):
+            row[0].password = encoded
+
+        while True:
+            try:
+                self.insert(rows)
+                return
+            except IntegrityError:
+                # another import created some of these emails after they were looked up
+                taken = set(
+                    User.objects.filter(email__in=[row[0].email for row in rows]).values_list('email', flat=True)
+                )
+                if not taken:
+                    raise
+                self.stats['skipped'] += len(taken)
+                rows = [row for row in rows if row[0].email not in taken]
+
+    def insert(self, rows):
+        users = [user for user, _, _ in rows]
+        role_names = {role_id: name for name, role_id in self.roles().items()}
+        assignments = [UserRole(user=user, role_id=role_id) for user, _, role_ids in rows for role_id in role_ids]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=1000)
+            if assignments:
+                UserRole.objects.bulk_create(assignments, batch_size=1000)
+            record_events(
+                [AuditEvent(self.actor, 'User', str(u.id), 'create', {'email': u.email, 'source': 'import'})
+                 for u in users]
+                + [AuditEvent(self.actor, 'UserRole', str(a.id), 'create', {'user': a.user.email, 'role': role_names[a.role_id]})
+                   for a in assignments]
+            )
+        self.stats['created'] += len(users)
+        self.stats['role_assignments'] += len(assignments)
+
+    def run(self, records, resume=False):
+        if resume:
+            self.load_state()
+        done = self.stats['records']
+        started = time.perf_counter()
+        chunk = []
+        try:
+            for number, record in enumerate(records, start=1):
+                if number <= done:
+                    continue
+                chunk.append((number, record))
+                if len(chunk) >= self.batch_size:
+                    self.flush(chunk, started)
+                    chunk = []
+            if chunk:
+                self.flush(chunk, started)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        return self.stats
+
+    def flush(self, chunk, started):
+        self.write_chunk(chunk)
+        self.stats['records'] = chunk[-1][0]
+        self.save_state()
+        if self.stdout is not None:
+            self.stdout.write(
+                f"{self.stats['records']} registros: {self.stats['created']} creados, "
+                f"{self.stats['skipped']} omitidos, {self.stats['errors']} errores "
+                f"({time.perf_counter() - started:.1f}s)"
+            )
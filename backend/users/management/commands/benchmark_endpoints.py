@@ -0,0 +1,186 @@
+import random
+import time
+import uuid
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from audit.models import AuditLog
+from authcore.benchmarking import measure, write_results
+from rbac.models import Permission, Role, RolePermission, UserRole
+from rbac.permissions import UserPermission
+from users.models import User
+
+BATCH_SIZE = 20000
+PASSWORD = 'bench-password'
+
+
+class NamedPermission(UserPermission):
+    # checks the permission named by the view action
+    def get_required_permission(self, request, view):
+        return view.action
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency (p50/p95/p99) and throughput of the hot endpoints: login, refresh, "
+        "/api/me/, RBAC permission checks, /api/user/ and /api/audit-logs/, at increasing "
+        "dataset sizes. Seeds a synthetic dataset inside a transaction that is rolled back. "
+        "Runs against the default database; set POSTGRES_DB to use a local Postgres."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='comma separated user counts, measured in increasing order')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='requests per endpoint and size')
+        parser.add_argument('--login-requests', type=int, default=20,
+                            help='login hashes the password, so it gets fewer requests')
+        parser.add_argument('--roles', type=int, default=50)
+        parser.add_argument('--permissions', type=int, default=100)
+        parser.add_argument('--perms-per-role', type=int, default=10)
+        parser.add_argument('--roles-per-user', type=int, default=2)
+        parser.add_argument('--audit-per-user', type=int, default=5)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',') if size.strip()})
+        except ValueError:
+            raise CommandError("--sizes must be a comma separated list of integers")
+        if not sizes or sizes[0] < 1:
+            raise CommandError("--sizes must hold positive integers")
+        rng = random.Random(options['seed'])
+
+        results = {
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'login_requests': options['login_requests'],
+            'dataset': {k: options[k] for k in (
+                'roles', 'permissions', 'perms_per_role', 'roles_per_user', 'audit_per_user'
+            )},
+            'sizes': [],
+        }
+        # the test client talks to "testserver"
+        with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+            self.client = Client()
+            role_ids, perm_names = self.seed_catalog(rng, options)
+            admin = User.objects.create_superuser(email=f"bench-admin-{uuid.uuid4().hex}@bench.local", password=PASSWORD)
+            self.admin_access = str(RefreshToken.for_user(admin).access_token)
+
+            user_ids = []
+            for size in sizes:
+                started = time.perf_counter()
+                user_ids += self.seed_users(rng, options, role_ids, size - len(user_ids))
+                seed_seconds = time.perf_counter() - started
+                self.stdout.write(f"{size} users seeded in {seed_seconds:.1f}s", self.style.NOTICE)
+
+                cache.clear()
+                results['sizes'].append({
+                    'users': size,
+                    'seed_seconds': seed_seconds,
+                    **self.run(rng, options, user_ids, perm_names),
+                })
+            transaction.set_rollback(True)
+        cache.clear()
+
+        write_results(results, options['output'], self.stdout)
+
+    #-------------------------------
+    # Seeding
+    #-------------------------------
+    def seed_catalog(self, rng, options):
+        perm_names = [f"bench.perm{i}" for i in range(options['permissions'])]
+        permissions = Permission.objects.bulk_create([Permission(name=name) for name in perm_names])
+        roles = Role.objects.bulk_create(
+            [Role(name=f"bench-role-{uuid.uuid4().hex}") for _ in range(options['roles'])]
+        )
+        per_role = min(options['perms_per_role'], len(permissions))
+        RolePermission.objects.bulk_create(
+            [RolePermission(role=role, permission=perm)
+             for role in roles for perm in rng.sample(permissions, per_role)],
+            batch_size=BATCH_SIZE
+        )
+        return [r.id for r in roles], perm_names
+
+    def seed_users(self, rng, options, role_ids, count):
+        if count <= 0:
+            return []
+        users = User.objects.bulk_create(
+            [User(email=f"bench-{uuid.uuid4().hex}@bench.local", password='!') for _ in range(count)],
+            batch_size=BATCH_SIZE
+        )
+        user_ids = [u.id for u in users]
+        per_user = min(options['roles_per_user'], len(role_ids))
+        UserRole.objects.bulk_create(
+            [UserRole(user_id=user_id, role_id=role_id)
+             for user_id in user_ids for role_id in rng.sample(role_ids, per_user)],
+            batch_size=BATCH_SIZE
+        )
+        AuditLog.objects.bulk_create(
+            [AuditLog(user_id=rng.choice(user_ids), model_name='User', object_id=str(user_id),
+                      action=rng.choice(('create', 'update', 'delete')), changes={})
+             for user_id in user_ids for _ in range(options['audit_per_user'])],
+            batch_size=BATCH_SIZE
+        )
+        return user_ids
+
+    #-------------------------------
+    # Measuring
+    #-------------------------------
+    def get(self, url, access, data=None):
+        response = self.client.get(url, data, HTTP_AUTHORIZATION=f"Bearer {access}")
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} answered {response.status_code}")
+
+    def post(self, url, data):
+        response = self.client.post(url, data, content_type='application/json')
+        if response.status_code != 200:
+            raise CommandError(f"POST {url} answered {response.status_code}")
+
+    def run(self, rng, options, user_ids, perm_names):
+        n = options['requests']
+        page_size = options['page_size']
+
+        login_user = User.objects.create_user(email=f"bench-login-{uuid.uuid4().hex}@bench.local", password=PASSWORD)
+        refresh = str(RefreshToken.for_user(login_user))
+        access = str(RefreshToken.for_user(login_user).access_token)
+
+        permission = NamedPermission()
+        checks = [
+            (SimpleNamespace(user=User(id=rng.choice(user_ids)), auth=None), SimpleNamespace(action=rng.choice(perm_names)))
+            for _ in range(n)
+        ]
+
+        offsets = [(rng.randrange(0, max(1, len(user_ids) - page_size)),) for _ in range(n)]
+        audit_users = [(rng.choice(user_ids),) for _ in range(n)]
+
+        return {
+            'login': measure(
+                lambda: self.post(reverse('token_obtain_pair'), {'email': login_user.email, 'password': PASSWORD}),
+                [()] * options['login_requests']
+            ),
+            'refresh': measure(lambda: self.post(reverse('token_refresh'), {'refresh': refresh}), [()] * n),
+            'me': measure(lambda: self.get(reverse('me'), access), [()] * n),
+            'rbac_check': measure(permission.has_permission, checks),
+            'user_list': measure(
+                lambda offset: self.get(reverse('user-list'), self.admin_access, {'limit': page_size, 'offset': offset}),
+                offsets
+            ),
+            'audit_list': measure(
+                lambda: self.get(reverse('auditlog-list'), self.admin_access, {'page_size': page_size}),
+                [()] * n
+            ),
+            'audit_list_by_user': measure(
+                lambda user_id: self.get(reverse('auditlog-list'), self.admin_access,
+                                         {'user': user_id, 'page_size': page_size}),
+                audit_users
+            ),
+        }
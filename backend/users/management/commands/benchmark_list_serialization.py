@@ -0,0 +1,160 @@
+import gc
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+
+from audit.models import AuditLog
+from audit.serializer import AuditLogSerializer, VALUE_FIELDS, serialize_values
+from authcore.benchmarking import summarize, write_results
+from rbac.models import Permission, Role, RolePermission, UserRole
+from rbac.serializers import PERMISSION_VALUES, ROLE_VALUES, PermissionSerializer, RoleSerializer
+from rbac.views import PermissionViewSet, RoleViewSet, UserViewSet
+from users.models import User
+from users.serializers import USER_VALUES, UserSerializer
+
+BATCH_SIZE = 20000
+PER_ROWS = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the CPU time of rendering the role, permission, user and audit lists through "
+        "their ModelSerializer and through the values_list() fast path (FAST_LIST_SERIALIZATION), "
+        "reported per 10k rows. Both paths must produce the same JSON bytes. Seeds a synthetic "
+        "dataset inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=PER_ROWS, help='rows per list')
+        parser.add_argument('--rounds', type=int, default=5, help='renders per list and path')
+        parser.add_argument('--perms-per-role', type=int, default=10)
+        parser.add_argument('--roles-per-user', type=int, default=2)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['rounds'] < 1:
+            raise CommandError("--rows and --rounds must be positive")
+        rng = random.Random(options['seed'])
+        self.rows = options['rows']
+        self.rounds = options['rounds']
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.seed(rng, options)
+            self.stdout.write(f"{self.rows} rows per list seeded in {time.perf_counter() - started:.1f}s", self.style.NOTICE)
+
+            # the list querysets of the viewsets, prefetches and orders included;
+            # every run clones them, a reused queryset would serve its result cache
+            tag = self.tag
+            roles = RoleViewSet.queryset.filter(name__startswith=tag)
+            permissions = PermissionViewSet.queryset.filter(name__startswith=tag)
+            users = UserViewSet.queryset.filter(email__startswith=tag)
+            audit = AuditLog.objects.filter(model_name=tag).order_by('-timestamp', '-id')
+
+            results = {
+                'database': connection.vendor,
+                'rows': self.rows,
+                'rounds': self.rounds,
+                'lists': {
+                    'roles': self.compare(
+                        lambda: RoleSerializer(roles.all(), many=True).data,
+                        lambda: ROLE_VALUES.render(ROLE_VALUES.values(roles)),
+                    ),
+                    'permissions': self.compare(
+                        lambda: PermissionSerializer(permissions.all(), many=True).data,
+                        lambda: PERMISSION_VALUES.render(PERMISSION_VALUES.values(permissions)),
+                    ),
+                    'users': self.compare(
+                        lambda: UserSerializer(users.all(), many=True).data,
+                        lambda: USER_VALUES.render(USER_VALUES.values(users)),
+                    ),
+                    # the audit list already had its values() path (audit.serializer.serialize_values)
+                    'audit': self.compare(
+                        lambda: AuditLogSerializer(audit.select_related('user'), many=True).data,
+                        lambda: serialize_values(list(audit.values(*VALUE_FIELDS))),
+                    ),
+                },
+            }
+            transaction.set_rollback(True)
+
+        write_results(results, options['output'], self.stdout)
+
+    #-------------------------------
+    # Seeding
+    #-------------------------------
+    def seed(self, rng, options):
+        self.tag = f"bench-{uuid.uuid4().hex[:8]}-"
+        count = self.rows
+        permissions = Permission.objects.bulk_create(
+            [Permission(name=f"{self.tag}perm{i}", description=f"permiso {i}") for i in range(count)],
+            batch_size=BATCH_SIZE
+        )
+        roles = Role.objects.bulk_create(
+            [Role(name=f"{self.tag}role{i}", description=f"rol {i}") for i in range(count)],
+            batch_size=BATCH_SIZE
+        )
+        per_role = min(options['perms_per_role'], len(permissions))
+        RolePermission.objects.bulk_create(
+            [RolePermission(role=role, permission=perm)
+             for role in roles for perm in rng.sample(permissions, per_role)],
+            batch_size=BATCH_SIZE
+        )
+        users = User.objects.bulk_create(
+            [User(email=f"{self.tag}{i}@bench.local", first_name='Bench', password='!') for i in range(count)],
+            batch_size=BATCH_SIZE
+        )
+        per_user = min(options['roles_per_user'], len(roles))
+        UserRole.objects.bulk_create(
+            [UserRole(user=user, role=role) for user in users for role in rng.sample(roles, per_user)],
+            batch_size=BATCH_SIZE
+        )
+        AuditLog.objects.bulk_create(
+            [AuditLog(user=rng.choice(users), model_name=self.tag, object_id=str(i),
+                      action=rng.choice(('create', 'update', 'delete')), changes={'field': {'from': i, 'to': i + 1}})
+             for i in range(count)],
+            batch_size=BATCH_SIZE
+        )
+
+    #-------------------------------
+    # Measuring
+    #-------------------------------
+    def timed(self, render):
+        """
+        returns (JSON bytes, CPU seconds, wall seconds) of one query + serialize + render
+        """
+        # start every run without the previous run's garbage
+        gc.collect()
+        cpu, wall = time.process_time(), time.perf_counter()
+        content = JSONRenderer().render(render())
+        return content, time.process_time() - cpu, time.perf_counter() - wall
+
+    def compare(self, serializer_path, fast_path):
+        runs = {'serializer': serializer_path, 'fast': fast_path}
+        cpu = {name: [] for name in runs}
+        wall = {name: [] for name in runs}
+        contents = {}
+        for _ in range(self.rounds):
+            for name, render in runs.items():
+                contents[name], cpu_seconds, wall_seconds = self.timed(render)
+                cpu[name].append(cpu_seconds)
+                wall[name].append(wall_seconds)
+        if contents['serializer'] != contents['fast']:
+            raise CommandError("the fast path rendered different JSON than the serializer")
+
+        scale = PER_ROWS / self.rows * 1000
+        result = {
+            name: {
+                'cpu_ms_per_10k': sum(cpu[name]) / self.rounds * scale,
+                'wall_ms_per_10k': sum(wall[name]) / self.rounds * scale,
+                'wall': summarize(wall[name]),
+            }
+            for name in runs
+        }
+        result['cpu_speedup'] = result['serializer']['cpu_ms_per_10k'] / max(result['fast']['cpu_ms_per_10k'], 1e-9)
+        result['bytes'] = len(contents['fast'])
+        return result
@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authcore.schema import schema_dir, write_schema_files
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema once and write swagger.json and swagger.yaml for the docs routes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='defaults to API_SCHEMA_DIR')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'API_DOCS_ENABLED', True):
+            raise CommandError("API_DOCS_ENABLED está desactivado")
+        started = time.perf_counter()
+        paths = write_schema_files(options['dir'] or schema_dir())
+        self.stdout.write(self.style.SUCCESS(
+            f"Esquema generado en {time.perf_counter() - started:.2f}s: " + ", ".join(str(p) for p in paths)
+        ))
@@ -0,0 +1,56 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importer import UserImporter, read_records
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users from a CSV (with header) or JSONL file. Columns: email, first_name, last_name, "
+        "is_active, is_staff, roles (role names separated by '|' or a JSON list) and either "
+        "password_hash (any format of PASSWORD_HASHERS) or password (hashed here). "
+        "Existing emails are skipped; --resume continues an interrupted import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='processes hashing plain passwords; 0 or 1 hashes in this process')
+        parser.add_argument('--state', default=None,
+                            help='progress file, defaults to <path>.import-state.json')
+        parser.add_argument('--resume', action='store_true',
+                            help='skip the records a previous run already committed')
+        parser.add_argument('--actor', default=None, help='email recorded as the author of the audit entries')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"No existe el archivo {path}")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size debe ser mayor que 0")
+        actor = None
+        if options['actor']:
+            actor = User.objects.filter(email=options['actor']).first()
+            if actor is None:
+                raise CommandError(f"No existe el usuario {options['actor']}")
+
+        importer = UserImporter(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            state_path=options['state'] or f"{path}.import-state.json",
+            actor=actor,
+            stdout=self.stdout,
+        )
+        stats = importer.run(read_records(path, options['format']), resume=options['resume'])
+
+        for message in importer.error_samples:
+            self.stderr.write(message)
+        self.stdout.write(self.style.SUCCESS(
+            f"Importación terminada: {stats['created']} usuarios creados, {stats['role_assignments']} roles asignados, "
+            f"{stats['skipped']} omitidos, {stats['errors']} errores"
+        ))
@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
-from rbac.models import Role, Permission
+from collections import defaultdict
+
+from authcore.fastlist import ValuesRenderer
+from rbac.models import UserRole
+from rbac.services import get_user_rbac_summary
 
 User = get_user_model() # get custom user model
 
@@ -30,9 +34,16 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'is_staff', 'date_joined', 'is_superuser']
 
     def get_roles(self, obj):
+        # the viewset prefetches user_roles with their role, avoiding one query per user
+        if 'user_roles' in getattr(obj, '_prefetched_objects_cache', {}):
+            return [
+                {'role__id': user_role.role.id, 'role__name': user_role.role.name}
+                for user_role in obj.user_roles.all()
+            ]
         return list(
             obj.user_roles
                 .select_related('role')
+                .order_by('role__name')
                 .values('role__id', 'role__name')
             )
         
@@ -44,21 +55,31 @@ class MeSerializer(serializers.ModelSerializer):
         fields = ['id', 'email', 'first_name', 'last_name', 'roles', 'is_superuser', 'permissions']
         read_only_fields = fields
     
+    def _summary(self, obj):
+        # roles and permissions come from one cached, aggregated query
+        if getattr(self, '_rbac_summary', None) is None:
+            self._rbac_summary = get_user_rbac_summary(obj)
+        return self._rbac_summary
+
     def get_roles(self, obj):
-        return list(
-            obj.user_roles
-                .select_related('role')
-                .values_list('role__name', flat=True)
-        )
+        return self._summary(obj)['roles']
+
     def get_permissions(self, obj):
+        return self._summary(obj)['permissions']
+
+
+def _user_roles(user_ids):
+    # same rows, in the same order, as the viewset's user_roles prefetch
+    roles = defaultdict(list)
+    rows = (
+        UserRole.objects.filter(user__in=user_ids)
+        .order_by('role__name')
+        .values_list('user_id', 'role__id', 'role__name')
+    )
+    for user_id, role_id, role_name in rows:
+        roles[user_id].append({'role__id': role_id, 'role__name': role_name})
+    return roles
+
 
-        if obj.is_superuser:
-           perms = Permission.objects.all()
-        else:
-            roles = Role.objects.filter(role_assignments__user=obj).prefetch_related('permissions')
-            perms_set = set()
-            for role in roles:
-                for perm in role.permissions.all():
-                    perms_set.add(perm)
-            perms = list(perms_set)
-        return [{'name': p.name, 'description': p.description} for p in perms]
+# values_list() renderer for the user list (authcore.fastlist)
+USER_VALUES = ValuesRenderer(UserSerializer, computed={'roles': (_user_roles, [])})
@@ -1,3 +1,427 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import uuid
+from unittest import mock
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.db import router
+from django.http import JsonResponse
+from django.test import TestCase, AsyncRequestFactory, RequestFactory, override_settings
+from django.views import View
+from django.urls import path, reverse
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from rbac.models import Role, Permission, UserRole
+from audit.models import AuditLog
+from authcore.db import ReadReplicaMiddleware, read_from_primary, read_from_replica
+from authcore.metrics import render_metrics, reset_metrics
+from authcore.schema import generate_schema, schema_fingerprint
+from rbac.cache import get_cached_permissions
+from rbac.views import RoleViewSet
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from .importer import UserImporter, read_records
+from .views import AsyncMeview
 
-# Create your tests here.
+User = get_user_model()
+
+
+class MeViewTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="me@joy.com", first_name="Joy")
+        self.role = Role.objects.create(name="Editor")
+        self.role.permissions.add(
+            Permission.objects.create(name="user.view", description="ver"),
+            Permission.objects.create(name="role.view", description="ver roles"),
+        )
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("me")
+
+    def test_roles_and_permissions_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["roles"], ["Editor"])
+        self.assertEqual(
+            response.data["permissions"],
+            [{"name": "role.view", "description": "ver roles"},
+             {"name": "user.view", "description": "ver"}]
+        )
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_etag_returns_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_changes_with_rbac(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.role.permissions.add(Permission.objects.create(name="user.change"))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("user.change", [p["name"] for p in response.data["permissions"]])
+
+    def test_superuser_sees_every_permission(self):
+        admin = User.objects.create(email="root@joy.com", is_superuser=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data["permissions"]), Permission.objects.count())
+
+
+class AsyncMeviewTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="async@joy.com", first_name="Joy")
+        role = Role.objects.create(name="Editor")
+        role.permissions.add(Permission.objects.create(name="user.view", description="ver"))
+        UserRole.objects.create(user=self.user, role=role)
+        self.token = str(AccessToken.for_user(self.user))
+        self.factory = AsyncRequestFactory()
+        self.view = AsyncMeview.as_view()
+
+    def request(self, token=None, **headers):
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return self.factory.get("/api/me/", headers=headers)
+
+    async def test_matches_sync_view(self):
+        response = await self.view(self.request(self.token))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=self.user)
+        expected = await sync_to_async(self.client.get)(reverse("me"))
+        self.assertEqual(json.loads(response.content), expected.json())
+        self.assertEqual(response["ETag"], expected["ETag"])
+
+    async def test_etag_returns_not_modified(self):
+        etag = (await self.view(self.request(self.token)))["ETag"]
+        response = await self.view(self.request(self.token, If_None_Match=etag))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_missing_and_invalid_tokens(self):
+        response = await self.view(self.request())
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("detail", json.loads(response.content))
+        self.assertEqual(response["WWW-Authenticate"], 'Bearer realm="api"')
+
+        response = await self.view(self.request("not-a-token"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content)["code"], "token_not_valid")
+
+
+@override_settings(METRICS={'ENABLED': True, 'SERVER_TIMING': True})
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+        self.user = User.objects.create(email="metrics@joy.com")
+        self.client.force_authenticate(user=self.user)
+
+    def test_request_is_recorded(self):
+        response = self.client.get(reverse("me"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('authcore_request_db_queries_bucket{view="me",method="GET",le="1"} 1', body)
+        self.assertIn('authcore_request_db_queries_count{view="me",method="GET"} 1', body)
+        self.assertIn('authcore_response_size_bytes_count{view="me",method="GET"} 1', body)
+        self.assertIn('authcore_rbac_cache_misses_total', body)
+
+    def test_routes_keep_ids_out_of_labels(self):
+        self.client.get(reverse("user-detail", args=[self.user.id]))
+        body = render_metrics()
+        self.assertIn('view="user-detail"', body)
+        self.assertNotIn(str(self.user.id), body)
+
+    async def test_async_request_is_recorded(self):
+        access = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        response = await self.async_client.get(reverse("me"), headers={"Authorization": f"Bearer {access}"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Server-Timing", response)
+        self.assertIn('authcore_request_duration_seconds_count{view="me",method="GET"} 1', render_metrics())
+
+    @override_settings(METRICS={'ENABLED': True, 'TOKEN': 's3cret', 'ALLOWED_IPS': ()})
+    def test_scrapes_need_the_token_or_an_allowed_address(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer nope").status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer s3cret").status_code, status.HTTP_200_OK)
+        with override_settings(METRICS={'ENABLED': True, 'ALLOWED_IPS': ('10.0.0.5',)}):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.5").status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.6").status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS={'ENABLED': False})
+    def test_disabled(self):
+        response = self.client.get(reverse("me"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(PASSWORD_HASHERS=[
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+])
+class ImportUsersTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.role = Role.objects.create(name="Editor")
+        Role.objects.create(name="Viewer")
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def import_users(self, path, *args):
+        out = io.StringIO()
+        call_command('import_users', path, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_csv_with_hashed_and_plain_passwords(self):
+        encoded = make_password("legacy-secret")
+        path = self.write("users.csv", (
+            "email,first_name,password_hash,password,roles\n"
+            f"ana@joy.com,Ana,{encoded},,Editor|Viewer\n"
+            "bob@joy.com,Bob,,plain-secret,Viewer\n"
+            "carl@joy.com,Carl,,,\n"
+        ))
+        self.import_users(path, "--workers", "0")
+
+        ana = User.objects.get(email="ana@joy.com")
+        self.assertEqual(ana.password, encoded)
+        self.assertTrue(ana.check_password("legacy-secret"))
+        self.assertEqual(sorted(ana.user_roles.values_list('role__name', flat=True)), ["Editor", "Viewer"])
+        self.assertTrue(User.objects.get(email="bob@joy.com").check_password("plain-secret"))
+        self.assertFalse(User.objects.get(email="carl@joy.com").has_usable_password())
+        self.assertEqual(AuditLog.objects.filter(model_name='User', action='create').count(), 3)
+        self.assertEqual(AuditLog.objects.filter(model_name='UserRole', action='create').count(), 3)
+
+    def test_jsonl_chunks_use_constant_queries(self):
+        path = self.write("users.jsonl", "".join(
+            json.dumps({"email": f"user{i}@joy.com", "password_hash": "!", "roles": ["Editor"]}) + "\n"
+            for i in range(40)
+        ))
+        # roles, then per chunk: existing emails, users, assignments, audit rows (+ savepoint pair)
+        with self.assertNumQueries(1 + 2 * 6):
+            self.import_users(path, "--batch-size", "20")
+        self.assertEqual(UserRole.objects.filter(role=self.role).count(), 40)
+
+    def test_invalid_records_are_reported_and_skipped(self):
+        path = self.write("users.csv", (
+            "email,password_hash,roles\n"
+            "not-an-email,,\n"
+            "dan@joy.com,nohasher$abc,\n"
+            "eve@joy.com,,Missing\n"
+            "fay@joy.com,,\n"
+        ))
+        out = self.import_users(path)
+        self.assertIn("1 usuarios creados", out)
+        self.assertIn("3 errores", out)
+        self.assertEqual(list(User.objects.values_list('email', flat=True)), ["fay@joy.com"])
+
+    def test_malformed_json_lines_are_errors(self):
+        path = self.write("users.jsonl", (
+            '{"email": "gil@joy.com"}\n'
+            '{"email": "broken@joy.com",\n'
+            '["not", "an", "object"]\n'
+            '{"email": "hal@joy.com"}\n'
+        ))
+        out = self.import_users(path)
+        self.assertIn("2 usuarios creados", out)
+        self.assertIn("2 errores", out)
+        with open(path + ".import-state.json") as fh:
+            self.assertEqual(json.load(fh)["records"], 4)
+
+    def test_concurrent_insert_of_an_email(self):
+        path = self.write("users.csv", "email,password\nian@joy.com,secret\njay@joy.com,secret\n")
+        importer = UserImporter()
+        hash_passwords = importer.hash_passwords
+
+        def hash_and_race(passwords):
+            # another import creates one of the emails after they were looked up
+            User.objects.create(email="jay@joy.com")
+            return hash_passwords(passwords)
+
+        with mock.patch.object(importer, 'hash_passwords', hash_and_race):
+            stats = importer.run(read_records(path))
+        self.assertEqual((stats['created'], stats['skipped']), (1, 1))
+        self.assertTrue(User.objects.get(email="ian@joy.com").check_password("secret"))
+
+    def test_resume_and_rerun(self):
+        User.objects.create(email="u0@joy.com")
+        path = self.write("users.csv", "email\n" + "".join(f"u{i}@joy.com\n" for i in range(6)))
+        state = path + ".import-state.json"
+        with open(state, 'w') as fh:
+            json.dump({"records": 3, "created": 2, "skipped": 1, "errors": 0, "role_assignments": 0}, fh)
+
+        self.import_users(path, "--resume")
+        # u1 and u2 were recorded as done
+        self.assertEqual(
+            sorted(User.objects.values_list('email', flat=True)),
+            ["u0@joy.com", "u3@joy.com", "u4@joy.com", "u5@joy.com"]
+        )
+        with open(state) as fh:
+            self.assertEqual(json.load(fh)["records"], 6)
+
+        # a plain re-run starts over and skips the existing emails
+        out = self.import_users(path)
+        self.assertIn("2 usuarios creados", out)
+        self.assertIn("4 omitidos", out)
+        self.assertEqual(User.objects.count(), 6)
+
+    def test_process_pool_hashing(self):
+        path = self.write("users.csv", "email,password\n" + "".join(f"p{i}@joy.com,secret-{i}\n" for i in range(8)))
+        self.import_users(path, "--workers", "2")
+        self.assertTrue(User.objects.get(email="p5@joy.com").check_password("secret-5"))
+
+
+class RecordingView(View):
+    replica_reads = True
+
+    def get(self, request):
+        return JsonResponse({'read': router.db_for_read(User), 'write': router.db_for_write(User)})
+
+    post = get
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReadReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ReadReplicaMiddleware(self.dispatch)
+
+    def dispatch(self, request):
+        view = self.view_class.as_view()
+        self.middleware.process_view(request, view, (), {})
+        return view(request)
+
+    def call(self, request, view_class=RecordingView):
+        self.view_class = view_class
+        return self.middleware(request)
+
+    def test_safe_request_reads_replica(self):
+        response = self.call(self.factory.get('/'))
+        self.assertEqual(json.loads(response.content), {'read': 'replica1', 'write': 'default'})
+        # nothing leaks out of the request
+        self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_views_opt_in(self):
+        class PrimaryView(RecordingView):
+            replica_reads = False
+        response = self.call(self.factory.get('/'), PrimaryView)
+        self.assertEqual(json.loads(response.content)['read'], 'default')
+
+    def test_write_pins_client_to_primary(self):
+        response = self.call(self.factory.post('/'))
+        self.assertEqual(json.loads(response.content)['read'], 'default')
+        cookie = response.cookies['authcore_primary']
+
+        request = self.factory.get('/')
+        request.COOKIES['authcore_primary'] = cookie.value
+        self.assertEqual(json.loads(self.call(request).content)['read'], 'default')
+
+        request.COOKIES['authcore_primary'] = '0'
+        self.assertEqual(json.loads(self.call(request).content)['read'], 'replica1')
+
+    def test_cache_loaders_read_primary(self):
+        seen = []
+        with read_from_replica('replica1'):
+            self.assertEqual(router.db_for_read(Role), 'replica1')
+            self.assertEqual(router.db_for_read(OutstandingToken), 'default')
+            get_cached_permissions(uuid.uuid4(), lambda: seen.append(router.db_for_read(Role)) or [])
+        self.assertEqual(seen, ['default'])
+
+    def test_drf_viewsets_are_recognized(self):
+        view = RoleViewSet.as_view({'get': 'list'})
+        with read_from_primary():
+            self.middleware.process_view(self.factory.get('/'), view, (), {})
+            self.assertEqual(router.db_for_read(Role), 'replica1')
+
+
+class AsyncMeUrls:
+    urlpatterns = [path('me/', AsyncMeview.as_view())]
+
+
+# DEBUG makes the handler log every middleware it has to adapt
+@override_settings(ROOT_URLCONF=AsyncMeUrls, DEBUG=True, METRICS={'ENABLED': True})
+class AsgiStackTests(TestCase):
+
+    async def test_async_me_is_not_adapted_to_sync(self):
+        user = await User.objects.acreate(email="asgi@joy.com")
+        access = await sync_to_async(lambda: str(RefreshToken.for_user(user).access_token))()
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            response = await self.async_client.get('/me/', headers={"Authorization": f"Bearer {access}"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["email"], "asgi@joy.com")
+
+
+class ApiDocsTests(APITestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        settings_override = override_settings(API_SCHEMA_DIR=self.dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_schema_is_built_once_and_streamed(self):
+        with mock.patch('authcore.schema.generate_schema', wraps=generate_schema) as generate:
+            response = self.client.get('/swagger.json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            schema = json.loads(b''.join(response.streaming_content))
+            self.assertIn('/user/', schema['paths'])
+            self.client.get('/swagger.json')
+            self.client.get('/swagger.yaml')
+        self.assertEqual(generate.call_count, 1)
+        # no temporary files left behind
+        self.assertEqual(sorted(os.listdir(self.dir.name)), ['schema.fingerprint', 'swagger.json', 'swagger.yaml'])
+
+    def test_files_of_another_build_are_rebuilt(self):
+        self.client.get('/swagger.json')
+        fingerprint = schema_fingerprint()
+        with mock.patch('authcore.schema.generate_schema', wraps=generate_schema) as generate:
+            with override_settings(API_SCHEMA_BUILD_ID='next-release'):
+                self.assertEqual(self.client.get('/swagger.json').status_code, status.HTTP_200_OK)
+                self.client.get('/swagger.yaml')
+            self.assertEqual(generate.call_count, 1)
+            # a changed URLconf changes the fingerprint too
+            with override_settings(ROOT_URLCONF=AsyncMeUrls):
+                self.assertNotEqual(schema_fingerprint(), fingerprint)
+
+    def test_etag_returns_not_modified(self):
+        etag = self.client.get('/swagger.yaml')['ETag']
+        response = self.client.get('/swagger.yaml', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        call_command('build_openapi_schema', stdout=io.StringIO())
+        os.utime(os.path.join(self.dir.name, 'swagger.yaml'), ns=(0, 0))
+        response = self.client.get('/swagger.yaml', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_ui_pages_load_the_prebuilt_spec(self):
+        with mock.patch('authcore.schema.generate_schema') as generate:
+            for url in ('/swagger/', '/redoc/'):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn('/swagger.json', response.content.decode())
+        generate.assert_not_called()
@@ -1,10 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from .views import RegisterView, Meview
+from .views import RegisterView, Meview, AsyncMeview
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('me/', Meview.as_view(), name='me'),
+    path('me/', AsyncMeview.as_view() if getattr(settings, 'ASYNC_ME_VIEW', False) else Meview.as_view(), name='me'),
 ]
\ No newline at end of file
@@ -5,6 +5,13 @@ from rest_framework import status
 from .serializers import RegisterSerializer, MeSerializer
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from django.http import HttpResponseNotModified, JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException, NotAuthenticated
+from authcore.http import make_etag, etag_matches, not_modified, with_etag
+from authentication.authentication import AsyncJWTAuthentication
+from rbac.cache import aget_rbac_version, get_rbac_version
+from rbac.services import aget_user_rbac_summary
 
 
 class RegisterView(generics.CreateAPIView):
@@ -23,8 +30,66 @@ class RegisterView(generics.CreateAPIView):
 
 class Meview(APIView):
     permission_classes = [IsAuthenticated] # only authenticated users may acces
+    # safe requests may read from a replica (authcore.db)
+    replica_reads = True
 
     def get(self, request):
-        serializer = MeSerializer(request.user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        user = request.user
+        # everything the response depends on, so a match skips serialization
+        etag = make_etag(
+            'me', user.pk, user.email, user.first_name, user.last_name,
+            user.is_superuser, get_rbac_version()
+        )
+        if etag_matches(request, etag):
+            return not_modified(etag)
 
+        serializer = MeSerializer(user)
+        return with_etag(Response(serializer.data, status=status.HTTP_200_OK), etag)
+
+
+
+class AsyncMeview(View):
+    """
+    async /me for ASGI deployments: same payload, ETag and error bodies as
+    Meview, with authentication, cache and database reads done without a
+    thread per request. Routed instead of Meview when ASYNC_ME_VIEW is set.
+    """
+    authentication_class = AsyncJWTAuthentication
+    replica_reads = True
+
+    def error(self, exc, authenticator):
+        detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = JsonResponse(detail, status=status.HTTP_401_UNAUTHORIZED, safe=False)
+        response['WWW-Authenticate'] = authenticator.authenticate_header(self.request)
+        return response
+
+    async def get(self, request):
+        authenticator = self.authentication_class()
+        try:
+            auth = await authenticator.aauthenticate(request)
+            if auth is None:
+                raise NotAuthenticated()
+        except APIException as exc:
+            return self.error(exc, authenticator)
+        user, request.auth = auth
+        request.user = user
+
+        etag = make_etag(
+            'me', user.pk, user.email, user.first_name, user.last_name,
+            user.is_superuser, await aget_rbac_version()
+        )
+        if etag_matches(request, etag):
+            return with_etag(HttpResponseNotModified(), etag)
+
+        summary = await aget_user_rbac_summary(user)
+        # field order of MeSerializer
+        data = {
+            'id': str(user.id),
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'roles': summary['roles'],
+            'is_superuser': user.is_superuser,
+            'permissions': summary['permissions'],
+        }
+        return with_etag(JsonResponse(data), etag)